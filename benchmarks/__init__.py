@@ -0,0 +1,3 @@
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+""" Benchmarks of session orchestration, see benchmarks/__main__.py. """
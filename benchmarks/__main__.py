@@ -0,0 +1,180 @@
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+import argparse
+import concurrent.futures
+import json
+import resource
+import shutil
+import statistics
+import sys
+import threading
+import time
+
+from benchmarks import host
+import tools.config
+from tools import helpers
+from tools.actions import container_manager
+
+""" Usage: python3 -m benchmarks [-n SESSIONS] [-r REPEAT] [-j JOBS] [--json]
+
+    Runs every operation for 1..SESSIONS sessions and prints per operation:
+
+    ms:       median wall time of the operation over all sessions
+    spawns:   processes started by waydroid (subprocess.Popen audit events),
+              not counting what the shims or the network script fork
+    syscalls: read and write class syscalls of the benchmark process from
+              /proc/self/io, the forked tools are not included
+    cpu ms:   user and system time of the benchmark process and its reaped
+              children """
+
+OPERATIONS = ["lxc_config", "make_prop", "start", "get_session", "freeze",
+              "unfreeze", "stop"]
+
+spawn_lock = threading.Lock()
+spawns = 0
+
+
+def audit(event, hook_args):
+    global spawns
+    if event == "subprocess.Popen":
+        with spawn_lock:
+            spawns += 1
+
+
+def syscalls():
+    try:
+        with open("/proc/self/io") as handle:
+            io = dict(line.split(": ") for line in handle.read().splitlines())
+        return int(io["syscr"]) + int(io["syscw"])
+    except (OSError, KeyError, ValueError):
+        return 0
+
+
+def cpu_time():
+    ret = 0
+    for who in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]:
+        usage = resource.getrusage(who)
+        ret += usage.ru_utime + usage.ru_stime
+    return ret
+
+
+def measure(work):
+    before = (time.monotonic(), spawns, syscalls(), cpu_time())
+    work()
+    after = (time.monotonic(), spawns, syscalls(), cpu_time())
+    return {"ms": (after[0] - before[0]) * 1000,
+            "spawns": after[1] - before[1],
+            "syscalls": after[2] - before[2],
+            "cpu_ms": (after[3] - before[3]) * 1000}
+
+
+def run_all(jobs, work, items):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        for future in [pool.submit(work, item) for item in items]:
+            future.result()
+
+
+def operations(args, manager, sessions, jobs):
+    def lxc_config():
+        for session_id, session in sessions.items():
+            session_args = host.session_args(args, session_id)
+            session_args.vendor_type = tools.config.load(session_args)["waydroid"]["vendor_type"]
+            helpers.drivers.loadBinderNodes(session_args)
+            helpers.lxc.set_lxc_config(session_args)
+            helpers.lxc.generate_session_lxc_config(session_args, session)
+
+    def make_prop():
+        for session_id, session in sessions.items():
+            session_args = host.session_args(args, session_id)
+            helpers.images.make_prop(session_args, session, tools.config.defaults(
+                session_args, "work") + "/waydroid.prop")
+
+    def start():
+        def start_one(session_id):
+            session_args = host.session_args(args, session_id)
+            helpers.drivers.loadBinderNodes(session_args)
+            container_manager.do_start(session_args, sessions[session_id])
+        run_all(jobs, start_one, sessions)
+
+    def get_session():
+        manager.sessions = {session_id: dict(session) for session_id, session in sessions.items()}
+        for session_id in sessions:
+            manager.GetSession(session_id)
+
+    def freeze():
+        for session_id in sessions:
+            container_manager.freeze(host.session_args(args, session_id))
+
+    def unfreeze():
+        for session_id in sessions:
+            container_manager.unfreeze(host.session_args(args, session_id))
+
+    def stop():
+        run_all(jobs, lambda session_id: container_manager.stop(
+            host.session_args(args, session_id), False), sessions)
+
+    return {"lxc_config": lxc_config, "make_prop": make_prop, "start": start,
+            "get_session": get_session, "freeze": freeze, "unfreeze": unfreeze,
+            "stop": stop}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python3 -m benchmarks",
+                                     description="Benchmark session orchestration against fake host tools")
+    parser.add_argument("-n", "--sessions", type=int, default=4,
+                        help="measure 1..SESSIONS sessions (default: 4)")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="runs per session count (default: 3)")
+    parser.add_argument("-j", "--jobs", type=int, default=4,
+                        help="sessions started and stopped at the same time (default: 4)")
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the fake host directory")
+    bench = parser.parse_args()
+
+    sys.addaudithook(audit)
+    args = host.setup()
+    # Only GetSession goes through the service object, it is never exported
+    manager = container_manager.DbusContainerManager(None, None, None, args)
+
+    results = []
+    try:
+        for count in range(1, bench.sessions + 1):
+            sessions = {session_id: host.session(args, session_id) for session_id in range(count)}
+            runs = {name: [] for name in OPERATIONS}
+            for _ in range(bench.repeat):
+                ops = operations(args, manager, sessions, bench.jobs)
+                for name in OPERATIONS:
+                    runs[name].append(measure(ops[name]))
+            for name in OPERATIONS:
+                results.append({
+                    "sessions": count,
+                    "operation": name,
+                    "ms": statistics.median(run["ms"] for run in runs[name]),
+                    "ms_per_session": statistics.median(run["ms"] for run in runs[name]) / count,
+                    "spawns": statistics.median(run["spawns"] for run in runs[name]),
+                    "syscalls": statistics.median(run["syscalls"] for run in runs[name]),
+                    "cpu_ms": statistics.median(run["cpu_ms"] for run in runs[name]),
+                })
+    finally:
+        manager.executor.shutdown(wait=False)
+        if bench.keep:
+            print("Fake host kept in " + args.bench_root, file=sys.stderr)
+        else:
+            shutil.rmtree(args.bench_root, ignore_errors=True)
+
+    if bench.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    print("{:>8}  {:<12} {:>10} {:>12} {:>7} {:>9} {:>8}".format(
+        "sessions", "operation", "ms", "ms/session", "spawns", "syscalls", "cpu ms"))
+    for r in results:
+        print("{:>8}  {:<12} {:>10.1f} {:>12.1f} {:>7.0f} {:>9.0f} {:>8.1f}".format(
+            r["sessions"], r["operation"], r["ms"], r["ms_per_session"], r["spawns"],
+            r["syscalls"], r["cpu_ms"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
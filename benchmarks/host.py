@@ -0,0 +1,115 @@
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+import argparse
+import copy
+import os
+import shutil
+import tempfile
+import tools.config
+import tools.helpers.logging
+import tools.helpers.mount
+
+""" A fake host for the benchmarks: a temporary directory holding the work
+    dir, the images, the container states and a mount table, plus a PATH
+    entry where the host tools are replaced by benchmarks/shim.py. """
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+
+TOOLS = ["lxc-info", "lxc-start", "lxc-wait", "lxc-stop", "lxc-freeze",
+         "lxc-unfreeze", "lxc-attach", "mount", "umount", "aa-enabled",
+         "systemctl", "ip", "nft", "dnsmasq", "iptables", "iptables-legacy",
+         "modprobe", "chmod"]
+
+BASE_PROPS = ["ro.product.brand=waydroid",
+              "ro.product.device=bench",
+              "ro.hardware.gralloc=default",
+              "ro.hardware.egl=mesa",
+              "ro.vendor.extra_feature=0"]
+
+
+def setup(root=None):
+    """
+    Create the fake host and point waydroid at it. This changes the process
+    wide defaults of tools.config, so only do it in a benchmark process.
+
+    :returns: args like tools.main() builds them, for session 0
+    """
+    # The prefix must not contain "/waydroid", see tools.config.defaults()
+    root = root or tempfile.mkdtemp(prefix="wd-bench-")
+    work = root + "/waydroid"
+    for path in ["/bin", "/src/data/scripts", "/states", "/xdg", "/images"]:
+        os.makedirs(root + path, exist_ok=True)
+    open(root + "/mounts", "a").close()
+
+    for tool in TOOLS:
+        link = root + "/bin/" + tool
+        if not os.path.lexists(link):
+            os.symlink(HERE + "/shim.py", link)
+    os.environ["PATH"] = root + "/bin:" + os.environ.get("PATH", "")
+    os.environ["WAYDROID_BENCH_ROOT"] = root
+
+    # LXC configs come from the tree, networking from the fake script
+    configs = root + "/src/data/configs"
+    if not os.path.lexists(configs):
+        os.symlink(tools.config.tools_src + "/data/configs", configs)
+    shutil.copy(HERE + "/waydroid-net.sh", root + "/src/data/scripts/waydroid-net.sh")
+    tools.config.tools_src = root + "/src"
+    tools.helpers.mount.PROC_MOUNTS = root + "/mounts"
+
+    for key, value in tools.config._defaults.items():
+        if isinstance(value, str) and value.startswith("/var/lib/waydroid"):
+            tools.config._defaults[key] = work + value[len("/var/lib/waydroid"):]
+    tools.config._defaults["container_xdg_runtime_dir"] = root + "/container_xdg"
+    tools.config._defaults["container_pulse_runtime_path"] = root + "/container_xdg/pulse"
+
+    for image in ["system.img", "vendor.img"]:
+        open(root + "/images/" + image, "a").close()
+
+    args = argparse.Namespace(
+        action="container", subaction="start", session_id=0, cache={},
+        work_root=work, config=work + "/waydroid.cfg", log=root + "/waydroid.log",
+        sudo_timer=False, timeout=1800, details_to_stdout=False, verbose=False,
+        quiet=True, bench_root=root)
+    os.makedirs(work, exist_ok=True)
+    tools.helpers.logging.init(args)
+
+    cfg = tools.config.load(args)
+    cfg["waydroid"].update({
+        "images_path": root + "/images",
+        "vendor_type": "MAINLINE",
+        "mount_overlays": "True",
+        "lxc_backend": "cli",
+        "binder": "anbox-binder",
+        "vndbinder": "anbox-vndbinder",
+        "hwbinder": "anbox-hwbinder",
+    })
+    tools.config.save(args, cfg)
+    return args
+
+
+def session_args(args, session_id):
+    args = copy.copy(args)
+    args.session_id = session_id
+    return args
+
+
+def session(args, session_id):
+    """
+    Prepare the work dir of a session and return its session dict, like
+    "waydroid session start" would send it.
+    """
+    args = session_args(args, session_id)
+    work = tools.config.defaults(args, "work")
+    os.makedirs(work, exist_ok=True)
+    with open(work + "/waydroid_base.prop", "w") as handle:
+        handle.write("".join(prop + "\n" for prop in BASE_PROPS))
+
+    ret = tools.config.session_defaults(args)
+    ret.update({
+        "xdg_runtime_dir": args.bench_root + "/xdg",
+        "wayland_display": "wayland-{}".format(session_id),
+        "pulse_runtime_path": args.bench_root + "/xdg/pulse",
+        "waydroid_data": "{}/data/session_{}".format(args.bench_root, session_id),
+    })
+    os.makedirs(ret["waydroid_data"], exist_ok=True)
+    return ret
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+import fcntl
+import os
+import sys
+import time
+
+""" Stand-in for the host tools waydroid runs. The benchmark links this file
+    under the name of every tool into a directory at the front of PATH, the
+    name it was called by picks the behaviour. Container states are plain
+    files and mounts are lines in a fake mount table, both below
+    $WAYDROID_BENCH_ROOT, so nothing needs root. """
+
+ROOT = os.environ["WAYDROID_BENCH_ROOT"]
+STATES = ROOT + "/states"
+MOUNTS = ROOT + "/mounts"
+
+
+def option(argv, name, default=None):
+    if name in argv and argv.index(name) + 1 < len(argv):
+        return argv[argv.index(name) + 1]
+    return default
+
+
+def state_path(argv):
+    return os.path.join(STATES, option(argv, "-n", "waydroid"))
+
+
+def get_state(argv):
+    try:
+        with open(state_path(argv)) as handle:
+            return handle.read().strip() or "STOPPED"
+    except FileNotFoundError:
+        return "STOPPED"
+
+
+def set_state(argv, state):
+    os.makedirs(STATES, exist_ok=True)
+    path = state_path(argv)
+    with open(path + ".tmp", "w") as handle:
+        handle.write(state + "\n")
+    os.replace(path + ".tmp", path)
+
+
+def lxc_info(argv):
+    if "--version" in argv:
+        print("5.0.0")
+    elif "-sH" in argv:
+        print(get_state(argv))
+    else:
+        # No init pid, waydroid then waits for states instead of cgroups
+        return 1
+    return 0
+
+
+def lxc_start(argv):
+    set_state(argv, "RUNNING")
+    # Behave like "lxc-start -F": run until the container gets stopped
+    while get_state(argv) != "STOPPED":
+        time.sleep(0.01)
+    return 0
+
+
+def lxc_wait(argv):
+    state = option(argv, "-s")
+    # lxc-wait only takes whole seconds
+    deadline = time.monotonic() + int(option(argv, "-t", "10"))
+    while get_state(argv) != state:
+        if time.monotonic() > deadline:
+            return 1
+        time.sleep(0.002)
+    return 0
+
+
+def lxc_attach(argv):
+    command = argv[argv.index("--") + 1:] if "--" in argv else []
+    if command and os.path.basename(command[0]) == "getprop":
+        if command[1:] == ["sys.boot_completed"]:
+            print("1")
+    return 0
+
+
+def update_mounts(change):
+    with open(MOUNTS, "a+") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        handle.seek(0)
+        lines = change(handle.read().splitlines())
+        handle.seek(0)
+        handle.truncate()
+        handle.write("".join(line + "\n" for line in lines))
+
+
+def mount(argv):
+    if any(arg.startswith("--make-") for arg in argv):
+        return 0
+    source, destination = argv[-2], os.path.realpath(argv[-1])
+    if not os.path.exists(destination):
+        print("mount: {}: mount point does not exist.".format(destination))
+        return 32
+    line = "{} {} {} {} 0 0".format(source, destination, option(argv, "-t", "none"),
+                                    option(argv, "-o", "rw"))
+    update_mounts(lambda lines: lines + [line])
+    return 0
+
+
+def umount(argv):
+    destination = os.path.realpath(argv[-1])
+    found = []
+    def change(lines):
+        for i in reversed(range(len(lines))):
+            if lines[i].split()[1] == destination:
+                found.append(lines.pop(i))
+                break
+        return lines
+    update_mounts(change)
+    if not found:
+        print("umount: {}: not mounted.".format(destination))
+        return 32
+    return 0
+
+
+TOOLS = {
+    "lxc-info": lxc_info,
+    "lxc-start": lxc_start,
+    "lxc-wait": lxc_wait,
+    "lxc-stop": lambda argv: set_state(argv, "STOPPED"),
+    "lxc-freeze": lambda argv: set_state(argv, "FROZEN"),
+    "lxc-unfreeze": lambda argv: set_state(argv, "RUNNING"),
+    "lxc-attach": lxc_attach,
+    "mount": mount,
+    "umount": umount,
+    # Pretend AppArmor is off, so the LXC config stays unconfined
+    "aa-enabled": lambda argv: 1,
+    "systemctl": lambda argv: 1,
+}
+
+
+if __name__ == "__main__":
+    tool = os.path.basename(sys.argv[0])
+    # Everything else (ip, nft, dnsmasq, modprobe, chmod...) does nothing
+    sys.exit(TOOLS.get(tool, lambda argv: 0)(sys.argv[1:]) or 0)
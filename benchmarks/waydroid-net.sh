@@ -0,0 +1,52 @@
+#!/bin/sh -
+# Stand-in for data/scripts/waydroid-net.sh. It forks the same kind of tools
+# per session (the shims on the benchmark PATH), but never touches /proc/sys
+# or the real network configuration.
+
+SESSION_ID="0"
+
+while [ $# -gt 0 ]; do
+    case "$1" in
+        --sid)
+            SESSION_ID="$2"
+            shift 2
+            ;;
+        start|stop)
+            COMMAND="$1"
+            shift
+            ;;
+        *)
+            echo "Unknown argument: $1"
+            exit 1
+            ;;
+    esac
+done
+
+VNIC="waydroid$SESSION_ID"
+varrun="$WAYDROID_BENCH_ROOT/run/session_$SESSION_ID"
+LXC_ADDR="192.168.$((100 + SESSION_ID)).1"
+LXC_NETWORK="192.168.$((100 + SESSION_ID)).0/24"
+
+case "$COMMAND" in
+    start)
+        lxc-info --version > /dev/null
+        ip link add dev "$VNIC" type bridge
+        ip addr add "$LXC_ADDR/255.255.255.0" broadcast + dev "$VNIC"
+        ip link set dev "$VNIC" address "00:16:3e:00:00:$(printf '%02x' "$SESSION_ID")"
+        ip link set dev "$VNIC" up
+        nft add table ip "lxc_$VNIC"
+        nft add chain ip "lxc_$VNIC" postrouting
+        nft add rule ip "lxc_$VNIC" postrouting ip saddr "$LXC_NETWORK" counter masquerade
+        mkdir -p "$varrun"
+        dnsmasq --strict-order --bind-interfaces --pid-file="$varrun/dnsmasq.pid" \
+            --listen-address "$LXC_ADDR" --interface="$VNIC"
+        touch "$varrun/network_up"
+        ;;
+    stop)
+        [ -f "$varrun/network_up" ] || exit 0
+        ip link set dev "$VNIC" down
+        nft delete table ip "lxc_$VNIC"
+        ip link delete "$VNIC"
+        rm -f "$varrun/network_up" "$varrun/dnsmasq.pid"
+        ;;
+esac
@@ -26,7 +26,7 @@ varrun="/run/waydroid-lxc/session_$SESSION_ID"
 varlib="/var/lib"
 net_link_key="lxc.net.0.link"
 case "$(lxc-info --version)" in [012].*) net_link_key="lxc.network.link" ;; esac
-vnic=$(awk "\$1 == \"$net_link_key\" {print \$3}" /var/lib/waydroid/session_$SESSION_ID/lxc/waydroid/config)
+vnic=$(awk "\$1 == \"$net_link_key\" {print \$3}" /var/lib/waydroid/session_$SESSION_ID/lxc/waydroid-$SESSION_ID/config)
 : ${vnic:=waydroid0}
 
 if [ "$vnic" != "$VNIC" ]; then
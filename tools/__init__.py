@@ -70,6 +70,12 @@ def main():
                 actions.session_manager.start(args)
             elif args.subaction == "stop":
                 actions.session_manager.stop(args)
+            elif args.subaction == "template":
+                actions.session_manager.template(args)
+            elif args.subaction == "publish-apps":
+                actions.session_manager.publish_apps(args)
+            elif args.subaction in ["add", "remove", "list", "claim", "release"]:
+                return actions.session_manager.scale(args)
             else:
                 logging.info(
                     "Run waydroid {} -h for usage information.".format(args.action))
@@ -91,6 +97,8 @@ def main():
                 actions.container_manager.freeze(args)
             elif args.subaction == "unfreeze":
                 actions.container_manager.unfreeze(args)
+            elif args.subaction == "checkpoint":
+                actions.container_manager.checkpoint(args)
             else:
                 logging.info(
                     "Run waydroid {} -h for usage information.".format(args.action))
@@ -131,6 +139,10 @@ def main():
         elif args.action == "status":
             actions.status.print_status(args)
         elif args.action == "log":
+            if args.trace is not None:
+                args.session_id = args.trace
+                print("\n".join(helpers.trace.summary(args)))
+                return 0
             if args.clear_log:
                 helpers.run.user(args, ["truncate", "-s", "0", args.log])
             try:
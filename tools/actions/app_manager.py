@@ -5,6 +5,7 @@ import os
 import shutil
 import time
 import tools.config
+import tools.helpers.ephemeral
 import tools.helpers.props
 import tools.helpers.ipc
 from tools.interfaces import IPlatform
@@ -20,7 +21,7 @@ def install(args):
         if session["state"] == "FROZEN":
             cm.Unfreeze(args.session_id)
 
-        tmp_dir = tools.config.session_defaults(args, "waydroid_data") + "/waydroid_tmp"
+        tmp_dir = tools.helpers.ephemeral.host_data(args, session) + "/waydroid_tmp"
         if not os.path.exists(tmp_dir):
             os.makedirs(tmp_dir)
 
@@ -66,7 +67,13 @@ def maybeLaunchLater(args, launchNow):
             tools.helpers.ipc.DBusContainerService().Unfreeze(args.session_id)
         except:
             logging.error("Failed to unfreeze container. Trying to launch anyways...")
+        try:
+            if not tools.helpers.ipc.wait_for_ready(args.session_id):
+                logging.warning("Android did not finish booting. Trying to launch anyways...")
+        except dbus.DBusException as e:
+            logging.debug(f"Cannot wait for the session to be ready: {e}")
         launchNow()
+        tools.helpers.ipc.notify_activity(args.session_id)
     except dbus.DBusException:
         logging.error("Starting waydroid session")
         tools.actions.session_manager.start(args, launchNow, background=False)
@@ -2,12 +2,17 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 from shutil import which
 import logging
+import math
 import os
 import time
 import glob
 import signal
 import sys
 import uuid
+import copy
+import functools
+import threading
+import concurrent.futures
 import tools.config
 from tools import helpers
 from tools import services
@@ -16,17 +21,121 @@ import dbus.service
 import dbus.exceptions
 from gi.repository import GLib
 
+# Threads running the blocking parts of D-Bus methods
+WORKERS = 16
+# Sessions torn down at the same time by StopAll
+STOP_WORKERS = 32
+# Time a killed container gets to reach STOPPED
+KILL_TIMEOUT = 5
+# Pause between attempts to umount busy mounts before the stop deadline
+UMOUNT_RETRY = 0.5
+
 class DbusContainerManager(dbus.service.Object):
     def __init__(self, looper, bus, object_path, args):
         self.args = args
         self.looper = looper
         self.sessions = {}
+        self.container_pids = {}
+        self.placements = {}
+        self.placement_lock = threading.Lock()
+        self.pool = services.ContainerPool(self)
+        self.watchdog = services.SessionWatchdog(self)
+        self.idle = services.IdleFreezer(self)
+        self.readiness = services.SessionReadiness(self)
+        self.admission = services.AdmissionControl(self)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS)
+        self.busy = set()
+        helpers.metrics.add_collector(self.session_usage)
         dbus.service.Object.__init__(self, bus, object_path)
 
-    @dbus.service.method("id.waydro.ContainerManager", in_signature='ia{ss}', out_signature='i', sender_keyword="sender", connection_keyword="conn")
-    def Start(self, session_id, session, sender, conn):
-        self.args.session_id = session_id
-
+    def session_args(self, session_id):
+        # Private copy of args, so sessions can be handled concurrently
+        args = copy.copy(self.args)
+        args.session_id = session_id
+        return args
+
+    def start_session(self, args, session):
+        start = time.monotonic()
+        self.place(args, session)
+        # Prefer a frozen container of the warm pool over a cold start
+        pooled = self.pool.take(args, session)
+        how = "pool" if pooled else "cold"
+        try:
+            if pooled:
+                self.admission.hold(args.session_id)
+                placement = {key: session[key] for key in ["cpuset_cpus", "cpuset_mems"]
+                             if session[key]}
+                if placement:
+                    helpers.lxc.set_resources(args, placement)
+            else:
+                # Normally admitted while queued by queue_start already
+                reason = self.admission.try_admit(args.session_id)
+                if reason is not None:
+                    raise services.NoCapacityError(f"No capacity for session {args.session_id}: {reason}")
+                do_start(args, session)
+        except:
+            self.admission.release(args.session_id)
+            helpers.metrics.inc("waydroid_session_starts_total", how=how, result="error")
+            raise
+        helpers.metrics.inc("waydroid_session_starts_total", how=how, result="ok")
+        helpers.metrics.observe("waydroid_session_start_seconds", time.monotonic() - start, how=how)
+        self.container_pids[args.session_id] = args.container_pid
+        self.watchdog.watch(args.session_id, args.container_pid, check_boot=not pooled)
+        self.readiness.watch(args.session_id)
+        self.pool.remember(args, session)
+        return session
+
+    def place(self, args, session):
+        """
+        Pick CPUs and memory nodes for a session according to the
+        placement_policy from waydroid.cfg and store them in the session.
+        """
+        cfg = tools.config.load(args)
+        with self.placement_lock:
+            used = [cpus for session_id, cpus in self.placements.items()
+                    if session_id != args.session_id]
+            cpus, mems = helpers.topology.place(cfg["waydroid"]["placement_policy"],
+                                                int(cfg["waydroid"]["placement_cpus"]), used)
+            self.placements[args.session_id] = cpus
+        session["cpuset_cpus"] = helpers.topology.format_cpulist(cpus)
+        session["cpuset_mems"] = helpers.topology.format_cpulist(mems)
+        if cpus:
+            logging.info(f"Placing session {args.session_id} on CPUs {session['cpuset_cpus']}, memory nodes {session['cpuset_mems']}")
+
+    def drop_session(self, session_id):
+        self.admission.release(session_id)
+        self.placements.pop(session_id, None)
+        self.sessions.pop(session_id, None)
+        self.container_pids.pop(session_id, None)
+        self.save_sessions()
+
+    def save_sessions(self):
+        entries = {session_id: helpers.registry.entry(self.session_args(session_id), session,
+                                                      self.container_pids.get(session_id))
+                   for session_id, session in self.sessions.items()}
+        helpers.registry.save(self.args, entries)
+
+    def reattach(self):
+        """
+        Pick up the sessions of a previous instance of the service from the
+        session registry, and clean up the ones whose container is gone.
+        """
+        alive, dead = helpers.registry.reconcile(self.args, helpers.registry.load(self.args))
+        for session_id in dead:
+            stop(self.session_args(session_id), False)
+        for session_id, item in alive.items():
+            self.sessions[session_id] = item["session"]
+            self.container_pids[session_id] = item["container_pid"]
+            self.admission.hold(session_id)
+            self.placements[session_id] = helpers.topology.parse_cpulist(
+                item["session"].get("cpuset_cpus", ""))
+            if item["container_pid"]:
+                self.watchdog.watch(session_id, item["container_pid"], check_boot=False)
+            self.readiness.watch(session_id)
+            logging.info(f"Reattached session {session_id}")
+        self.save_sessions()
+
+    def check_caller(self, session, sender, conn):
         dbus_info = dbus.Interface(conn.get_object("org.freedesktop.DBus", "/org/freedesktop/DBus/Bus", False), "org.freedesktop.DBus")
         uid = dbus_info.GetConnectionUnixUser(sender)
         if str(uid) not in ["0", session["user_id"]]:
@@ -34,48 +143,416 @@ class DbusContainerManager(dbus.service.Object):
         pid = dbus_info.GetConnectionUnixProcessID(sender)
         if str(uid) != "0" and str(pid) != session["pid"]:
             raise RuntimeError("Invalid session pid")
-        
-        if session_id in self.sessions:
-            raise RuntimeError(f"Already tracking a session {session_id}")
-        
-        self.sessions[session_id] = do_start(self.args, session)
-        return self.args.container_pid
-
-    @dbus.service.method("id.waydro.ContainerManager", in_signature='ib', out_signature='')
-    def Stop(self, session_id, quit_session):
-        if session_id in self.sessions:
-            self.args.session_id = session_id
-            stop(self.args, quit_session)
-            self.args.session = self.sessions.pop(session_id)
-
-    @dbus.service.method("id.waydro.ContainerManager", in_signature='b', out_signature='')
-    def StopAll(self, quit_session):
+
+    def check_user(self, sender, conn, user_id=None):
+        """
+        :param user_id: user the caller must be, root is always allowed
+        :returns: user id of the caller
+        """
+        dbus_info = dbus.Interface(conn.get_object("org.freedesktop.DBus", "/org/freedesktop/DBus/Bus", False), "org.freedesktop.DBus")
+        uid = str(dbus_info.GetConnectionUnixUser(sender))
+        if user_id is not None and uid not in ["0", user_id]:
+            raise RuntimeError("Not allowed for another user")
+        return uid
+
+    def run_async(self, session_ids, work, done, reply, error):
+        """
+        Run the blocking part of a D-Bus method on the worker pool and reply
+        from the main loop once it is done, so other clients are served in
+        the meantime. Only one such call may work on a session at a time.
+
+        :param work: called on a worker thread
+        :param done: called on the main loop with the result of work, its
+                     return value is the reply (None for no reply value)
+        """
+        try:
+            self.check_busy(session_ids)
+        except RuntimeError as e:
+            error(e)
+            return
+        self.busy.update(session_ids)
+        future = self.executor.submit(work)
+
+        def finish():
+            self.busy.difference_update(session_ids)
+            try:
+                result = done(future.result())
+            except Exception as e:
+                error(e)
+                return False
+            if result is None:
+                reply()
+            else:
+                reply(result)
+            return False
+        future.add_done_callback(lambda f: GLib.idle_add(finish))
+
+    def check_busy(self, session_ids):
+        busy = [session_id for session_id in session_ids if session_id in self.busy]
+        if busy:
+            raise RuntimeError(f"Session {busy[0]} is busy")
+
+    def queue_start(self, session_id, start, error):
+        """
+        Wait for admission control to let a session start, without holding
+        a worker thread. The session counts as busy while it waits.
+
+        :param start: called on the main loop once the session is admitted
+        """
+        self.busy.add(session_id)
+        def admitted():
+            self.busy.discard(session_id)
+            start()
+        def rejected(e):
+            self.busy.discard(session_id)
+            error(e)
+        self.admission.admit(session_id, admitted, rejected)
+
+    @dbus.service.method("id.waydro.ContainerManager", in_signature='ia{ss}', out_signature='i', sender_keyword="sender", connection_keyword="conn", async_callbacks=("reply", "error"))
+    def Start(self, session_id, session, sender, conn, reply, error):
+        try:
+            self.check_caller(session, sender, conn)
+            if session_id in self.sessions:
+                raise RuntimeError(f"Already tracking a session {session_id}")
+            if session_id in self.busy:
+                raise RuntimeError(f"Session {session_id} is busy")
+        except RuntimeError as e:
+            error(e)
+            return
+
+        args = self.session_args(session_id)
+        def done(session):
+            self.sessions[session_id] = session
+            self.save_sessions()
+            self.pool.refill()
+            return args.container_pid
+        self.queue_start(session_id, lambda: self.run_async(
+            [session_id], lambda: self.start_session(args, session), done, reply, error), error)
+
+    @dbus.service.method("id.waydro.ContainerManager", in_signature='a{ia{ss}}i', out_signature='a{is}', sender_keyword="sender", connection_keyword="conn", async_callbacks=("reply", "error"))
+    def StartBatch(self, sessions, max_parallel, sender, conn, reply, error):
+        """
+        Start several sessions, running up to max_parallel of them at the
+        same time (0 uses start_concurrency from waydroid.cfg).
+
+        :returns: dict of session id to error message ("" on success)
+        """
+        if max_parallel <= 0:
+            cfg = tools.config.load(self.args)
+            max_parallel = int(cfg["waydroid"]["start_concurrency"])
+
+        results = {}
+        pending = {}
+        for session_id, session in sessions.items():
+            session_id = int(session_id)
+            try:
+                self.check_caller(session, sender, conn)
+                if session_id in self.sessions:
+                    raise RuntimeError(f"Already tracking a session {session_id}")
+                if session_id in self.busy:
+                    raise RuntimeError(f"Session {session_id} is busy")
+            except RuntimeError as e:
+                results[session_id] = str(e)
+                continue
+            pending[session_id] = session
+
+        # Sessions are admitted and started one by one, so a session that
+        # waits for room doesn't hold back the ones before it. Until their
+        # turn comes they are busy, so no Start can take them meanwhile
+        order = list(pending)
+        self.busy.update(order)
+        active = set()
+        logging.info(f"Starting sessions {sorted(pending)}, {max_parallel} at a time")
+
+        def next_start():
+            while order and len(active) < max(1, max_parallel):
+                session_id = order.pop(0)
+                active.add(session_id)
+                self.queue_start(session_id, functools.partial(start, session_id),
+                                 functools.partial(failed, session_id))
+            if not order and not active:
+                self.save_sessions()
+                self.pool.refill()
+                reply(results)
+
+        def start(session_id):
+            args = self.session_args(session_id)
+            def work():
+                try:
+                    return self.start_session(args, pending[session_id])
+                except:
+                    self.placements.pop(session_id, None)
+                    stop(args, False)
+                    raise
+            def done(session):
+                self.sessions[session_id] = session
+                results[session_id] = ""
+            def started():
+                active.discard(session_id)
+                next_start()
+            self.run_async([session_id], work, done, started,
+                           functools.partial(failed, session_id))
+
+        def failed(session_id, e):
+            logging.error(f"Failed to start session {session_id}: {e}")
+            results[session_id] = str(e) or type(e).__name__
+            active.discard(session_id)
+            next_start()
+
+        next_start()
+
+    def stop_args(self, session_id):
+        """
+        Prepare stopping a session, which is no longer watched afterwards.
+        Check that the session isn't busy first.
+        """
+        self.watchdog.forget(session_id)
+        self.idle.forget(session_id)
+        self.readiness.forget(session_id)
+        args = self.session_args(session_id)
+        args.session = self.sessions[session_id]
+        return args
+
+    @dbus.service.method("id.waydro.ContainerManager", in_signature='ib', out_signature='', async_callbacks=("reply", "error"))
+    def Stop(self, session_id, quit_session, reply, error):
+        if session_id not in self.sessions:
+            reply()
+            return
+        try:
+            self.check_busy([session_id])
+        except RuntimeError as e:
+            error(e)
+            return
+        args = self.stop_args(session_id)
+        def done(result):
+            self.drop_session(session_id)
+            self.pool.refill()
+        self.run_async([session_id], lambda: stop(args, quit_session), done, reply, error)
+
+    def stop_all(self, quit_session):
+        """
+        Stop all sessions, blocking the caller. See StopAll for D-Bus.
+        """
         logging.info("Stopping all containers")
-        for session_id in list(self.sessions.keys()):
-            logging.info(f"Stopping session {session_id}")
-            self.args.session_id = session_id   
-            stop(self.args, quit_session)
-            self.args.session = self.sessions.pop(session_id)
+        session_ids = list(self.sessions.keys())
+        stop_many([self.stop_args(session_id) for session_id in session_ids], quit_session)
+        for session_id in session_ids:
+            self.drop_session(session_id)
 
-    @dbus.service.method("id.waydro.ContainerManager", in_signature='i', out_signature='')
-    def Freeze(self, session_id):
-        self.args.session_id = session_id
-        self.args.session = self.sessions[session_id]
-        freeze(self.args)
+    @dbus.service.method("id.waydro.ContainerManager", in_signature='b', out_signature='', async_callbacks=("reply", "error"))
+    def StopAll(self, quit_session, reply, error):
+        logging.info("Stopping all containers")
+        session_ids = list(self.sessions.keys())
+        try:
+            self.check_busy(session_ids)
+        except RuntimeError as e:
+            error(e)
+            return
+        stopping = [self.stop_args(session_id) for session_id in session_ids]
+        def work():
+            stop_many(stopping, quit_session)
+        def done(result):
+            for session_id in session_ids:
+                self.drop_session(session_id)
+        self.run_async(session_ids, work, done, reply, error)
+
+    @dbus.service.signal("id.waydro.ContainerManager", signature='iss')
+    def SessionFailed(self, session_id, reason, action):
+        """
+        Emitted when the container of a session exits or hangs while booting.
+
+        :param action: "restarting" or "stopped" once restart_limit is reached
+        """
+        pass
+
+    @dbus.service.signal("id.waydro.ContainerManager", signature='i')
+    def SessionReady(self, session_id):
+        """
+        Emitted once Android in a session has finished booting and its
+        platform service is available.
+        """
+        pass
+
+    @dbus.service.method("id.waydro.ContainerManager", in_signature='i', out_signature='b')
+    def IsReady(self, session_id):
+        return self.readiness.is_ready(session_id)
+
+    @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature='ss', out_signature='v')
+    def Get(self, interface, prop):
+        properties = self.GetAll(interface)
+        if prop not in properties:
+            raise dbus.exceptions.DBusException(f"No property {prop}",
+                                                name="org.freedesktop.DBus.Error.UnknownProperty")
+        return properties[prop]
+
+    @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature='s', out_signature='a{sv}')
+    def GetAll(self, interface):
+        if interface != "id.waydro.ContainerManager":
+            raise dbus.exceptions.DBusException(f"No interface {interface}",
+                                                name="org.freedesktop.DBus.Error.UnknownInterface")
+        return {"ReadySessions": dbus.Array(sorted(self.readiness.ready), signature='i')}
+
+    @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature='ssv', out_signature='')
+    def Set(self, interface, prop, value):
+        raise dbus.exceptions.DBusException(f"Property {prop} is read-only",
+                                            name="org.freedesktop.DBus.Error.PropertyReadOnly")
+
+    @dbus.service.signal(dbus.PROPERTIES_IFACE, signature='sa{sv}as')
+    def PropertiesChanged(self, interface, changed, invalidated):
+        pass
+
+    @dbus.service.method("id.waydro.ContainerManager", in_signature='i', out_signature='', async_callbacks=("reply", "error"))
+    def Freeze(self, session_id, reply, error):
+        if self.idle.skip_freeze(session_id):
+            logging.info(f"Leaving session {session_id} to the idle scheduler")
+            reply()
+            return
+        args = self.session_args(session_id)
+        args.session = self.sessions[session_id]
+        self.run_async([session_id], lambda: freeze(args), lambda result: None, reply, error)
+
+    @dbus.service.method("id.waydro.ContainerManager", in_signature='i', out_signature='', async_callbacks=("reply", "error"))
+    def Unfreeze(self, session_id, reply, error):
+        if self.idle.thaw(session_id):
+            logging.info(f"Thawing idle session {session_id}")
+        args = self.session_args(session_id)
+        args.session = self.sessions[session_id]
+        self.run_async([session_id], lambda: unfreeze(args), lambda result: None, reply, error)
+
+    @dbus.service.method("id.waydro.ContainerManager", in_signature='ia{ss}', out_signature='', sender_keyword="sender", connection_keyword="conn")
+    def SetResourceLimits(self, session_id, limits, sender, conn):
+        """
+        Change cgroup limits of a running session, e.g. {"memory_max": "4G"}.
+        They last until the container stops, waydroid.cfg sets them for good.
+        """
+        if session_id not in self.sessions:
+            raise RuntimeError(f"Not tracking a session {session_id}")
+        self.check_user(sender, conn, self.sessions[session_id]["user_id"])
+        helpers.lxc.set_resources(self.session_args(session_id), limits)
+
+    @dbus.service.method("id.waydro.ContainerManager", in_signature='i', out_signature='a{ss}')
+    def GetResourceLimits(self, session_id):
+        return helpers.lxc.get_resources(self.session_args(session_id))
 
     @dbus.service.method("id.waydro.ContainerManager", in_signature='i', out_signature='')
-    def Unfreeze(self, session_id):
-        self.args.session_id = session_id
-        self.args.session = self.sessions[session_id]
-        unfreeze(self.args)
+    def NotifyActivity(self, session_id):
+        """
+        Report user activity of a session, thawing it when it was frozen
+        for being idle.
+        """
+        if self.idle.thaw(session_id):
+            logging.info(f"Thawing idle session {session_id}")
+            unfreeze(self.session_args(session_id))
+
+    def session_usage(self):
+        gauges = []
+        for session_id in list(self.sessions):
+            cgroup = helpers.lxc.container_cgroup(self.session_args(session_id))
+            if cgroup is None:
+                continue
+            labels = {"session_id": session_id}
+            cpu = helpers.cgroup.read_keyed(cgroup, "cpu.stat")
+            gauges.append(("waydroid_session_cpu_seconds", "CPU time used by a session",
+                           labels, int(cpu.get("usage_usec", 0)) / 1000000))
+            gauges.append(("waydroid_session_memory_bytes", "Memory used by a session",
+                           labels, helpers.cgroup.read(cgroup, "memory.current")))
+        gauges.append(("waydroid_sessions", "Sessions tracked by the container service",
+                       {}, len(self.sessions)))
+        return gauges
+
+    @dbus.service.method("id.waydro.ContainerManager", in_signature='is', out_signature='', sender_keyword="sender", connection_keyword="conn", async_callbacks=("reply", "error"))
+    def CaptureTemplate(self, session_id, name, sender, conn, reply, error):
+        """
+        Save the data of a session as template for new sessions of the same
+        user, see tools.helpers.template. A running container gets frozen
+        while its data is copied.
+        """
+        try:
+            if session_id not in self.sessions:
+                raise RuntimeError(f"Not tracking a session {session_id}")
+            user_id = self.sessions[session_id]["user_id"]
+            self.check_user(sender, conn, user_id)
+            self.check_user(sender, conn, helpers.template.owner(self.args, name))
+        except RuntimeError as e:
+            error(e)
+            return
+
+        args = self.session_args(session_id)
+        args.session = self.sessions[session_id]
+        def work():
+            running = helpers.lxc.status(args) == "RUNNING"
+            if running:
+                freeze(args)
+            try:
+                helpers.template.capture(args, helpers.ephemeral.host_data(args, args.session), name,
+                                         session_id, user_id)
+            finally:
+                if running:
+                    unfreeze(args)
+        self.run_async([session_id], work, lambda result: None, reply, error)
+
+    @dbus.service.method("id.waydro.ContainerManager", in_signature='i', out_signature='s', sender_keyword="sender", connection_keyword="conn", async_callbacks=("reply", "error"))
+    def PublishAppLayer(self, session_id, sender, conn, reply, error):
+        """
+        Share the installed apps and compiled code of a session with all
+        sessions using shared_app_layer, see tools.helpers.app_layer. Only
+        root may do this, the layer is used by all users.
+
+        :returns: digest of the published layer
+        """
+        try:
+            if session_id not in self.sessions:
+                raise RuntimeError(f"Not tracking a session {session_id}")
+            self.check_user(sender, conn, "0")
+        except RuntimeError as e:
+            error(e)
+            return
+
+        args = self.session_args(session_id)
+        args.session = self.sessions[session_id]
+        def work():
+            running = helpers.lxc.status(args) == "RUNNING"
+            if running:
+                freeze(args)
+            try:
+                data = helpers.app_layer.session_dirs(args, args.session)[0]
+                return helpers.app_layer.publish(args, data)
+            finally:
+                if running:
+                    unfreeze(args)
+        self.run_async([session_id], work, lambda digest: digest, reply, error)
+
+    @dbus.service.method("id.waydro.ContainerManager", in_signature='s', out_signature='', sender_keyword="sender", connection_keyword="conn")
+    def RemoveTemplate(self, name, sender, conn):
+        self.check_user(sender, conn, helpers.template.owner(self.args, name))
+        helpers.template.remove(self.args, name)
+
+    @dbus.service.method("id.waydro.ContainerManager", in_signature='', out_signature='a{sa{ss}}')
+    def ListTemplates(self):
+        return {name: {key: str(value) for key, value in metadata.items()}
+                for name, metadata in helpers.template.list_templates(self.args).items()}
+
+    @dbus.service.method("id.waydro.ContainerManager", in_signature='', out_signature='s')
+    def GetMetrics(self):
+        return helpers.metrics.render()
+
+    @dbus.service.method("id.waydro.ContainerManager", in_signature='i', out_signature='a{ss}')
+    def GetMemorySavings(self, session_id):
+        """
+        KSM statistics of a session, plus the host-wide ones from sysfs.
+        """
+        ret = helpers.ksm.host_stats()
+        cgroup = helpers.lxc.container_cgroup(self.session_args(session_id))
+        if cgroup is not None:
+            ret.update(helpers.ksm.session_stats(cgroup))
+        return ret
 
     @dbus.service.method("id.waydro.ContainerManager", in_signature='i', out_signature='a{ss}')
     def GetSession(self, session_id):
-        self.args.session_id = session_id
         try:
             session = self.sessions[session_id]
             # session = self.args.session
-            session["state"] = helpers.lxc.status(self.args)
+            session["state"] = helpers.lxc.status(self.session_args(session_id))
             logging.info(f"retreived session {session_id}, {session}")
             return session
         # except AttributeError:
@@ -90,16 +567,37 @@ class DbusContainerManager(dbus.service.Object):
     def IsContainerRunning(self, session_id):
         return session_id in self.sessions
 
+    @dbus.service.method("id.waydro.ContainerManager", in_signature='i', out_signature='b')
+    def IsBusy(self, session_id):
+        """
+        Check whether a session is being started or stopped right now.
+        """
+        return session_id in self.busy
+
 
 def service(args, looper):
     dbus_obj = DbusContainerManager(looper, dbus.SystemBus(), '/ContainerManager', args)
     def sigint_handler(data):
         logging.info("Caught termination signal")
-        dbus_obj.StopAll(True)
+        dbus_obj.pool.drain()
+        cfg = tools.config.load(args)
+        if cfg["waydroid"]["detach_on_exit"] == "True":
+            logging.info(f"Leaving sessions {sorted(dbus_obj.sessions)} running")
+            dbus_obj.save_sessions()
+        else:
+            dbus_obj.stop_all(True)
+            helpers.images.umount_base(args)
         looper.quit()
 
     GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGINT, sigint_handler, None)
     GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGTERM, sigint_handler, None)
+    dbus_obj.reattach()
+    cfg = tools.config.load(args)
+    try:
+        helpers.metrics.serve(cfg["waydroid"]["metrics_listen"])
+    except (OSError, ValueError) as e:
+        logging.error(f"Failed to serve metrics on {cfg['waydroid']['metrics_listen']}: {e}")
+    GLib.idle_add(lambda: dbus_obj.pool.refill())
     looper.run()
 
 def set_permissions(args, perm_list=None, mode="777"):
@@ -146,7 +644,8 @@ def start(args):
         return
 
     status = helpers.lxc.status(args)
-    if status == "STOPPED":
+    # Containers left running by a previous instance get reattached
+    if status == "STOPPED" or args.session_id in helpers.registry.load(args):
         # Load binder and ashmem drivers
         cfg = tools.config.load(args)
         if cfg["waydroid"]["vendor_type"] == "MAINLINE":
@@ -161,96 +660,209 @@ def start(args):
             binderfs_path + args.HWBINDER_DRIVER
         ], "666")
 
+        # Must happen before any container is started, see tools.helpers.ksm
+        if cfg["waydroid"]["memory_merge"] == "True":
+            helpers.ksm.enable(args, cfg["waydroid"]["ksm_pages_to_scan"],
+                               cfg["waydroid"]["ksm_sleep_millisecs"])
+
         mainloop = GLib.MainLoop()
         service(args, mainloop)
     else:
         logging.error("WayDroid container is {}".format(status))
 
 def do_start(args, session):
+    helpers.trace.reset(args)
+    try:
+        with helpers.trace.span(args, "do_start"):
+            return _do_start(args, session)
+    finally:
+        helpers.trace.save(args)
+
+def _do_start(args, session):
     # if "session" in args:
     #     raise RuntimeError("Already tracking a session")
 
     status = helpers.lxc.status(args)
     if status == "STOPPED":
-        # Load binder and ashmem drivers
+        with helpers.trace.span(args, "drivers", phase=True):
+            # Load binder and ashmem drivers
+            cfg = tools.config.load(args)
+            if cfg["waydroid"]["vendor_type"] == "MAINLINE":
+                if helpers.drivers.probeBinderDriver(args) != 0:
+                    logging.error("Failed to load Binder driver")
+                helpers.drivers.probeAshmemDriver(args)
+            helpers.drivers.loadBinderNodes(args)
+            binderfs_path = tools.config.defaults(args, "binderfs")
+            set_permissions(args, [
+                binderfs_path + args.BINDER_DRIVER,
+                binderfs_path + args.VNDBINDER_DRIVER,
+                binderfs_path + args.HWBINDER_DRIVER
+            ], "666")
+
+
+    # Sessions set up before containers got per-session names need a new
+    # LXC config, the networking script below already looks for it
+    lxc_path = tools.config.defaults(args, "lxc") + helpers.lxc.container_path(args)
+    if not os.path.exists(lxc_path + "/config"):
         cfg = tools.config.load(args)
-        if cfg["waydroid"]["vendor_type"] == "MAINLINE":
-            if helpers.drivers.probeBinderDriver(args) != 0:
-                logging.error("Failed to load Binder driver")
-            helpers.drivers.probeAshmemDriver(args)
+        args.vendor_type = cfg["waydroid"]["vendor_type"]
         helpers.drivers.loadBinderNodes(args)
-        binderfs_path = tools.config.defaults(args, "binderfs")
-        set_permissions(args, [
-            binderfs_path + args.BINDER_DRIVER,
-            binderfs_path + args.VNDBINDER_DRIVER,
-            binderfs_path + args.HWBINDER_DRIVER
-        ], "666")
-
+        helpers.lxc.set_lxc_config(args)
 
     # Networking
     command = [tools.config.tools_src +
                "/data/scripts/waydroid-net.sh", "start", "--sid", str(args.session_id)]
     # if args.session_id == 0:
-    tools.helpers.run.user(args, command)
+    with helpers.trace.span(args, "network", phase=True):
+        tools.helpers.run.user(args, command)
 
-    set_permissions(args)
+    with helpers.trace.span(args, "set_permissions"):
+        set_permissions(args)
+
+    with helpers.trace.span(args, "template", phase=True):
+        if helpers.ephemeral.is_ephemeral(session):
+            helpers.ephemeral.mount(args, session)
+        else:
+            helpers.template.provision(args, session)
+        helpers.app_layer.mount(args, session)
 
     # Create session-specific LXC config file
     helpers.lxc.generate_session_lxc_config(args, session)
     # Backwards compatibility
-    with open(tools.config.defaults(args, "lxc") + "/waydroid/config") as f:
+    with open(lxc_path + "/config") as f:
         if "config_session" not in f.read():
             helpers.mount.bind(args, session["waydroid_data"],
                                tools.config.defaults(args, "data"))
 
     # Mount rootfs
     cfg = tools.config.load(args)
-    helpers.images.mount_rootfs(args, cfg["waydroid"]["images_path"], session)
-    helpers.protocol.set_aidl_version(args)
-    container_process = helpers.lxc.start(args)
+    with helpers.trace.span(args, "mount", phase=True):
+        helpers.images.mount_rootfs(args, cfg["waydroid"]["images_path"], session)
+    with helpers.trace.span(args, "set_aidl_version"):
+        helpers.protocol.set_aidl_version(args)
+    container_process = None
+    # The data a checkpoint was taken with is gone for ephemeral sessions
+    if not helpers.ephemeral.is_ephemeral(session) and helpers.checkpoint.is_valid(args):
+        try:
+            with helpers.trace.span(args, "restore", phase=True):
+                container_process = helpers.checkpoint.restore(args)
+            logging.info(f"Restored session {args.session_id} from checkpoint")
+        except (OSError, RuntimeError) as e:
+            logging.warning(f"Failed to restore checkpoint, booting instead: {e}")
+            if helpers.lxc.status(args) != "STOPPED":
+                helpers.lxc.stop(args)
+                helpers.lxc.wait_for_state(args, "STOPPED")
+    if container_process is None:
+        with helpers.trace.span(args, "lxc-start", phase=True):
+            container_process = helpers.lxc.start(args)
 
     args.session = session
     args.container_pid = container_process.pid
 
     return session
 
-def stop(args, quit_session=True):
+def stop_many(stopping, quit_session):
+    """
+    Stop several sessions in parallel, all within one stop_timeout.
+
+    :param stopping: list of args of the sessions, see stop_args()
+    """
+    if not stopping:
+        return
+    cfg = tools.config.load(stopping[0])
+    deadline = time.monotonic() + int(cfg["waydroid"]["stop_timeout"])
+    workers = max(1, min(len(stopping), STOP_WORKERS))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        for args in stopping:
+            logging.info(f"Stopping session {args.session_id}")
+            pool.submit(stop, args, quit_session, deadline)
+
+def stop(args, quit_session=True, deadline=None):
+    """
+    :param deadline: time.monotonic() by which the session should be down,
+                     stop_timeout from now by default. After it, the
+                     container gets killed and busy mounts detached lazily.
+    """
+    helpers.metrics.inc("waydroid_session_stops_total")
+    start = time.monotonic()
+    if deadline is None:
+        cfg = tools.config.load(args)
+        deadline = start + int(cfg["waydroid"]["stop_timeout"])
     try:
+        with helpers.trace.span(args, "stop"):
+            _stop(args, quit_session, deadline)
+    except:
+        pass
+    helpers.trace.save(args)
+    helpers.metrics.observe("waydroid_session_stop_seconds", time.monotonic() - start)
+
+def _stop(args, quit_session, deadline):
+    with helpers.trace.span(args, "hardware_manager"):
         services.hardware_manager.stop(args)
-        status = helpers.lxc.status(args)
-        if status != "STOPPED":
+    status = helpers.lxc.status(args)
+    if status != "STOPPED":
+        with helpers.trace.span(args, "lxc-stop"):
             helpers.lxc.stop(args)
-            while helpers.lxc.status(args) != "STOPPED":
-                pass
-
-        # Networking
-        command = [tools.config.tools_src +
-                   "/data/scripts/waydroid-net.sh", "stop", "--sid", str(args.session_id)]
-        tools.helpers.run.user(args, command, check=False)
-
-        # Umount rootfs
-        helpers.images.umount_rootfs(args)
-
-        # Backwards compatibility
-        try:
-            helpers.mount.umount_all(args, tools.config.defaults(args, "data"))
-        except:
-            pass
-
+            try:
+                helpers.lxc.wait_for_state(args, "STOPPED",
+                                           max(1, math.ceil(deadline - time.monotonic())))
+            except OSError as e:
+                logging.error(e)
+                helpers.lxc.kill(args)
+                try:
+                    helpers.lxc.wait_for_state(args, "STOPPED", KILL_TIMEOUT)
+                except OSError as e:
+                    logging.error(e)
+
+    # Networking doesn't depend on the mounts, tear both down at once
+    command = [tools.config.tools_src +
+               "/data/scripts/waydroid-net.sh", "stop", "--sid", str(args.session_id)]
+    def stop_network():
+        with helpers.trace.span(args, "network"):
+            tools.helpers.run.user(args, command, check=False)
+    network = threading.Thread(target=stop_network)
+    network.start()
+
+    # Umount rootfs, plus the data (backwards compatibility), the sockets
+    # handed to a pool container and the tmpfs of an ephemeral session
+    with helpers.trace.span(args, "umount"):
+        for key in ["rootfs", "data", "late_bind", "ephemeral"]:
+            umount_until(args, tools.config.defaults(args, key), deadline)
+        # Data on an overlay over its template
         if "session" in args:
-            # if quit_session:
-            #     try:
-            #         os.kill(int(args.session["pid"]), signal.SIGTERM)
-            #     except:
-            #         pass
-            del args.session
-    except:
-        pass
+            umount_until(args, args.session["waydroid_data"], deadline)
+    network.join()
+
+    if "session" in args:
+        # if quit_session:
+        #     try:
+        #         os.kill(int(args.session["pid"]), signal.SIGTERM)
+        #     except:
+        #         pass
+        del args.session
+
+def umount_until(args, folder, deadline):
+    """
+    Umount everything below a folder, retrying busy mounts until the
+    deadline and detaching them lazily after it.
+    """
+    while True:
+        lazy = time.monotonic() >= deadline
+        try:
+            helpers.mount.umount_all(args, folder, lazy)
+            return
+        except RuntimeError as e:
+            if lazy:
+                logging.error(e)
+                return
+            logging.debug(f"{e}, retrying")
+            time.sleep(UMOUNT_RETRY)
 
 def restart(args):
     status = helpers.lxc.status(args)
     if status == "RUNNING":
         helpers.lxc.stop(args)
+        helpers.lxc.wait_for_state(args, "STOPPED")
         helpers.lxc.start(args)
     else:
         logging.error("WayDroid container is {}".format(status))
@@ -258,15 +870,34 @@ def restart(args):
 def freeze(args):
     status = helpers.lxc.status(args)
     if status == "RUNNING":
-        helpers.lxc.freeze(args)
-        while helpers.lxc.status(args) == "RUNNING":
-            pass
+        helpers.metrics.inc("waydroid_freezes_total", action="freeze")
+        with helpers.metrics.timed("waydroid_freeze_seconds", action="freeze"):
+            helpers.lxc.freeze(args)
+            helpers.lxc.wait_for_frozen(args, True)
     else:
         logging.error("WayDroid container is {}".format(status))
 
 def unfreeze(args):
     status = helpers.lxc.status(args)
     if status == "FROZEN":
-        helpers.lxc.unfreeze(args)
-        while helpers.lxc.status(args) == "FROZEN":
-            pass
+        helpers.metrics.inc("waydroid_freezes_total", action="unfreeze")
+        with helpers.metrics.timed("waydroid_freeze_seconds", action="unfreeze"):
+            helpers.lxc.unfreeze(args)
+            helpers.lxc.wait_for_frozen(args, False)
+
+def checkpoint(args):
+    if args.remove:
+        helpers.checkpoint.remove(args)
+        return
+    status = helpers.lxc.status(args)
+    if status == "FROZEN":
+        unfreeze(args)
+    elif status != "RUNNING":
+        logging.error("WayDroid container is {}".format(status))
+        return
+    try:
+        helpers.checkpoint.create(args)
+    except RuntimeError as e:
+        logging.error(e)
+    if status == "FROZEN":
+        freeze(args)
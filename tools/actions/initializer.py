@@ -134,6 +134,7 @@ def init(args):
             except Exception as e:
                 logging.debug(e)
                 tools.actions.container_manager.stop(args)
+        helpers.images.umount_base(args)
         if args.images_path not in tools.config.defaults(args, "preinstalled_images_paths"):
             helpers.images.get(args)
         else:
@@ -15,21 +15,196 @@ import dbus.exceptions
 from gi.repository import GLib
 import copy
 
+# Time the container service gets to start one session
+START_TIMEOUT = 30
+
+def start_timeout(args, count=1):
+    """
+    Time to wait for Start or StartBatch, starts may queue for admission_timeout
+    before they begin.
+    """
+    cfg = tools.config.load(args)
+    return int(cfg["waydroid"]["admission_timeout"]) + max(60, START_TIMEOUT * count)
+
 class DbusSessionManager(dbus.service.Object):
-    def __init__(self, looper, bus, object_path, args):
+    def __init__(self, looper, bus, object_path, args, session_ids=()):
         self.args = args
         self.looper = looper
+        # Sessions this session manager started and has to stop again
+        self.session_ids = set(session_ids)
+        self.claimed = set()
+        self.ready = set()
         dbus.service.Object.__init__(self, bus, object_path)
+        self.autoscaler = services.SessionAutoscaler(self)
 
-    @dbus.service.method("id.waydro.SessionManager", in_signature='i', out_signature='')
-    def Stop(self, session_id):
-        self.args.session_id = session_id
+    @dbus.service.method("id.waydro.SessionManager", in_signature='', out_signature='')
+    def Stop(self):
+        """
+        Stop all sessions of this session manager and quit.
+        """
         do_stop(self.args, self.looper)
-        stop_container(session_id, quit_session=False)
+        # Includes the sessions added and not the ones removed since
+        for session_id in sorted(self.session_ids):
+            stop_container(session_id, quit_session=False)
+
+    def add_session(self, session_id, reply, error):
+        """
+        Have the container service start another session, see AddSession.
+        """
+        if session_id in self.session_ids:
+            error(RuntimeError(f"Session {session_id} is running already"))
+            return
+        args = copy.copy(self.args)
+        args.session_id = session_id
+        try:
+            session = make_session(args, background=True)
+        except OSError as e:
+            error(e)
+            return
+        self.session_ids.add(session_id)
+
+        def started(container_pid):
+            logging.info(f"Added session {session_id}")
+            reply()
+        # Start instead of StartBatch, so errors keep their D-Bus name and
+        # callers can tell e.g. NoCapacity apart
+        def failed(e):
+            if e.get_dbus_name() == "org.freedesktop.DBus.Error.NoReply":
+                # The container service may still be starting it, keep the
+                # session until it is known whether it came up
+                logging.warning(f"No reply while adding session {session_id}, checking on it later")
+                GLib.timeout_add_seconds(START_TIMEOUT, self.check_added, session_id)
+            else:
+                self.session_ids.discard(session_id)
+            error(e)
+        tools.helpers.ipc.DBusContainerService().Start(
+            session_id, session, reply_handler=started, error_handler=failed,
+            timeout=start_timeout(self.args))
+
+    def check_added(self, session_id):
+        """
+        Find out whether a session whose Start timed out got started.
+        """
+        if session_id not in self.session_ids:
+            return False
+        try:
+            container = tools.helpers.ipc.DBusContainerService()
+            if container.IsContainerRunning(session_id):
+                logging.info(f"Added session {session_id}")
+                return False
+            if container.IsBusy(session_id):
+                return True
+        except dbus.DBusException as e:
+            logging.debug(e)
+            return True
+        logging.error(f"Failed to add session {session_id}")
+        self.session_ids.discard(session_id)
+        return False
+
+    def remove_session(self, session_id, reply, error):
+        """
+        Have the container service stop a session, see RemoveSession.
+        """
+        if session_id not in self.session_ids:
+            error(RuntimeError(f"Session {session_id} was not started by this session manager"))
+            return
+        self.session_ids.discard(session_id)
+        self.claimed.discard(session_id)
+        self.ready.discard(session_id)
+
+        def stopped():
+            logging.info(f"Removed session {session_id}")
+            reply()
+        tools.helpers.ipc.DBusContainerService().Stop(
+            session_id, False, reply_handler=stopped, error_handler=error)
+
+    @dbus.service.method("id.waydro.SessionManager", in_signature='i', out_signature='', async_callbacks=("reply", "error"))
+    def AddSession(self, session_id, reply, error):
+        """
+        Start another session, without restarting the session manager.
+        """
+        self.add_session(session_id, reply, error)
+
+    @dbus.service.method("id.waydro.SessionManager", in_signature='i', out_signature='', async_callbacks=("reply", "error"))
+    def RemoveSession(self, session_id, reply, error):
+        self.remove_session(session_id, reply, error)
+
+    @dbus.service.method("id.waydro.SessionManager", in_signature='', out_signature='ai')
+    def ListSessions(self):
+        return dbus.Array(sorted(self.session_ids), signature='i')
+
+    @dbus.service.method("id.waydro.SessionManager", in_signature='', out_signature='i')
+    def Claim(self):
+        """
+        Hand out a ready session nobody claimed yet, e.g. to run a job in.
+        The autoscaler keeps autoscale_idle of these around.
+
+        :returns: the session id, -1 when there is none
+        """
+        idle = sorted(self.ready - self.claimed)
+        if not idle:
+            return -1
+        self.claimed.add(idle[0])
+        GLib.idle_add(self.autoscaler.scale)
+        return idle[0]
+
+    @dbus.service.method("id.waydro.SessionManager", in_signature='i', out_signature='')
+    def Release(self, session_id):
+        """
+        Give a claimed session back.
+        """
+        self.claimed.discard(session_id)
+        GLib.idle_add(self.autoscaler.scale)
+
+def make_session(args, background=True):
+    """
+    Describe session args.session_id for the container service, with the
+    environment of this process.
+    """
+    session = copy.copy(tools.config.session_defaults(args))
+
+    # TODO: also support WAYLAND_SOCKET?
+    wayland_display = session["wayland_display"]
+    if wayland_display == "None" or not wayland_display:
+        logging.warning('WAYLAND_DISPLAY is not set, defaulting to "wayland-0"')
+        wayland_display = session["wayland_display"] = "wayland-0"
+
+    if os.path.isabs(wayland_display):
+        wayland_socket_path = wayland_display
+    else:
+        xdg_runtime_dir = session["xdg_runtime_dir"]
+        if xdg_runtime_dir == "None" or not xdg_runtime_dir:
+            raise OSError("XDG_RUNTIME_DIR is not set; please don't start a Waydroid session with 'sudo'!")
+        wayland_socket_path = os.path.join(xdg_runtime_dir, wayland_display)
+    if not os.path.exists(wayland_socket_path):
+        raise OSError(f"Wayland socket '{wayland_socket_path}' doesn't exist; are you running a Wayland compositor?")
+
+    # Ephemeral sessions don't touch the disk, see tools.helpers.ephemeral
+    if getattr(args, "ephemeral", False):
+        session["ephemeral"] = "true"
+        if args.ephemeral_size:
+            session["ephemeral_size"] = args.ephemeral_size
+    else:
+        waydroid_data = session["waydroid_data"]
+        if not os.path.isdir(waydroid_data):
+            os.makedirs(waydroid_data)
 
-def service(args, looper):
-    dbus_obj = DbusSessionManager(looper, dbus.SessionBus(), '/SessionManager', args)
-    looper.run()
+    dpi = tools.helpers.props.host_get(args, "ro.sf.lcd_density")
+    if dpi == "":
+        dpi = os.getenv("GRID_UNIT_PX")
+        if dpi is not None:
+            dpi = str(int(dpi) * 20)
+        else:
+            dpi = "0"
+    session["lcd_density"] = dpi
+
+    session["background_start"] = "true" if background else "false"
+
+    # Only new sessions get provisioned, see tools.helpers.template
+    template = getattr(args, "template", None)
+    if template:
+        session["template"] = template
+    return session
 
 def start(args, unlocked_cb=None, background=True):
     logging.info("starting sessions")
@@ -43,66 +218,57 @@ def start(args, unlocked_cb=None, background=True):
     
     mainloop = GLib.MainLoop()
 
+    launch_session = args.session_id
+    sessions = {}
     for i in range(args.num_sessions):
         args.session_id = i
 
         logging.info(f"starting session {i}")
-        session = copy.copy(tools.config.session_defaults(args))
-
-        # TODO: also support WAYLAND_SOCKET?
-        wayland_display = session["wayland_display"]
-        if wayland_display == "None" or not wayland_display:
-            logging.warning('WAYLAND_DISPLAY is not set, defaulting to "wayland-0"')
-            wayland_display = session["wayland_display"] = "wayland-0"
-
-        if os.path.isabs(wayland_display):
-            wayland_socket_path = wayland_display
-        else:
-            xdg_runtime_dir = session["xdg_runtime_dir"]
-            if xdg_runtime_dir == "None" or not xdg_runtime_dir:
-                logging.error(f"XDG_RUNTIME_DIR is not set; please don't start a Waydroid session with 'sudo'!")
-                sys.exit(1)
-            wayland_socket_path = os.path.join(xdg_runtime_dir, wayland_display)
-        if not os.path.exists(wayland_socket_path):
-            logging.error(f"Wayland socket '{wayland_socket_path}' doesn't exist; are you running a Wayland compositor?")
+        try:
+            sessions[i] = make_session(args, background)
+        except OSError as e:
+            logging.error(e)
             sys.exit(1)
 
-        waydroid_data = session["waydroid_data"]
-        if not os.path.isdir(waydroid_data):
-            os.makedirs(waydroid_data)
-
-        dpi = tools.helpers.props.host_get(args, "ro.sf.lcd_density")
-        if dpi == "":
-            dpi = os.getenv("GRID_UNIT_PX")
-            if dpi is not None:
-                dpi = str(int(dpi) * 20)
-            else:
-                dpi = "0"
-        session["lcd_density"] = dpi
-
-        session["background_start"] = "true" if background else "false"
+    # GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGUSR1, sigusr_handler, None)
+    try:
+        # The container service starts the sessions in parallel, give it
+        # enough time to bring all of them up
+        results = tools.helpers.ipc.DBusContainerService().StartBatch(
+            sessions, 0, timeout=start_timeout(args, len(sessions)))
+    except dbus.DBusException as e:
+        logging.debug(e)
+        if e.get_dbus_name().startswith("org.freedesktop.DBus.Python"):
+            logging.error(e.get_dbus_message().splitlines()[-1])
+        else:
+            logging.error("WayDroid container is not listening")
+        sys.exit(0)
 
-        local_args = copy.copy(args)
+    for session_id, error in sorted(results.items()):
+        if error:
+            logging.error(f"Failed to start session {session_id}: {error}")
 
-        # GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGUSR1, sigusr_handler, None)
+    # e.g. "waydroid app launch" started the session and waits to launch
+    args.session_id = launch_session
+    if unlocked_cb and launch_session in results and not results[launch_session]:
         try:
-            tools.helpers.ipc.DBusContainerService().Start(args.session_id, session)
-        except dbus.DBusException as e:
-            logging.debug(e)
-            if e.get_dbus_name().startswith("org.freedesktop.DBus.Python"):
-                logging.error(e.get_dbus_message().splitlines()[-1])
+            if tools.helpers.ipc.wait_for_ready(launch_session):
+                unlocked_cb()
             else:
-                logging.error("WayDroid container is not listening")
-            sys.exit(0)
+                logging.error(f"Session {launch_session} did not finish booting")
+        except dbus.DBusException as e:
+            logging.error(f"Failed to wait for session {launch_session}: {e}")
 
-        # services.user_manager.start(args, session, unlocked_cb)
-        # services.clipboard_manager.start(args)
+    # services.user_manager.start(args, session, unlocked_cb)
+    # services.clipboard_manager.start(args)
 
+    dbus_obj = DbusSessionManager(mainloop, dbus.SessionBus(), '/SessionManager', args,
+                                  [session_id for session_id, error in results.items() if not error])
 
     def sigint_handler(data):
         # do_stop(local_args, mainloop)
-        for i in range(args.num_sessions):
-            session_id = i
+        # Includes the sessions added and not the ones removed since
+        for session_id in sorted(dbus_obj.session_ids):
             stop_container(session_id, quit_session=False)
         mainloop.quit()
 
@@ -112,7 +278,7 @@ def start(args, unlocked_cb=None, background=True):
     GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGINT, sigint_handler, None)
     GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGTERM, sigint_handler, None)
 
-    service(args, mainloop)
+    mainloop.run()
 
 def do_stop(args, looper):
     services.user_manager.stop(args)
@@ -125,6 +291,63 @@ def stop(args):
     except dbus.DBusException:
         stop_container(args.session_id, quit_session=True)
 
+def scale(args):
+    try:
+        manager = tools.helpers.ipc.DBusSessionService()
+        if args.subaction == "add":
+            # Leave the session manager time to answer after Start
+            manager.AddSession(args.session_id, timeout=start_timeout(args) + START_TIMEOUT)
+        elif args.subaction == "remove":
+            manager.RemoveSession(args.session_id)
+        elif args.subaction == "list":
+            for session_id in manager.ListSessions():
+                print(session_id)
+        elif args.subaction == "claim":
+            session_id = manager.Claim()
+            if session_id < 0:
+                logging.error("No idle session is ready")
+                return 1
+            print(session_id)
+        elif args.subaction == "release":
+            manager.Release(args.session_id)
+    except dbus.DBusException as e:
+        if e.get_dbus_name().startswith("org.freedesktop.DBus.Python"):
+            logging.error(e.get_dbus_message().splitlines()[-1])
+        else:
+            logging.error("WayDroid session is stopped")
+        return 1
+
+def template(args):
+    try:
+        container = tools.helpers.ipc.DBusContainerService()
+        if args.templateaction == "capture":
+            container.CaptureTemplate(args.session_id, args.NAME, timeout=3600)
+            logging.info(f"Saved session {args.session_id} as template {args.NAME}")
+        elif args.templateaction == "remove":
+            container.RemoveTemplate(args.NAME)
+        elif args.templateaction == "list":
+            for name, metadata in container.ListTemplates().items():
+                created = time.strftime("%Y-%m-%d %H:%M", time.localtime(int(metadata["created"])))
+                print(f"{name}\tcreated {created} from session {metadata['session_id']}")
+        else:
+            logging.info("Run waydroid session template -h for usage information.")
+    except dbus.DBusException as e:
+        if e.get_dbus_name().startswith("org.freedesktop.DBus.Python"):
+            logging.error(e.get_dbus_message().splitlines()[-1])
+        else:
+            logging.error("WayDroid container is not listening")
+
+def publish_apps(args):
+    try:
+        digest = tools.helpers.ipc.DBusContainerService().PublishAppLayer(
+            args.session_id, timeout=3600)
+        logging.info(f"Published the apps of session {args.session_id} as layer {digest}")
+    except dbus.DBusException as e:
+        if e.get_dbus_name().startswith("org.freedesktop.DBus.Python"):
+            logging.error(e.get_dbus_message().splitlines()[-1])
+        else:
+            logging.error("WayDroid container is not listening")
+
 def stop_container(session_id, quit_session):
     try:
         tools.helpers.ipc.DBusContainerService().Stop(session_id, quit_session)
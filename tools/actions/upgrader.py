@@ -43,6 +43,7 @@ def upgrade(args):
         except Exception as e:
             logging.debug(e)
             tools.actions.container_manager.stop(args)
+    helpers.images.umount_base(args)
     migration(args)
     helpers.drivers.loadBinderNodes(args)
     if not args.offline:
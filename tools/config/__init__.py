@@ -24,7 +24,35 @@ config_keys = ["arch",
                "vendor_datetime",
                "suspend_action",
                "mount_overlays",
-               "auto_adb"]
+               "auto_adb",
+               "lxc_backend",
+               "start_concurrency",
+               "pool_size",
+               "boot_timeout",
+               "detach_on_exit",
+               "restart_limit",
+               "restart_backoff",
+               "placement_policy",
+               "placement_cpus",
+               "memory_merge",
+               "ksm_pages_to_scan",
+               "ksm_sleep_millisecs",
+               "idle_freeze_timeout",
+               "idle_cpu_percent",
+               "metrics_listen",
+               "stop_timeout",
+               "data_template",
+               "data_template_method",
+               "shared_app_layer",
+               "app_layer_update",
+               "session_memory_reserve",
+               "admission_min_available",
+               "admission_memory_pressure",
+               "admission_cpu_pressure",
+               "admission_load",
+               "admission_timeout",
+               "autoscale_idle",
+               "autoscale_max"]
 
 # Config file/commandline default values
 # $WORK gets replaced with the actual value for args.work (which may be
@@ -43,22 +71,56 @@ _defaults = {
     "suspend_action": "freeze",
     "mount_overlays": "True",
     "auto_adb": "True",
+    "lxc_backend": "auto",
+    "start_concurrency": "4",
+    "pool_size": "0",
+    "boot_timeout": "180",
+    "detach_on_exit": "False",
+    "restart_limit": "5",
+    "restart_backoff": "2",
+    "placement_policy": "none",
+    "placement_cpus": "2",
+    "memory_merge": "False",
+    "ksm_pages_to_scan": "1000",
+    "ksm_sleep_millisecs": "50",
+    "idle_freeze_timeout": "0",
+    "idle_cpu_percent": "2",
+    "metrics_listen": "",
+    "stop_timeout": "60",
+    "data_template": "",
+    "data_template_method": "auto",
+    "shared_app_layer": "False",
+    "app_layer_update": "False",
+    "session_memory_reserve": "0",
+    "admission_min_available": "0",
+    "admission_memory_pressure": "0",
+    "admission_cpu_pressure": "0",
+    "admission_load": "0",
+    "admission_timeout": "0",
+    "autoscale_idle": "0",
+    "autoscale_max": "4",
     "container_xdg_runtime_dir": "/run/waydroid/xdg",
     "container_wayland_display": "wayland-0",
 }
 _defaults["images_path"] = _defaults["work"] + "/images"
 _defaults["rootfs"] = _defaults["work"] + "/rootfs"
+_defaults["base"] = _defaults["work"] + "/base"
+_defaults["registry"] = _defaults["work"] + "/sessions.json"
+_defaults["templates"] = _defaults["work"] + "/templates"
+_defaults["app_layer"] = _defaults["work"] + "/app_layer"
 _defaults["overlay"] = _defaults["work"] + "/overlay"
 _defaults["overlay_rw"] = _defaults["work"] + "/overlay_rw"
 _defaults["overlay_work"] = _defaults["work"] + "/overlay_work"
 _defaults["data"] = _defaults["work"] + "/data"
+_defaults["late_bind"] = _defaults["work"] + "/late_bind"
+_defaults["ephemeral"] = _defaults["work"] + "/ephemeral"
 _defaults["lxc"] = _defaults["work"] + "/lxc"
 _defaults["host_perms"] = _defaults["work"] + "/host-permissions"
 _defaults["container_pulse_runtime_path"] = _defaults["container_xdg_runtime_dir"] + "/pulse"
 _defaults["binderfs"] = _defaults["work"] + "/dev/binderfs/"
 
 def defaults(args, key):
-    if key in ["work", "rootfs", "overlay", "overlay_rw", "overlay_work", "data", "lxc", "container_xdg_runtime_dir", "binderfs"]:
+    if key in ["work", "rootfs", "overlay", "overlay_rw", "overlay_work", "data", "lxc", "container_xdg_runtime_dir", "binderfs", "late_bind", "ephemeral"]:
         session_default = _defaults[key].replace('/waydroid', f'/waydroid/session_{args.session_id}')
         logging.info(f"Session default {key} => {session_default}")
         return session_default
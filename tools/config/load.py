@@ -30,6 +30,10 @@ def load(args):
         cfg["properties"] = {}
     # no default values for property override
 
+    if "resources" not in cfg:
+        cfg["resources"] = {}
+    # no default resource limits, [resources.<session id>] overrides them
+
     return cfg
 
 def load_channels():
@@ -2,11 +2,22 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 import os
 import logging
+import tempfile
 import tools.config
 
 
 def save(args, cfg):
     logging.debug("Save config: " + args.config)
     os.makedirs(os.path.dirname(args.config), 0o700, True)
-    with open(args.config, "w") as handle:
-        cfg.write(handle)
+    # Sessions may be started concurrently, so never let a reader see a
+    # half-written file: write a temporary file and rename it into place
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(args.config),
+                                    prefix=".waydroid.cfg.")
+    try:
+        with os.fdopen(fd, "w") as handle:
+            cfg.write(handle)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, args.config)
+    except:
+        os.remove(tmp_path)
+        raise
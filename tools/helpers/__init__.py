@@ -12,3 +12,14 @@ import tools.helpers.ipc
 import tools.helpers.gpu
 import tools.helpers.protocol
 import tools.helpers.version
+import tools.helpers.cgroup
+import tools.helpers.lxc_backend
+import tools.helpers.checkpoint
+import tools.helpers.registry
+import tools.helpers.topology
+import tools.helpers.ksm
+import tools.helpers.metrics
+import tools.helpers.trace
+import tools.helpers.template
+import tools.helpers.ephemeral
+import tools.helpers.app_layer
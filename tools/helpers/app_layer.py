@@ -0,0 +1,296 @@
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import threading
+import tools.config
+import tools.helpers.ephemeral
+import tools.helpers.mount
+import tools.helpers.run
+
+""" Shared layer of installed apps and their compiled code. Publishing takes
+    /data/app and /data/dalvik-cache of one session and stores them as a
+    read-only layer, which gets mounted below an overlay over these folders
+    in the data of every session with shared_app_layer enabled. An app
+    installed and dexopted once is then available to all of them, each
+    session only stores what it changes.
+
+    Layers are content-addressed: every file is kept once in objects/, named
+    after the hash of its content, mode and owner, and a layer is a tree of
+    hard links to them in layers/<digest>, where the digest covers the
+    whole tree. Publishing the same apps again gives the same layer and
+    unchanged files are shared between layers. "current" points at the
+    layer new sessions get.
+
+    A session keeps the layer it started with, as its upper dirs only make
+    sense on top of it. The digest is recorded next to the upper dirs and
+    pinned in pins/, so the layer isn't collected while sessions use it.
+    With app_layer_update set to True, sessions move to the current layer
+    at their next start. """
+
+FOLDERS = ["app", "dalvik-cache"]
+CHUNK_SIZE = 1024 * 1024
+# Held while the layers and objects get changed
+lock = threading.Lock()
+
+
+def layer_root(args):
+    return tools.config.defaults(args, "app_layer")
+
+
+def current(args):
+    """
+    :returns: folder of the current layer, None when nothing was published
+    """
+    path = layer_root(args) + "/current"
+    if not os.path.isdir(path):
+        return None
+    return os.path.realpath(path)
+
+
+def session_dirs(args, session):
+    """
+    :returns: (data folder of the session, folder of its overlay upper dirs)
+    """
+    data = tools.helpers.ephemeral.host_data(args, session)
+    if tools.helpers.ephemeral.is_ephemeral(session):
+        return data, tools.config.defaults(args, "ephemeral") + "/app_layer"
+    return data, os.path.dirname(data) + "/app_layer"
+
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def store_object(args, path, st):
+    """
+    Add a file to the object store, unless it is there already.
+
+    :returns: path of the object
+    """
+    attrs = "{}:{:o}:{}:{}".format(hash_file(path), stat.S_IMODE(st.st_mode),
+                                   st.st_uid, st.st_gid)
+    name = hashlib.sha256(attrs.encode()).hexdigest()
+    obj = os.path.join(layer_root(args), "objects", name[:2], name[2:])
+    if not os.path.exists(obj):
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        shutil.copyfile(path, obj + ".new")
+        os.chown(obj + ".new", st.st_uid, st.st_gid)
+        os.chmod(obj + ".new", stat.S_IMODE(st.st_mode))
+        os.replace(obj + ".new", obj)
+    return obj
+
+
+def build_tree(args, source, destination, name, manifest):
+    """
+    Recreate a folder as tree of hard links into the object store, adding
+    a line per entry to the manifest.
+
+    :param name: path of the folder in the layer, used in the manifest
+    """
+    st = os.lstat(source)
+    os.mkdir(destination)
+    os.chown(destination, st.st_uid, st.st_gid)
+    os.chmod(destination, stat.S_IMODE(st.st_mode))
+    manifest.append("d {} {:o} {} {}".format(name, stat.S_IMODE(st.st_mode),
+                                             st.st_uid, st.st_gid))
+    for entry in sorted(os.scandir(source), key=lambda e: e.name):
+        st = entry.stat(follow_symlinks=False)
+        path = os.path.join(destination, entry.name)
+        relative = name + "/" + entry.name
+        if entry.is_symlink():
+            target = os.readlink(entry.path)
+            os.symlink(target, path)
+            os.lchown(path, st.st_uid, st.st_gid)
+            manifest.append(f"l {relative} {target} {st.st_uid} {st.st_gid}")
+        elif entry.is_dir():
+            build_tree(args, entry.path, path, relative, manifest)
+        elif entry.is_file():
+            obj = store_object(args, entry.path, st)
+            os.link(obj, path)
+            manifest.append(f"f {relative} {os.path.basename(obj)}")
+        else:
+            logging.debug(f"Not publishing special file {entry.path}")
+
+
+def publish(args, data):
+    """
+    Make the apps of a data folder the current layer.
+
+    :returns: digest of the layer
+    """
+    with lock:
+        return _publish(args, data)
+
+
+def _publish(args, data):
+    root = layer_root(args)
+    new = root + "/layers/new"
+    if os.path.exists(new):
+        shutil.rmtree(new)
+    os.makedirs(new)
+    manifest = []
+    for folder in FOLDERS:
+        source = os.path.join(data, folder)
+        if os.path.isdir(source):
+            build_tree(args, source, os.path.join(new, folder), folder, manifest)
+        else:
+            os.mkdir(os.path.join(new, folder))
+    digest = hashlib.sha256("\n".join(manifest).encode()).hexdigest()
+
+    layer = root + "/layers/" + digest
+    if os.path.exists(layer):
+        shutil.rmtree(new)
+    else:
+        os.rename(new, layer)
+    if os.path.lexists(root + "/current.new"):
+        os.unlink(root + "/current.new")
+    os.symlink("layers/" + digest, root + "/current.new")
+    os.replace(root + "/current.new", root + "/current")
+    logging.info(f"Published app layer {digest} from {data}")
+    collect_garbage(args)
+    return digest
+
+
+def recorded(store):
+    """
+    :returns: digest of the layer a session's upper dirs belong to, None
+              if the session never used one
+    """
+    try:
+        with open(store + "/layer") as handle:
+            return handle.read().strip() or None
+    except OSError:
+        return None
+
+
+def pin(args, store, digest):
+    """
+    Record the layer a session uses, next to its upper dirs and in the
+    pins of the layer root. Call with the lock held.
+    """
+    with open(store + "/layer.new", "w") as handle:
+        handle.write(digest + "\n")
+    os.replace(store + "/layer.new", store + "/layer")
+
+    pins = layer_root(args) + "/pins"
+    os.makedirs(pins, exist_ok=True)
+    path = os.path.join(pins, hashlib.sha256(store.encode()).hexdigest())
+    with open(path + ".new", "w") as handle:
+        json.dump({"store": store, "layer": digest}, handle)
+    os.replace(path + ".new", path)
+
+
+def pinned(args):
+    """
+    Layers sessions still record, stale pins get removed.
+
+    :returns: set of layer folders
+    """
+    root = layer_root(args)
+    pins = root + "/pins"
+    ret = set()
+    for entry in os.scandir(pins) if os.path.isdir(pins) else []:
+        try:
+            with open(entry.path) as handle:
+                item = json.load(handle)
+        except (OSError, ValueError):
+            item = {}
+        if item and recorded(item["store"]) == item["layer"]:
+            ret.add(os.path.join(root, "layers", item["layer"]))
+        else:
+            os.unlink(entry.path)
+    return ret
+
+
+def in_use(layer):
+    for line in tools.helpers.mount.mount_lines():
+        words = line.split()
+        if len(words) >= 4 and any(option.startswith("lowerdir=" + layer + "/")
+                                   for option in words[3].split(",")):
+            return True
+    return False
+
+
+def collect_garbage(args):
+    """
+    Remove layers that are neither current, pinned nor mounted, and the
+    objects no layer links to anymore.
+    """
+    root = layer_root(args)
+    keep = pinned(args) | {current(args)}
+    for name in os.listdir(root + "/layers"):
+        layer = os.path.join(root, "layers", name)
+        if layer not in keep and not in_use(layer):
+            shutil.rmtree(layer)
+    objects = root + "/objects"
+    if not os.path.isdir(objects):
+        return
+    for prefix in os.scandir(objects):
+        for obj in os.scandir(prefix.path):
+            if obj.stat(follow_symlinks=False).st_nlink == 1:
+                os.unlink(obj.path)
+
+
+def adopt(args, folder, upper):
+    """
+    Move what a session has in a folder into its new upper dir, so it does
+    not disappear below the overlay.
+    """
+    entries = [os.path.join(folder, name) for name in os.listdir(folder)]
+    if entries:
+        tools.helpers.run.user(args, ["mv", *entries, upper])
+
+
+def mount(args, session):
+    """
+    Mount the layer of a session below its app folders: the one it used
+    before, or the current one. Once a session used a layer it keeps using
+    shared layers, its apps are in the upper dirs then.
+    """
+    data, store = session_dirs(args, session)
+    cfg = tools.config.load(args)
+    if cfg["waydroid"]["shared_app_layer"] != "True" and not os.path.isdir(store):
+        return
+    with lock:
+        layer = None
+        digest = recorded(store)
+        if digest and cfg["waydroid"]["app_layer_update"] != "True":
+            layer = os.path.join(layer_root(args), "layers", digest)
+            if not os.path.isdir(layer):
+                logging.warning(f"App layer {digest} of session {args.session_id} is gone, using the current one")
+                layer = None
+        if layer is None:
+            layer = current(args)
+        if layer is None:
+            if os.path.isdir(store):
+                logging.warning(f"Session {args.session_id} used the shared app layer, but there is none")
+            return
+        os.makedirs(store, exist_ok=True)
+        pin(args, store, os.path.basename(layer))
+
+    for folder in FOLDERS:
+        destination = os.path.join(data, folder)
+        if tools.helpers.mount.ismount(destination):
+            continue
+        lower = os.path.join(layer, folder)
+        upper = os.path.join(store, folder, "upper")
+        if not os.path.isdir(upper):
+            os.makedirs(upper)
+            st = os.stat(lower)
+            os.chown(upper, st.st_uid, st.st_gid)
+            os.chmod(upper, stat.S_IMODE(st.st_mode))
+            if os.path.isdir(destination):
+                adopt(args, destination, upper)
+        tools.helpers.mount.mount_overlay(args, [lower], destination, upper_dir=upper,
+                                          work_dir=os.path.join(store, folder, "work"),
+                                          readonly=False)
+    logging.info(f"Mounted app layer {os.path.basename(layer)} for session {args.session_id}")
@@ -52,13 +52,43 @@ def arguments_log(subparser):
                      help="count of initial output lines")
     ret.add_argument("-c", "--clear", help="clear the log",
                      action="store_true", dest="clear_log")
+    ret.add_argument("-t", "--trace", type=int, metavar="SID", dest="trace",
+                     help="summarize the slowest phases of the last start"
+                          " and stop of a session")
     return ret
 
 def arguments_session(subparser):
     ret = subparser.add_parser("session", help="session controller")
     sub = ret.add_subparsers(title="subaction", dest="subaction")
-    sub.add_parser("start", help="start session")
+    start = sub.add_parser("start", help="start session")
+    start.add_argument("-t", "--template",
+                       help="provision the data of new sessions from this"
+                            " template (default: data_template of waydroid.cfg)")
+    start.add_argument("-e", "--ephemeral", action="store_true",
+                       help="keep the data of the sessions in memory and"
+                            " throw it away when they stop")
+    start.add_argument("--ephemeral-size", dest="ephemeral_size", metavar="SIZE",
+                       help="limit the memory for the data of ephemeral"
+                            " sessions, e.g. 4G (default: half of the RAM)")
     sub.add_parser("stop", help="stop session")
+    template = sub.add_parser("template", help="templates of the data of new sessions")
+    template_sub = template.add_subparsers(title="templateaction", dest="templateaction")
+    capture = template_sub.add_parser("capture", help="save the data of the"
+                                      " session as template (replaces an existing one)")
+    capture.add_argument("NAME", help="name of the template")
+    remove = template_sub.add_parser("remove", help="remove a template")
+    remove.add_argument("NAME", help="name of the template")
+    template_sub.add_parser("list", help="list templates")
+    sub.add_parser("add", help="start another session (--sid) in the running"
+                   " session manager")
+    sub.add_parser("remove", help="stop a session (--sid) of the running"
+                   " session manager")
+    sub.add_parser("list", help="list the sessions of the running session manager")
+    sub.add_parser("claim", help="take an idle, ready session and print its id")
+    sub.add_parser("release", help="give a claimed session (--sid) back")
+    sub.add_parser("publish-apps", help="share the installed apps of the"
+                   " session with all sessions using shared_app_layer"
+                   " (needs root)")
     return ret
 
 def arguments_container(subparser):
@@ -69,6 +99,11 @@ def arguments_container(subparser):
     sub.add_parser("restart", help="restart container")
     sub.add_parser("freeze", help="freeze container")
     sub.add_parser("unfreeze", help="unfreeze container")
+    checkpoint = sub.add_parser("checkpoint", help="save a checkpoint of the"
+                                " booted container to restore instead of"
+                                " booting (needs criu)")
+    checkpoint.add_argument("-r", "--remove", action="store_true",
+                            help="remove the checkpoint")
     return ret
 
 def arguments_app(subparser):
@@ -148,6 +183,14 @@ def arguments():
                         help="which session to process")
     parser.add_argument("--num-sessions", dest="num_sessions", type=int, default=1,
                         help="number of sessions to start")
+    parser.add_argument("--executor", dest="executor", default="real",
+                        choices=["real", "record", "simulate"],
+                        help="run host commands, also record them to"
+                             " --executor-file, or only simulate them with"
+                             " the responses from it")
+    parser.add_argument("--executor-file", dest="executor_file", metavar="FILE",
+                        help="JSON lines file written by --executor record and"
+                             " read by --executor simulate")
 
     # Actions
     sub = parser.add_subparsers(title="action", dest="action")
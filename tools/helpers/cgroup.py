@@ -0,0 +1,118 @@
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+import os
+import select
+import time
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# Resource limit keys of waydroid.cfg and the cgroup v2 files they set
+RESOURCE_FILES = {
+    "cpu_weight": "cpu.weight",
+    "cpu_max": "cpu.max",
+    "memory_max": "memory.max",
+    "memory_high": "memory.high",
+    "pids_max": "pids.max",
+    "io_max": "io.max",
+    "cpuset_cpus": "cpuset.cpus",
+    "cpuset_mems": "cpuset.mems",
+}
+
+
+def is_unified():
+    """
+    Check whether the host mounts the cgroup v2 (unified) hierarchy.
+    """
+    return os.path.isfile(CGROUP_ROOT + "/cgroup.controllers")
+
+
+def pid_cgroup(pid):
+    """
+    Find the cgroup v2 directory of a process.
+
+    :param pid: process id, usually the init process of a container
+    :returns: absolute path of the cgroup directory, or None when the process
+              does not exist or the host does not use the unified hierarchy
+    """
+    try:
+        with open("/proc/{}/cgroup".format(pid), "r") as handle:
+            for line in handle:
+                hierarchy, _, path = line.rstrip("\n").split(":", 2)
+                if hierarchy == "0":
+                    ret = os.path.normpath(CGROUP_ROOT + path)
+                    if os.path.isdir(ret):
+                        return ret
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def read_keyed(path, filename):
+    """
+    Parse a flat keyed cgroup file, e.g. cgroup.events or cpu.stat.
+
+    :returns: dict of all "key value" pairs in the file
+    """
+    ret = {}
+    with open(os.path.join(path, filename), "r") as handle:
+        for line in handle:
+            words = line.split()
+            if len(words) == 2:
+                ret[words[0]] = words[1]
+    return ret
+
+
+def procs(path):
+    """
+    List the processes of a cgroup and all of its descendants.
+    """
+    ret = []
+    for root, dirs, files in os.walk(path):
+        if "cgroup.procs" not in files:
+            continue
+        try:
+            with open(os.path.join(root, "cgroup.procs"), "r") as handle:
+                ret.extend(int(line) for line in handle if line.strip())
+        except OSError:
+            pass
+    return ret
+
+
+def read(path, filename):
+    with open(os.path.join(path, filename), "r") as handle:
+        return handle.read().strip()
+
+
+def write(path, filename, value):
+    with open(os.path.join(path, filename), "w") as handle:
+        handle.write(value)
+
+
+def wait_for_event(path, key, value, timeout):
+    """
+    Block until a key in the cgroup.events file of a cgroup has a value.
+
+    The kernel wakes up pollers of cgroup.events with POLLPRI whenever the
+    file changes, so this sleeps until the state flips instead of re-reading
+    the file in a loop.
+
+    :param path: cgroup directory, see pid_cgroup()
+    :param key: e.g. "frozen" or "populated"
+    :param value: expected value as string, e.g. "1"
+    :param timeout: deadline in seconds
+    :returns: True when the value was reached, False on timeout
+    """
+    deadline = time.monotonic() + timeout
+    with open(os.path.join(path, "cgroup.events"), "r") as handle:
+        poller = select.poll()
+        poller.register(handle, select.POLLPRI | select.POLLERR)
+        while True:
+            handle.seek(0)
+            for line in handle:
+                words = line.split()
+                if len(words) == 2 and words[0] == key and words[1] == value:
+                    return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            poller.poll(remaining * 1000)
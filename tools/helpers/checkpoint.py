@@ -0,0 +1,116 @@
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+import hashlib
+import json
+import logging
+import os
+import platform
+import shutil
+from shutil import which
+import tools.config
+import tools.helpers.lxc
+import tools.helpers.run
+
+""" CRIU checkpoints of booted containers, taken with lxc-checkpoint. A
+    checkpoint belongs to one session id: CRIU restores the mount table,
+    network devices and cgroups under the exact paths they were dumped with,
+    and all of those are per session. Next to the CRIU images a metadata
+    file records everything a checkpoint depends on, see metadata(). """
+
+
+def checkpoint_dir(args):
+    return tools.config.defaults(args, "work") + "/checkpoint"
+
+
+def available():
+    return which("criu") is not None and which("lxc-checkpoint") is not None
+
+
+def metadata(args):
+    """
+    Describe what a checkpoint of the current session depends on. Restoring
+    is only attempted when this matches the metadata stored at dump time.
+    """
+    cfg = tools.config.load(args)
+    h = hashlib.sha256()
+    lxc_path = tools.config.defaults(args, "lxc") + tools.helpers.lxc.container_path(args)
+    for name in ["config", "config_nodes", "config_session"]:
+        path = os.path.join(lxc_path, name)
+        if os.path.exists(path):
+            with open(path, "rb") as handle:
+                h.update(handle.read())
+    return {
+        "system_datetime": cfg["waydroid"]["system_datetime"],
+        "vendor_datetime": cfg["waydroid"]["vendor_datetime"],
+        "version": tools.config.version,
+        "kernel": platform.release(),
+        "lxc_config": h.hexdigest(),
+    }
+
+
+def is_valid(args):
+    """
+    Check whether a usable checkpoint exists. Stale checkpoints (e.g. after
+    an image upgrade changed system_datetime) are removed.
+    """
+    path = checkpoint_dir(args) + "/metadata.json"
+    if not os.path.exists(path):
+        return False
+    if not available():
+        logging.info("Not restoring checkpoint, criu is not installed")
+        return False
+    try:
+        with open(path) as handle:
+            stored = json.load(handle)
+    except (OSError, ValueError):
+        stored = {}
+    current = metadata(args)
+    stale = [key for key in current if stored.get(key) != current[key]]
+    if stale:
+        logging.info("Checkpoint is stale ({}), removing it".format(", ".join(stale)))
+        remove(args)
+        return False
+    return True
+
+
+def create(args):
+    """
+    Dump the running container of the session, leaving it running.
+    """
+    if not available():
+        raise RuntimeError("Checkpoints need criu and lxc-checkpoint")
+    remove(args)
+    directory = checkpoint_dir(args)
+    os.makedirs(directory)
+    command = ["lxc-checkpoint", "-P", tools.config.defaults(args, "lxc"),
+               "-n", tools.helpers.lxc.container_name(args), "-D", directory]
+    try:
+        tools.helpers.run.user(args, command)
+    except:
+        remove(args)
+        raise
+    with open(directory + "/metadata.json", "w") as handle:
+        json.dump(metadata(args), handle)
+    logging.info("Saved checkpoint of session {} in {}".format(args.session_id, directory))
+
+
+def restore(args):
+    """
+    Restore the container of the session from its checkpoint, like
+    tools.helpers.lxc.start() does for a cold boot.
+
+    :returns: the lxc-checkpoint process running the container
+    """
+    command = ["lxc-checkpoint", "-P", tools.config.defaults(args, "lxc"),
+               "-n", tools.helpers.lxc.container_name(args),
+               "-r", "-F", "-D", checkpoint_dir(args)]
+    container_process = tools.helpers.run.user(args, command, output="background")
+    tools.helpers.lxc.wait_for_running(args)
+    os.chmod(args.log, 0o666)
+    return container_process
+
+
+def remove(args):
+    directory = checkpoint_dir(args)
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
@@ -0,0 +1,66 @@
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+import logging
+import os
+import re
+import tools.config
+import tools.helpers.mount
+import tools.helpers.template
+
+""" Ephemeral sessions keep their Android data in memory. A tmpfs, capped
+    to the session's "ephemeral_size" if set, gets mounted per session and
+    the container's /data comes from it instead of the user's data
+    directory. With a template (see tools.helpers.template) the tmpfs only
+    holds the upper dir of an overlay over the template. Stopping the
+    session umounts the tmpfs, which throws all of it away without writing
+    or deleting anything on disk. """
+
+
+def is_ephemeral(session):
+    return session.get("ephemeral") == "true"
+
+
+def data_dir(args):
+    """
+    :returns: the folder the container's /data comes from
+    """
+    return tools.config.defaults(args, "ephemeral") + "/data"
+
+
+def host_data(args, session):
+    """
+    :returns: the folder on the host that holds the session's Android data,
+              use it instead of session["waydroid_data"]
+    """
+    if is_ephemeral(session):
+        return data_dir(args)
+    return session["waydroid_data"]
+
+
+def mount(args, session):
+    """
+    Set up the in-memory data of an ephemeral session. Data left over from
+    a previous container of the session gets thrown away.
+    """
+    folder = tools.config.defaults(args, "ephemeral")
+    tools.helpers.mount.umount_all(args, folder)
+    options = ["mode=0755"]
+    size = session.get("ephemeral_size")
+    if size:
+        # Comes from the user, don't let it add other mount options
+        if not re.fullmatch(r"[0-9]+[kKmMgG%]?", size):
+            raise RuntimeError(f"Invalid ephemeral_size: {size}")
+        options.append("size=" + size)
+    tools.helpers.mount.mount(args, "tmpfs", folder, mount_type="tmpfs",
+                              readonly=False, options=options)
+
+    data = data_dir(args)
+    name, source = tools.helpers.template.session_template(args, session)
+    if name:
+        tools.helpers.mount.mount_overlay(args, [source], data, upper_dir=folder + "/upper",
+                                          work_dir=folder + "/work", readonly=False)
+    else:
+        os.mkdir(data)
+    os.chown(data, int(session["user_id"]), int(session["group_id"]))
+    logging.info(f"Session {args.session_id} is ephemeral" +
+                 (f", on top of template {name}" if name else ""))
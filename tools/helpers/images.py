@@ -6,10 +6,14 @@ import json
 import hashlib
 import shutil
 import os
+import threading
 import tools.config
 from tools import helpers
 from shutil import which
 
+# Sessions may start concurrently, but the shared base is mounted only once
+base_lock = threading.Lock()
+
 def sha256sum(filename):
     h = hashlib.sha256()
     b = bytearray(128*1024)
@@ -118,6 +122,40 @@ def remove_overlay(args):
     if os.path.isdir(tools.config.defaults(args, "overlay_work")):
         shutil.rmtree(tools.config.defaults(args, "overlay_work"))
 
+def session_props(args, session):
+    """
+    Properties that depend on the user a session belongs to. Containers of
+    the warm pool boot without them and get them set when they are handed
+    out, see tools.services.container_pool.
+    """
+    props = []
+    def add_prop(key, cfg_key):
+        if cfg_key == "waydroid_data":
+            value = helpers.ephemeral.host_data(args, session)
+        else:
+            value = session[cfg_key]
+        if value != "None":
+            value = value.replace("/mnt/", "/mnt_extra/")
+            props.append(key + "=" + value)
+
+    add_prop("waydroid.host.user", "user_name")
+    add_prop("waydroid.host.uid", "user_id")
+    add_prop("waydroid.host.gid", "group_id")
+    add_prop("waydroid.host_data_path", "waydroid_data")
+    add_prop("waydroid.background_start", "background_start")
+    return props + density_props(session)
+
+def density_props(session):
+    """
+    Screen density of a session. It is read-only in Android, so pool
+    containers get it at boot as well and are only handed out to sessions
+    with the same lcd_density.
+    """
+    dpi = session.get("lcd_density", "0")
+    if dpi != "0":
+        return ["ro.sf.lcd_density=" + dpi]
+    return []
+
 def make_prop(args, cfg, full_props_path):
     args.work = tools.config.defaults(args, "work")
     if not os.path.isfile(args.work + "/waydroid_base.prop"):
@@ -127,31 +165,21 @@ def make_prop(args, cfg, full_props_path):
     if not props:
         raise RuntimeError("waydroid_base.prop is broken!!?")
 
-    def add_prop(key, cfg_key):
-        value = cfg[cfg_key]
-        if value != "None":
-            value = value.replace("/mnt/", "/mnt_extra/")
-            props.append(key + "=" + value)
-
     props.append(f"waydroid.host.session_id={args.session_id}")
     props.append("waydroid.multi_windows=true")
     props.append("waydroid.uevent=false")
     props.append("waydroid.edge_integration=true")
     props.append("waydroid.width=1080")
     props.append("waydroid.height=2400")
-    add_prop("waydroid.host.user", "user_name")
-    add_prop("waydroid.host.uid", "user_id")
-    add_prop("waydroid.host.gid", "group_id")
-    add_prop("waydroid.host_data_path", "waydroid_data")
-    add_prop("waydroid.background_start", "background_start")
+    if cfg.get("pool") != "true":
+        props.extend(session_props(args, cfg))
+    else:
+        props.extend(density_props(cfg))
     props.append("waydroid.xdg_runtime_dir=" + tools.config.defaults(args, "container_xdg_runtime_dir"))
     props.append("waydroid.pulse_runtime_path=" + tools.config.defaults(args, "container_pulse_runtime_path"))
     props.append("waydroid.wayland_display=" + tools.config.defaults(args, "container_wayland_display"))
     if which("waydroid-sensord") is None:
         props.append("waydroid.stub_sensors_hal=1")
-    dpi = cfg["lcd_density"]
-    if dpi != "0":
-        props.append("ro.sf.lcd_density=" + dpi)
 
     final_props = open(full_props_path, "w")
     for prop in props:
@@ -159,48 +187,112 @@ def make_prop(args, cfg, full_props_path):
     final_props.close()
     os.chmod(full_props_path, 0o644)
 
+def images_stamp(images_dir):
+    stamp = [images_dir]
+    for image in ["system.img", "vendor.img"]:
+        stamp.append(str(os.stat(os.path.join(images_dir, image)).st_mtime_ns))
+    return " ".join(stamp)
+
+def mount_base(args, images_dir):
+    """
+    Loop-mount system.img and vendor.img read-only once. All sessions build
+    their rootfs on top of these mounts, so they share one loop device and
+    one copy of the images in the page cache.
+
+    :returns: path of the shared base directory
+    """
+    base = tools.config.defaults(args, "base")
+    stamp_path = base + "/images.stamp"
+    stamp = images_stamp(images_dir)
+    with base_lock:
+        if helpers.mount.ismount(base + "/system"):
+            stale = True
+            if os.path.isfile(stamp_path):
+                with open(stamp_path) as f:
+                    stale = f.read().strip() != stamp
+            if stale:
+                logging.info("Images have changed, remounting " + base)
+                if not _umount_base(args, base):
+                    # Keep the old stamp, so the next start tries again
+                    logging.warning("Starting on the old images until all sessions using them stopped")
+                    return base
+
+        helpers.mount.mount(args, images_dir + "/system.img", base + "/system",
+                            force=False)
+        helpers.mount.mount(args, images_dir + "/vendor.img", base + "/vendor",
+                            force=False)
+        with open(stamp_path, "w") as f:
+            f.write(stamp + "\n")
+    return base
+
+def _umount_base(args, base):
+    """
+    :returns: True when the shared images are no longer mounted
+    """
+    try:
+        helpers.mount.umount_all(args, base)
+    except RuntimeError as e:
+        logging.warning("Shared images are still in use: {}".format(e))
+        return False
+    return True
+
+def umount_base(args):
+    """
+    Release the shared image mounts. This only succeeds when no session
+    rootfs is built on top of them anymore.
+    """
+    with base_lock:
+        _umount_base(args, tools.config.defaults(args, "base"))
+
 def mount_rootfs(args, images_dir, session):
     cfg = tools.config.load(args)
-    helpers.mount.mount(args, images_dir + "/system.img",
-                        tools.config.defaults(args, "rootfs"), umount=True)
+    with helpers.trace.span(args, "mount_base"):
+        base = mount_base(args, images_dir)
+    rootfs = tools.config.defaults(args, "rootfs")
+    if helpers.mount.ismount(rootfs):
+        helpers.mount.umount_all(args, rootfs)
+
     if cfg["waydroid"]["mount_overlays"] == "True":
         try:
             helpers.mount.mount_overlay(args, [tools.config.defaults(args, "overlay"),
-                                               tools.config.defaults(args, "rootfs")],
-                                    tools.config.defaults(args, "rootfs"),
+                                               base + "/system"],
+                                    rootfs,
                                     upper_dir=tools.config.defaults(args, "overlay_rw") + "/system",
                                     work_dir=tools.config.defaults(args, "overlay_work") + "/system")
         except RuntimeError:
             cfg["waydroid"]["mount_overlays"] = "False"
             tools.config.save(args, cfg)
             logging.warning("Mounting overlays failed. The feature has been disabled.")
+    if cfg["waydroid"]["mount_overlays"] != "True":
+        helpers.mount.bind(args, base + "/system", rootfs)
 
-    helpers.mount.mount(args, images_dir + "/vendor.img",
-                           tools.config.defaults(args, "rootfs") + "/vendor")
     if cfg["waydroid"]["mount_overlays"] == "True":
         helpers.mount.mount_overlay(args, [tools.config.defaults(args, "overlay") + "/vendor",
-                                           tools.config.defaults(args, "rootfs") + "/vendor"],
-                                    tools.config.defaults(args, "rootfs") + "/vendor",
+                                           base + "/vendor"],
+                                    rootfs + "/vendor",
                                     upper_dir=tools.config.defaults(args, "overlay_rw") + "/vendor",
                                     work_dir=tools.config.defaults(args, "overlay_work") + "/vendor")
+    else:
+        helpers.mount.bind(args, base + "/vendor", rootfs + "/vendor")
 
     for egl_path in ["/vendor/lib/egl", "/vendor/lib64/egl"]:
         if os.path.isdir(egl_path):
             helpers.mount.bind(
-                args, egl_path, tools.config.defaults(args, "rootfs") + egl_path)
+                args, egl_path, rootfs + egl_path)
     if helpers.mount.ismount("/odm"):
         helpers.mount.bind(
-            args, "/odm", tools.config.defaults(args, "rootfs") + "/odm_extra")
+            args, "/odm", rootfs + "/odm_extra")
     else:
         if os.path.isdir("/vendor/odm"):
             helpers.mount.bind(
-                args, "/vendor/odm", tools.config.defaults(args, "rootfs") + "/odm_extra")
+                args, "/vendor/odm", rootfs + "/odm_extra")
 
     args.work = tools.config.defaults(args, "work")
-    logging.info(f"Making props at {args.work + "/waydroid.prop"}, session {args.session_id}")
-    make_prop(args, session, args.work + "/waydroid.prop")
+    logging.info(f"Making props at {args.work}/waydroid.prop, session {args.session_id}")
+    with helpers.trace.span(args, "make_prop"):
+        make_prop(args, session, args.work + "/waydroid.prop")
     helpers.mount.bind_file(args, args.work + "/waydroid.prop",
-                            tools.config.defaults(args, "rootfs") + "/vendor/waydroid.prop")
+                            rootfs + "/vendor/waydroid.prop")
 
-def umount_rootfs(args):
-    helpers.mount.umount_all(args, tools.config.defaults(args, "rootfs"))
+def umount_rootfs(args, lazy=False):
+    helpers.mount.umount_all(args, tools.config.defaults(args, "rootfs"), lazy)
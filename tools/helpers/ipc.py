@@ -4,6 +4,7 @@
 # Currently implemented as FIFO
 import os
 import dbus
+from gi.repository import GLib
 
 BASE_DIR = "/var/run/"
 
@@ -40,5 +41,40 @@ def notify_blocking(channel, msg):
 def DBusContainerService(object_path="/ContainerManager", intf="id.waydro.ContainerManager"):
     return dbus.Interface(dbus.SystemBus().get_object("id.waydro.Container", object_path), intf)
 
+def notify_activity(session_id):
+    """
+    Report that a session is in use, so the idle freezer of the container
+    service doesn't freeze it (see tools.services.idle_freezer).
+    """
+    try:
+        DBusContainerService().NotifyActivity(session_id)
+    except dbus.DBusException:
+        pass
+
+def wait_for_ready(session_id, timeout=300):
+    """
+    Block until Android in a session has finished booting, woken up by the
+    SessionReady signal of the container service.
+
+    :returns: True when the session is ready
+    """
+    container = DBusContainerService()
+    mainloop = GLib.MainLoop()
+    def ready(ready_id):
+        if ready_id == session_id:
+            mainloop.quit()
+    # Subscribe before asking, so the signal can't get lost in between
+    match = dbus.SystemBus().add_signal_receiver(ready, signal_name="SessionReady",
+                                                 dbus_interface="id.waydro.ContainerManager",
+                                                 bus_name="id.waydro.Container")
+    try:
+        if container.IsReady(session_id):
+            return True
+        GLib.timeout_add_seconds(timeout, mainloop.quit)
+        mainloop.run()
+        return bool(container.IsReady(session_id))
+    finally:
+        match.remove()
+
 def DBusSessionService(object_path="/SessionManager", intf="id.waydro.SessionManager"):
     return dbus.Interface(dbus.SessionBus().get_object("id.waydro.Session", object_path), intf)
@@ -0,0 +1,104 @@
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+import ctypes
+import logging
+import os
+import tools.helpers.cgroup
+
+""" Kernel same-page merging for the containers. Android does not mark its
+    memory as mergeable, so KSM alone would not find anything to merge.
+    Since Linux 6.4, prctl(PR_SET_MEMORY_MERGE) marks a whole process as
+    mergeable, which is inherited by its children. The container service
+    sets it on itself before starting containers when memory_merge is
+    enabled in waydroid.cfg. """
+
+KSM_SYSFS = "/sys/kernel/mm/ksm"
+PR_SET_MEMORY_MERGE = 67
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def available():
+    return os.path.isdir(KSM_SYSFS)
+
+
+def write_tunable(name, value):
+    with open(os.path.join(KSM_SYSFS, name), "w") as handle:
+        handle.write(str(value))
+
+
+def read_tunable(name):
+    try:
+        with open(os.path.join(KSM_SYSFS, name), "r") as handle:
+            return int(handle.read().strip())
+    except (OSError, ValueError):
+        return 0
+
+
+def enable(args, pages_to_scan, sleep_millisecs):
+    """
+    Start ksmd with the given tunables and mark this process (and with it
+    every container started afterwards) as mergeable.
+
+    :returns: True when process-wide merging is active
+    """
+    if not available():
+        logging.warning("Kernel lacks KSM support, not merging memory")
+        return False
+    try:
+        write_tunable("pages_to_scan", pages_to_scan)
+        write_tunable("sleep_millisecs", sleep_millisecs)
+        write_tunable("run", 1)
+    except OSError as e:
+        logging.warning("Failed to start ksmd: {}".format(e))
+        return False
+
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.prctl(PR_SET_MEMORY_MERGE, 1, 0, 0, 0) != 0:
+        logging.warning("prctl(PR_SET_MEMORY_MERGE) failed: {}, kernel 6.4 or"
+                        " newer is needed to merge memory of the containers"
+                        .format(os.strerror(ctypes.get_errno())))
+        return False
+    logging.info("Memory merging enabled (pages_to_scan={}, sleep_millisecs={})"
+                 .format(pages_to_scan, sleep_millisecs))
+    return True
+
+
+def process_stat(pid):
+    ret = {}
+    try:
+        with open("/proc/{}/ksm_stat".format(pid), "r") as handle:
+            for line in handle:
+                words = line.split()
+                if len(words) == 2 and words[1].lstrip("-").isdigit():
+                    ret[words[0]] = int(words[1])
+    except OSError:
+        pass
+    return ret
+
+
+def session_stats(cgroup):
+    """
+    Sum up the KSM statistics of all processes in a container's cgroup.
+
+    :returns: dict with merging_pages, saved_bytes and profit_bytes (memory
+              saved minus the rmap_items KSM needs for tracking)
+    """
+    merging = 0
+    profit = 0
+    for pid in tools.helpers.cgroup.procs(cgroup):
+        stat = process_stat(pid)
+        merging += stat.get("ksm_merging_pages", 0)
+        profit += stat.get("ksm_process_profit", 0)
+    return {
+        "merging_pages": str(merging),
+        "saved_bytes": str(merging * PAGE_SIZE),
+        "profit_bytes": str(profit),
+    }
+
+
+def host_stats():
+    return {
+        "pages_shared": str(read_tunable("pages_shared")),
+        "pages_sharing": str(read_tunable("pages_sharing")),
+        "general_profit": str(read_tunable("general_profit")),
+    }
@@ -3,14 +3,26 @@
 import subprocess
 import os
 import re
+import shlex
 import logging
 import glob
 import shutil
+import signal
 import time
 import platform
 import gbinder
 import tools.config
+import tools.helpers.cgroup
+import tools.helpers.ephemeral
+import tools.helpers.lxc_backend
 import tools.helpers.run
+import tools.helpers.run_core
+import tools.helpers.trace
+
+# Deadline (in seconds) for the container to reach a requested state
+STATE_TIMEOUT = 10
+# Seconds between property checks inside the container, see wait_for_prop()
+PROP_INTERVAL = 0.1
 
 def get_lxc_version(args):
     if shutil.which("lxc-info") is not None:
@@ -164,7 +176,7 @@ def set_lxc_config(args):
     rootfs_path = "lxc.rootfs.path = " + tools.config.defaults(args, "rootfs")
     uts_name = "lxc.uts.name = " + container_name(args)
     net_link = f"lxc.net.0.link = waydroid{args.session_id}"
-    net_hwaddr = f"lxc.net.0.hwaddr = 00:16:3e:f9:d3:0{3+args.session_id}"
+    net_hwaddr = f"lxc.net.0.hwaddr = 00:16:3e:f9:d3:{3+args.session_id:02x}"
     seccomp = "lxc.seccomp.profile = " + seccomp_path
     config_edits = f"\"{include_config_nodes}\n{include_config_session}\n{rootfs_path}\n{uts_name}\n{net_link}\n{net_hwaddr}\n{seccomp}\n\""
 
@@ -191,7 +203,17 @@ def set_lxc_config(args):
     # Create empty file
     open(os.path.join(lxc_path, "config_session"), mode="w").close()
 
+    # Containers used to be called "waydroid" in every session
+    legacy_path = tools.config.defaults(args, "lxc") + "/" + LEGACY_CONTAINER_NAME
+    if os.path.isdir(legacy_path) and legacy_path != lxc_path:
+        logging.info("Removing legacy LXC config " + legacy_path)
+        shutil.rmtree(legacy_path)
+
 def generate_session_lxc_config(args, session):
+    with tools.helpers.trace.span(args, "generate_session_lxc_config"):
+        _generate_session_lxc_config(args, session)
+
+def _generate_session_lxc_config(args, session):
     nodes = []
     def make_entry(src, dist=None, mnt_type="none", options="rbind,create=file 0 0"):
         if any(x in src for x in ["\n", "\r"]):
@@ -203,23 +225,47 @@ def generate_session_lxc_config(args, session):
             return False
         return add_node_entry(nodes, src, dist, mnt_type, options, check=False)
 
-    # Make sure XDG_RUNTIME_DIR exists
-    if not make_entry("tmpfs", tools.config.defaults(args, "container_xdg_runtime_dir"), options="create=dir 0 0"):
-        raise OSError("Failed to create XDG_RUNTIME_DIR mount point")
-
-    wayland_host_socket = os.path.realpath(os.path.join(session["xdg_runtime_dir"], session["wayland_display"]))
-    wayland_container_socket = os.path.realpath(os.path.join(tools.config.defaults(args, "container_xdg_runtime_dir"), tools.config.defaults(args, "container_wayland_display")))
-    if not make_entry(wayland_host_socket, wayland_container_socket[1:]):
-        raise OSError("Failed to bind Wayland socket")
-
-    # Make sure PULSE_RUNTIME_DIR exists
-    pulse_host_socket = os.path.join(session["pulse_runtime_path"], "native")
-    pulse_container_socket = os.path.join(tools.config.defaults(args, "container_pulse_runtime_path"), "native")
-    make_entry(pulse_host_socket, pulse_container_socket[1:])
-
-    if not make_entry(session["waydroid_data"], "data", options="rbind 0 0"):
+    if session.get("pool") == "true":
+        # Containers of the warm pool boot before a user claims them. Their
+        # XDG_RUNTIME_DIR is a shared host directory, the user's sockets get
+        # bind-mounted into it later and propagate into the container.
+        if not make_entry(tools.config.defaults(args, "late_bind"),
+                          tools.config.defaults(args, "container_xdg_runtime_dir")[1:],
+                          options="rbind,rslave,create=dir 0 0"):
+            raise OSError("Failed to create XDG_RUNTIME_DIR mount point")
+    else:
+        # Make sure XDG_RUNTIME_DIR exists
+        if not make_entry("tmpfs", tools.config.defaults(args, "container_xdg_runtime_dir"), options="create=dir 0 0"):
+            raise OSError("Failed to create XDG_RUNTIME_DIR mount point")
+
+        wayland_host_socket = os.path.realpath(os.path.join(session["xdg_runtime_dir"], session["wayland_display"]))
+        wayland_container_socket = os.path.realpath(os.path.join(tools.config.defaults(args, "container_xdg_runtime_dir"), tools.config.defaults(args, "container_wayland_display")))
+        if not make_entry(wayland_host_socket, wayland_container_socket[1:]):
+            raise OSError("Failed to bind Wayland socket")
+
+        # Make sure PULSE_RUNTIME_DIR exists
+        pulse_host_socket = os.path.join(session["pulse_runtime_path"], "native")
+        pulse_container_socket = os.path.join(tools.config.defaults(args, "container_pulse_runtime_path"), "native")
+        make_entry(pulse_host_socket, pulse_container_socket[1:])
+
+    if tools.helpers.ephemeral.is_ephemeral(session):
+        if not make_entry(tools.helpers.ephemeral.data_dir(args), "data", options="rbind 0 0"):
+            raise OSError("Failed to bind ephemeral userdata")
+    elif not make_entry(session["waydroid_data"], "data", options="rbind 0 0"):
         raise OSError("Failed to bind userdata")
 
+    resources = session_resources(args)
+    # CPU and memory nodes picked by the placement policy of the service
+    for key in ["cpuset_cpus", "cpuset_mems"]:
+        if session.get(key):
+            resources[key] = session[key]
+    if resources and not tools.helpers.cgroup.is_unified():
+        logging.warning("Resource limits need the cgroup v2 hierarchy, ignoring them")
+    elif resources:
+        for key, value in resources.items():
+            nodes.append("lxc.cgroup2.{} = {}".format(
+                tools.helpers.cgroup.RESOURCE_FILES[key], value))
+
     lxc_path = tools.config.defaults(args, "lxc") + container_path(args)
     args.work = tools.config.defaults(args, "work")
     config_nodes_tmp_path = args.work + "/config_session"
@@ -230,6 +276,53 @@ def generate_session_lxc_config(args, session):
     command = ["mv", config_nodes_tmp_path, lxc_path]
     tools.helpers.run.user(args, command)
 
+def session_resources(args):
+    """
+    Resource limits of the session: the [resources] section of waydroid.cfg,
+    overridden by the [resources.<session id>] section.
+
+    :returns: dict of keys of tools.helpers.cgroup.RESOURCE_FILES to values
+    """
+    cfg = tools.config.load(args)
+    ret = {}
+    for section in ["resources", "resources.{}".format(args.session_id)]:
+        if section not in cfg:
+            continue
+        for key, value in cfg[section].items():
+            if key not in tools.helpers.cgroup.RESOURCE_FILES:
+                logging.warning("Ignoring unknown resource limit {} in [{}]".format(key, section))
+                continue
+            ret[key] = value
+    return ret
+
+def set_resources(args, limits):
+    """
+    Change resource limits of the running container, see session_resources().
+    """
+    if not limits:
+        return
+    cgroup = container_cgroup(args)
+    if cgroup is None:
+        raise OSError("Container {} is not running on a cgroup v2 host".format(container_name(args)))
+    for key, value in limits.items():
+        if key not in tools.helpers.cgroup.RESOURCE_FILES:
+            raise ValueError("Unknown resource limit: " + key)
+        logging.info("Setting {} of {} to {}".format(key, container_name(args), value))
+        tools.helpers.cgroup.write(cgroup, tools.helpers.cgroup.RESOURCE_FILES[key], value)
+
+def get_resources(args):
+    cgroup = container_cgroup(args)
+    if cgroup is None:
+        return {}
+    ret = {}
+    for key, filename in tools.helpers.cgroup.RESOURCE_FILES.items():
+        try:
+            ret[key] = tools.helpers.cgroup.read(cgroup, filename)
+        except OSError:
+            # Controller not enabled for the container
+            pass
+    return ret
+
 def make_base_props(args):
     def find_hal(hardware):
         hardware_props = [
@@ -390,47 +483,132 @@ def setup_host_perms(args):
         shutil.copy(filename, tools.config.defaults(args, "host_perms"))
 
 def status(args):
-    command = ["lxc-info", "-P", tools.config.defaults(args, "lxc"), "-n", container_name(args), "-sH"]
-    try:
-        return tools.helpers.run.user(args, command, output_return=True).strip()
-    except:
-        logging.info("Couldn't get LXC status. Assuming STOPPED.")
-        return "STOPPED"
+    return tools.helpers.lxc_backend.get(args).status(
+        args, tools.config.defaults(args, "lxc"), container_name(args))
+
+def init_pid(args):
+    return tools.helpers.lxc_backend.get(args).init_pid(
+        args, tools.config.defaults(args, "lxc"), container_name(args))
+
+def container_cgroup(args):
+    pid = init_pid(args)
+    if pid is None:
+        return None
+    return tools.helpers.cgroup.pid_cgroup(pid)
+
+def log_transition(args, state, start):
+    elapsed = time.monotonic() - start
+    logging.info("Container {} reached {} in {:.1f} ms".format(
+        container_name(args), state, elapsed * 1000))
+    return elapsed
+
+def wait_for_state(args, state, timeout=STATE_TIMEOUT):
+    """
+    Block until the container reaches an LXC state. Both backends sleep on
+    the LXC monitor socket, so no status polling is involved.
+
+    :param state: LXC state, e.g. "RUNNING" or "STOPPED"
+    :param timeout: deadline in seconds
+    :returns: seconds the transition took
+    :raises OSError: when the state was not reached before the deadline
+    """
+    start = time.monotonic()
+    backend = tools.helpers.lxc_backend.get(args)
+    with tools.helpers.trace.span(args, "wait_for_state", state=state):
+        reached = backend.wait(args, tools.config.defaults(args, "lxc"),
+                               container_name(args), state, timeout)
+    if not reached:
+        raise OSError("container did not reach state {} within {} seconds".format(state, timeout))
+    return log_transition(args, state, start)
+
+def wait_for_frozen(args, frozen, timeout=STATE_TIMEOUT):
+    """
+    Block until the container is (un)frozen. On cgroup v2 hosts this waits
+    for the "frozen" key of the container's cgroup.events, otherwise it falls
+    back to wait_for_state().
+
+    :param frozen: True to wait for FROZEN, False to wait for the thaw
+    :returns: seconds the transition took
+    :raises OSError: when the state was not reached before the deadline
+    """
+    state = "FROZEN" if frozen else "RUNNING"
+    cgroup = container_cgroup(args)
+    if cgroup is None:
+        return wait_for_state(args, state, timeout)
+
+    start = time.monotonic()
+    if not tools.helpers.cgroup.wait_for_event(cgroup, "frozen", "1" if frozen else "0", timeout):
+        raise OSError("container did not reach state {} within {} seconds".format(state, timeout))
+    return log_transition(args, state, start)
 
 def wait_for_running(args):
-    lxc_status = status(args)
-    timeout = 10
-    while lxc_status != "RUNNING" and timeout > 0:
-        lxc_status = status(args)
-        logging.info(
-            "waiting {} seconds for container to start...".format(timeout))
-        timeout = timeout - 1
-        time.sleep(1)
-    if lxc_status != "RUNNING":
+    try:
+        wait_for_state(args, "RUNNING")
+    except OSError:
         raise OSError("container failed to start")
 
 def start(args):
     command = ["lxc-start", "-P", tools.config.defaults(args, "lxc"),
                "-F", "-n", container_name(args), "--", "/init"]
-    container_process = tools.helpers.run.user(args, command, output="background")
+    with tools.helpers.trace.span(args, "lxc_start_spawn"):
+        container_process = tools.helpers.run.user(args, command, output="background")
     wait_for_running(args)
     # Workaround lxc-start changing stdout/stderr permissions to 700
     os.chmod(args.log, 0o666)
     return container_process
 
 def stop(args):
-    command = ["lxc-stop", "-P",
-               tools.config.defaults(args, "lxc"), "-n", container_name(args), "-k"]
-    tools.helpers.run.user(args, command)
+    tools.helpers.lxc_backend.get(args).stop(
+        args, tools.config.defaults(args, "lxc"), container_name(args))
+
+def in_container_cgroup(args, pid):
+    """
+    Check that a process runs in the cgroup LXC made for the container,
+    e.g. /lxc.payload.waydroid-0 or a cgroup below it.
+    """
+    cgroup = tools.helpers.cgroup.pid_cgroup(pid)
+    if cgroup is None:
+        return False
+    name = container_name(args)
+    return any(part in [name, "lxc.payload." + name]
+               for part in os.path.relpath(cgroup, tools.helpers.cgroup.CGROUP_ROOT).split("/"))
+
+def kill(args):
+    """
+    SIGKILL the init of the container, for when stopping it takes too long.
+    The pid is pinned with a pidfd and only signalled while it still is in
+    the container's cgroup, so a reused pid is never hit.
+    """
+    if tools.helpers.run_core.executor(args).name != "real":
+        # The pid comes from a recording and belongs to some other process
+        logging.warning("Not killing container {}, commands are not run for real".format(container_name(args)))
+        return
+    pid = init_pid(args)
+    if pid is None:
+        return
+    try:
+        pidfd = os.pidfd_open(pid)
+    except ProcessLookupError:
+        return
+    try:
+        if not in_container_cgroup(args, pid):
+            logging.error("Not killing pid {}, it does not belong to container {}".format(pid, container_name(args)))
+            return
+        logging.warning("Killing container {} (init pid {})".format(container_name(args), pid))
+        try:
+            signal.pidfd_send_signal(pidfd, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    finally:
+        os.close(pidfd)
 
 def freeze(args):
-    command = ["lxc-freeze", "-P", tools.config.defaults(args, "lxc"), "-n", container_name(args)]
-    tools.helpers.run.user(args, command)
+    tools.helpers.lxc_backend.get(args).freeze(
+        args, tools.config.defaults(args, "lxc"), container_name(args))
 
 def unfreeze(args):
-    command = ["lxc-unfreeze", "-P",
-               tools.config.defaults(args, "lxc"), "-n", container_name(args)]
-    tools.helpers.run.user(args, command)
+    tools.helpers.lxc_backend.get(args).unfreeze(
+        args, tools.config.defaults(args, "lxc"), container_name(args))
 
 ANDROID_ENV = {
     "PATH": "/product/bin:/apex/com.android.runtime/bin:/apex/com.android.art/bin:/system_ext/bin:/system/bin:/system/xbin:/odm/bin:/vendor/bin:/vendor/xbin",
@@ -494,6 +672,44 @@ def shell(args):
     if state == "FROZEN":
         freeze(args)
 
+def attach(args, command, output_return=False):
+    """
+    Run a command inside the container with the Android environment.
+    """
+    cmd = ["lxc-attach", "-P", tools.config.defaults(args, "lxc"),
+           "-n", container_name(args), "--clear-env"]
+    cmd.extend(android_env_attach_options())
+    cmd.append("--")
+    cmd.extend(command)
+    return tools.helpers.run.user(args, cmd, output_return=output_return)
+
+def getprop(args, key):
+    try:
+        return attach(args, ["/system/bin/getprop", key], output_return=True).strip()
+    except RuntimeError:
+        return ""
+
+def setprop(args, key, value):
+    attach(args, ["/system/bin/setprop", key, value])
+
+def wait_for_prop(args, key, value):
+    """
+    Block until an Android property has a value. The check loops inside the
+    container, where getprop only reads the shared property area, so the
+    host runs one lxc-attach for the whole wait instead of a command or
+    binder call per check.
+
+    :returns: True once the property has the value, False when the
+              container went away before
+    """
+    script = 'until [ "$(getprop {})" = {} ]; do sleep {}; done'.format(
+        key, shlex.quote(value), PROP_INTERVAL)
+    try:
+        attach(args, ["/system/bin/sh", "-c", script])
+    except RuntimeError:
+        return False
+    return True
+
 def logcat(args):
     args.COMMAND = ["/system/bin/logcat"]
     args.uid = None
@@ -504,8 +720,9 @@ def logcat(args):
     args.context = None
     shell(args)
 
+LEGACY_CONTAINER_NAME = "waydroid"
 def container_name(args):
-    return "waydroid"
+    return "waydroid-{}".format(args.session_id)
 
 def container_path(args):
     return "/" + container_name(args)
\ No newline at end of file
@@ -0,0 +1,127 @@
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+import logging
+import threading
+import tools.config
+import tools.helpers.run
+import tools.helpers.run_core
+
+try:
+    import lxc as liblxc
+except ImportError:
+    liblxc = None
+
+""" Container backends used by tools.helpers.lxc. The liblxc backend talks to
+    the containers in-process through the python3-lxc bindings, the CLI
+    backend forks the lxc-* tools and is used when the bindings are missing
+    or when "lxc_backend = cli" is set in waydroid.cfg. Recorded and
+    simulated runs (see tools.helpers.run_core) always use the CLI backend.
+
+    Every backend method gets the LXC path (-P) and the container name (-n),
+    so one backend instance serves all sessions. """
+
+
+class CliBackend:
+    name = "cli"
+
+    def status(self, args, lxcpath, name):
+        command = ["lxc-info", "-P", lxcpath, "-n", name, "-sH"]
+        try:
+            return tools.helpers.run.user(args, command, output_return=True).strip()
+        except:
+            logging.info("Couldn't get LXC status. Assuming STOPPED.")
+            return "STOPPED"
+
+    def init_pid(self, args, lxcpath, name):
+        command = ["lxc-info", "-P", lxcpath, "-n", name, "-pH"]
+        try:
+            return int(tools.helpers.run.user(args, command, output_return=True).strip())
+        except (RuntimeError, ValueError):
+            return None
+
+    def wait(self, args, lxcpath, name, state, timeout):
+        command = ["lxc-wait", "-P", lxcpath, "-n", name, "-s", state,
+                   "-t", str(timeout)]
+        return tools.helpers.run.user(args, command, check=False) == 0
+
+    def stop(self, args, lxcpath, name):
+        command = ["lxc-stop", "-P", lxcpath, "-n", name, "-k"]
+        tools.helpers.run.user(args, command)
+
+    def freeze(self, args, lxcpath, name):
+        command = ["lxc-freeze", "-P", lxcpath, "-n", name]
+        tools.helpers.run.user(args, command)
+
+    def unfreeze(self, args, lxcpath, name):
+        command = ["lxc-unfreeze", "-P", lxcpath, "-n", name]
+        tools.helpers.run.user(args, command)
+
+
+class LiblxcBackend:
+    name = "liblxc"
+
+    def __init__(self):
+        self.containers = {}
+        self.lock = threading.Lock()
+
+    def container(self, lxcpath, name):
+        # Container objects parse the config once, so keep them around
+        with self.lock:
+            key = (lxcpath, name)
+            if key not in self.containers:
+                self.containers[key] = liblxc.Container(name, lxcpath)
+            return self.containers[key]
+
+    def status(self, args, lxcpath, name):
+        return self.container(lxcpath, name).state
+
+    def init_pid(self, args, lxcpath, name):
+        pid = self.container(lxcpath, name).init_pid
+        return pid if pid > 0 else None
+
+    def wait(self, args, lxcpath, name, state, timeout):
+        return self.container(lxcpath, name).wait(state, timeout)
+
+    def stop(self, args, lxcpath, name):
+        logging.debug("% (liblxc) stop " + name)
+        if not self.container(lxcpath, name).stop():
+            raise RuntimeError("Failed to stop container " + name)
+
+    def freeze(self, args, lxcpath, name):
+        logging.debug("% (liblxc) freeze " + name)
+        if not self.container(lxcpath, name).freeze():
+            raise RuntimeError("Failed to freeze container " + name)
+
+    def unfreeze(self, args, lxcpath, name):
+        logging.debug("% (liblxc) unfreeze " + name)
+        if not self.container(lxcpath, name).unfreeze():
+            raise RuntimeError("Failed to unfreeze container " + name)
+
+
+_backend = None
+
+
+def get(args):
+    """
+    Pick the container backend once per process.
+
+    :returns: LiblxcBackend or CliBackend instance
+    """
+    global _backend
+    if _backend is not None:
+        return _backend
+
+    wanted = "auto"
+    if "config" in args:
+        cfg = tools.config.load(args)
+        wanted = cfg["waydroid"]["lxc_backend"]
+
+    simulated = tools.helpers.run_core.executor(args).name != "real"
+    if wanted != "cli" and liblxc is not None and not simulated:
+        _backend = LiblxcBackend()
+    else:
+        if wanted == "liblxc":
+            logging.warning("python3-lxc is not installed, falling back to lxc-* tools")
+        _backend = CliBackend()
+    logging.debug("Using {} container backend".format(_backend.name))
+    return _backend
@@ -0,0 +1,166 @@
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+import contextlib
+import http.server
+import logging
+import os
+import socketserver
+import threading
+import time
+
+""" Counters and histograms of the container service, exported in the
+    Prometheus text format. Recording a value only updates a dict under a
+    lock; the text is rendered when somebody scrapes it, either through the
+    GetMetrics D-Bus method or the endpoint configured with metrics_listen
+    in waydroid.cfg ("unix:/path/to/socket" or "host:port"). """
+
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+HELP = {
+    "waydroid_session_starts_total": "Sessions started, by how and result",
+    "waydroid_session_start_seconds": "Time to start a session",
+    "waydroid_session_stops_total": "Sessions stopped",
+    "waydroid_session_stop_seconds": "Time to stop a session",
+    "waydroid_freezes_total": "Containers frozen or thawed",
+    "waydroid_freeze_seconds": "Time to freeze or thaw a container",
+    "waydroid_start_phase_seconds": "Time spent in the phases of a cold start",
+    "waydroid_session_failures_total": "Sessions whose container exited or hung",
+    "waydroid_idle_freezes_total": "Sessions frozen for being idle",
+    "waydroid_session_ready_seconds": "Time from container start until Android is usable",
+    "waydroid_admissions_total": "Cold starts admitted right away, after queueing or rejected",
+}
+
+lock = threading.Lock()
+counters = {}
+histograms = {}
+collectors = []
+
+
+def key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def inc(name, value=1, **labels):
+    with lock:
+        k = key(name, labels)
+        counters[k] = counters.get(k, 0) + value
+
+
+def observe(name, value, **labels):
+    with lock:
+        k = key(name, labels)
+        if k not in histograms:
+            histograms[k] = [[0] * len(BUCKETS), 0, 0.0]
+        hist = histograms[k]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                hist[0][i] += 1
+        hist[1] += 1
+        hist[2] += value
+
+
+@contextlib.contextmanager
+def timed(name, **labels):
+    """
+    Observe how long the body takes, also when it raises.
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - start, **labels)
+
+
+def add_collector(collector):
+    """
+    Register a function that is called on every scrape and returns a list of
+    (name, help, labels, value) gauges, e.g. usage of the running sessions.
+    """
+    collectors.append(collector)
+
+
+def format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace('"', '\\"'))
+                          for k, v in items) + "}"
+
+
+def render():
+    lines = []
+    seen = set()
+    def header(name, kind, help=None):
+        if name not in seen:
+            seen.add(name)
+            lines.append("# HELP {} {}".format(name, help or HELP.get(name, name)))
+            lines.append("# TYPE {} {}".format(name, kind))
+
+    with lock:
+        for (name, labels), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append("{}{} {}".format(name, format_labels(labels), value))
+        for (name, labels), (buckets, count, total) in sorted(histograms.items()):
+            header(name, "histogram")
+            for bound, value in zip(BUCKETS, buckets):
+                lines.append("{}_bucket{} {}".format(name, format_labels(labels, [("le", bound)]), value))
+            lines.append("{}_bucket{} {}".format(name, format_labels(labels, [("le", "+Inf")]), count))
+            lines.append("{}_count{} {}".format(name, format_labels(labels), count))
+            lines.append("{}_sum{} {}".format(name, format_labels(labels), total))
+
+    for collector in collectors:
+        try:
+            gauges = collector()
+        except Exception as e:
+            logging.debug("Metrics collector failed: {}".format(e))
+            continue
+        for name, help, labels, value in gauges:
+            header(name, "gauge", help)
+            lines.append("{}{} {}".format(name, format_labels(sorted(labels.items())), value))
+    return "\n".join(lines) + "\n"
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects an (address, port) client address
+        return request, ("local", 0)
+
+
+def serve(listen):
+    """
+    Serve render() over HTTP in a background thread.
+
+    :param listen: "unix:/path/to/socket" or "host:port"
+    :returns: the server, or None when listen is empty
+    """
+    if not listen:
+        return None
+    if listen.startswith("unix:"):
+        path = listen[len("unix:"):]
+        if os.path.exists(path):
+            os.remove(path)
+        server = UnixHTTPServer(path, Handler)
+        os.chmod(path, 0o660)
+    else:
+        host, port = listen.rsplit(":", 1)
+        server = http.server.ThreadingHTTPServer((host, int(port)), Handler)
+        server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info("Serving metrics on " + listen)
+    return server
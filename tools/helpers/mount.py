@@ -2,8 +2,29 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 import os
 import tools.helpers.run
+import tools.helpers.run_core
+import tools.helpers.trace
 from tools.helpers.version import versiontuple, kernel_version
 
+# Mount table, the benchmarks point this at the one of their fake host
+PROC_MOUNTS = "/proc/mounts"
+
+def mount_lines(source=None):
+    """
+    Read the mount table. With simulated commands (--executor simulate)
+    this is the table the simulated mounts went to, as nothing is mounted
+    for real.
+    :param source: read this file instead (default: PROC_MOUNTS)
+    :returns: list of lines in the format of /proc/mounts
+    """
+    if source is None:
+        simulated = tools.helpers.run_core.simulated_mounts()
+        if simulated is not None:
+            return simulated
+        source = PROC_MOUNTS
+    with open(source, "r") as handle:
+        return handle.read().splitlines()
+
 
 def ismount(folder):
     """
@@ -11,13 +32,12 @@ def ismount(folder):
     Workaround for: https://bugs.python.org/issue29707
     """
     folder = os.path.realpath(os.path.realpath(folder))
-    with open("/proc/mounts", "r") as handle:
-        for line in handle:
-            words = line.split()
-            if len(words) >= 2 and words[1] == folder:
-                return True
-            if words[0] == folder:
-                return True
+    for line in mount_lines():
+        words = line.split()
+        if len(words) >= 2 and words[1] == folder:
+            return True
+        if words and words[0] == folder:
+            return True
     return False
 
 
@@ -44,13 +64,23 @@ def bind(args, source, destination, create_folders=True, umount=False):
                                path)
 
     # Actually mount the folder
-    tools.helpers.run.user(args, ["mount", "-o", "bind", source, destination])
+    with tools.helpers.trace.span(args, "bind", destination=destination):
+        tools.helpers.run.user(args, ["mount", "-o", "bind", source, destination])
 
     # Verify, that it has worked
     if not ismount(destination):
         raise RuntimeError("Mount failed: " + source + " -> " + destination)
 
 
+def make_shared(args, folder):
+    """
+    Turn a folder into a shared mount point, so that mounts created inside of
+    it later propagate to its slave copies (e.g. inside a container).
+    """
+    bind(args, folder, folder)
+    tools.helpers.run.user(args, ["mount", "--make-rshared", folder])
+
+
 def bind_file(args, source, destination, create_folders=False):
     """
     Mount a file with the --bind option, and create the destination file,
@@ -74,38 +104,40 @@ def bind_file(args, source, destination, create_folders=False):
                                 destination])
 
 
-def umount_all_list(prefix, source="/proc/mounts"):
+def umount_all_list(prefix, source=None):
     """
     Parses `/proc/mounts` for all folders beginning with a prefix.
-    :source: can be changed for testcases
+    :source: can be changed for testcases (default: PROC_MOUNTS)
     :returns: a list of folders, that need to be umounted
     """
     ret = []
     prefix = os.path.realpath(prefix)
-    with open(source, "r") as handle:
-        for line in handle:
-            words = line.split()
-            if len(words) < 2:
-                raise RuntimeError("Failed to parse line in " + source + ": " +
-                                   line)
-            mountpoint = words[1]
-            if mountpoint.startswith(prefix):
-                # Remove "\040(deleted)" suffix (#545)
-                deleted_str = r"\040(deleted)"
-                if mountpoint.endswith(deleted_str):
-                    mountpoint = mountpoint[:-len(deleted_str)]
-                ret.append(mountpoint)
+    for line in mount_lines(source):
+        words = line.split()
+        if len(words) < 2:
+            raise RuntimeError("Failed to parse line in " +
+                               (source or PROC_MOUNTS) + ": " + line)
+        mountpoint = words[1]
+        if mountpoint.startswith(prefix):
+            # Remove "\040(deleted)" suffix (#545)
+            deleted_str = r"\040(deleted)"
+            if mountpoint.endswith(deleted_str):
+                mountpoint = mountpoint[:-len(deleted_str)]
+            ret.append(mountpoint)
     ret.sort(reverse=True)
     return ret
 
 
-def umount_all(args, folder):
+def umount_all(args, folder, lazy=False):
     """
     Umount all folders, that are mounted inside a given folder.
+    :param lazy: detach the mounts even when they are still busy (umount -l)
     """
     all_list = umount_all_list(folder)
     for mountpoint in all_list:
-        tools.helpers.run.user(args, ["umount", mountpoint])
+        with tools.helpers.trace.span(args, "umount", destination=mountpoint, lazy=lazy):
+            tools.helpers.run.user(args, ["umount", "-l", mountpoint] if lazy
+                                   else ["umount", mountpoint])
     for mountpoint in all_list:
         if ismount(mountpoint):
             raise RuntimeError("Failed to umount: " + mountpoint)
@@ -145,7 +177,9 @@ def mount(args, source, destination, create_folders=True, umount=False,
         extra_args.extend(["-o", ",".join(opt_args)])
 
     # Actually mount the folder
-    tools.helpers.run.user(args, ["mount", *extra_args, source, destination])
+    with tools.helpers.trace.span(args, "mount", destination=destination,
+                                  type=mount_type or "auto"):
+        tools.helpers.run.user(args, ["mount", *extra_args, source, destination])
 
     # Verify, that it has worked
     if not ismount(destination):
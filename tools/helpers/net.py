@@ -18,16 +18,16 @@ def adb_connect(args):
     # Start and 'warm up' the adb server
     tools.helpers.run.user(args, ["adb", "start-server"])
 
-    ip = get_device_ip_address()
+    ip = get_device_ip_address(args)
     if not ip:
         return
 
     tools.helpers.run.user(args, ["adb", "connect", ip])
     logging.info("Established ADB connection to Waydroid device at {}.".format(ip))
 
-def get_device_ip_address():
-    # The IP address is queried from the DHCP lease file.
-    lease_file = "/var/lib/misc/dnsmasq.waydroid0.leases"
+def get_device_ip_address(args):
+    # The IP address is queried from the DHCP lease file of the session bridge.
+    lease_file = "/var/lib/misc/dnsmasq.waydroid{}.leases".format(args.session_id)
 
     try:
         with open(lease_file) as f:
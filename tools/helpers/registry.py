@@ -0,0 +1,107 @@
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+import copy
+import json
+import logging
+import os
+import tempfile
+import threading
+import tools.config
+import tools.helpers.lxc
+import tools.helpers.mount
+
+""" Durable registry of the sessions tracked by the container service. It is
+    rewritten atomically (temporary file, fsync, rename) whenever a session
+    starts or stops, so a restarted service can pick up the containers that
+    kept running. Every entry holds the session dict, the pid of the process
+    running the container, the container's init pid, whether its network is
+    up and which mounts belong to it. """
+
+lock = threading.Lock()
+
+
+def network_up(session_id):
+    return os.path.exists("/run/waydroid-lxc/session_{}/network_up".format(session_id))
+
+
+def session_mounts(args):
+    ret = []
+    for key in ["rootfs", "late_bind"]:
+        ret.extend(tools.helpers.mount.umount_all_list(tools.config.defaults(args, key)))
+    return ret
+
+
+def entry(args, session, container_pid):
+    return {
+        "session": session,
+        "container_pid": container_pid,
+        "init_pid": tools.helpers.lxc.init_pid(args),
+        "network_up": network_up(args.session_id),
+        "mounts": session_mounts(args),
+    }
+
+
+def save(args, entries):
+    """
+    Atomically replace the registry.
+
+    :param entries: dict of session id to entry(), see above
+    """
+    path = tools.config.defaults(args, "registry")
+    with lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".sessions.")
+        try:
+            with os.fdopen(fd, "w") as handle:
+                json.dump({str(k): v for k, v in entries.items()}, handle)
+                handle.flush()
+                os.fsync(handle.fileno())
+            os.chmod(tmp, 0o600)
+            os.replace(tmp, path)
+        except:
+            os.remove(tmp)
+            raise
+
+
+def load(args):
+    path = tools.config.defaults(args, "registry")
+    try:
+        with open(path) as handle:
+            return {int(k): v for k, v in json.load(handle).items()}
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning("Ignoring broken session registry {}: {}".format(path, e))
+        return {}
+
+
+def reconcile(args, entries):
+    """
+    Compare registry entries with the actual LXC state.
+
+    :returns: (alive, dead) dicts of session id to entry. A session is alive
+              when its container still runs with the recorded init pid and
+              all of its recorded mounts are still in place.
+    """
+    alive = {}
+    dead = {}
+    for session_id, item in entries.items():
+        session_args = copy.copy(args)
+        session_args.session_id = session_id
+        state = tools.helpers.lxc.status(session_args)
+        reason = None
+        if state not in ["RUNNING", "FROZEN"]:
+            reason = "container is " + state
+        elif tools.helpers.lxc.init_pid(session_args) != item.get("init_pid"):
+            reason = "container was restarted"
+        elif not all(tools.helpers.mount.ismount(m) for m in item.get("mounts", [])):
+            reason = "mounts are missing"
+        elif item.get("network_up") and not network_up(session_id):
+            reason = "network is down"
+
+        if reason:
+            logging.info("Not reattaching session {}: {}".format(session_id, reason))
+            dead[session_id] = item
+        else:
+            alive[session_id] = item
+    return alive, dead
@@ -1,6 +1,9 @@
 # Copyright 2021 Oliver Smith
 # SPDX-License-Identifier: GPL-3.0-or-later
 import fcntl
+import fnmatch
+import io
+import json
 import logging
 import selectors
 import subprocess
@@ -12,7 +15,18 @@ import tools.helpers.run
 
 """ For a detailed description of all output modes, read the description of
     core() at the bottom. All other functions in this file get (indirectly)
-    called by core(). """
+    called by core().
+
+    core() hands the commands to an executor, picked with "waydroid
+    --executor" (see executor() below):
+
+    real:     run the commands
+    record:   run the commands and append each one with its duration, exit
+              code and output to --executor-file, as JSON lines
+    simulate: run nothing, answer from the scripted responses in
+              --executor-file. A recording is a valid script, so a session
+              start recorded once can be replayed without root, binder and
+              LXC, e.g. to profile the orchestration around the commands. """
 
 
 def sanity_checks(output="log", output_return=False, check=None):
@@ -244,6 +258,237 @@ def sudo_timer_start(args):
     sudo_timer_iterate()
 
 
+def execute(args, cmd, working_dir=None, output="log", output_return=False,
+            sudo=False, disable_timeout=False):
+    """
+    Run a command on the host, see core() for the parameters.
+
+    :returns: * subprocess.Popen instance (output is "background" or "pipe")
+              * (code, output) otherwise, output is "" unless output_return
+    """
+    # Background
+    if output == "background":
+        return background(args, cmd, working_dir)
+
+    # Pipe
+    if output == "pipe":
+        return pipe(args, cmd, working_dir)
+
+    # Foreground TUI
+    if output == "tui":
+        return (foreground_tui(cmd, working_dir), "")
+
+    # Foreground pipe (always redirects to the error log file)
+    output_to_stdout = False
+    if not args.details_to_stdout and output in ["stdout", "interactive"]:
+        output_to_stdout = True
+
+    output_timeout = output in ["log", "stdout"] and not disable_timeout
+
+    return foreground_pipe(args, cmd, working_dir, output_to_stdout,
+                           output_return, output_timeout, sudo)
+
+
+class RealExecutor:
+    name = "real"
+
+    def run(self, args, cmd, working_dir, output, output_return, sudo,
+            disable_timeout):
+        return execute(args, cmd, working_dir, output, output_return, sudo,
+                       disable_timeout)
+
+
+class RecordExecutor(RealExecutor):
+    name = "record"
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def run(self, args, cmd, working_dir, output, output_return, sudo,
+            disable_timeout):
+        start = time.monotonic()
+        ret = super().run(args, cmd, working_dir, output, output_return, sudo,
+                          disable_timeout)
+        entry = {"cmd": cmd, "duration": round(time.monotonic() - start, 6)}
+        if working_dir:
+            entry["working_dir"] = working_dir
+        if output in ["background", "pipe"]:
+            entry["background"] = True
+        else:
+            entry["code"] = ret[0]
+            if output_return:
+                entry["output"] = ret[1]
+        logging.debug("recorded: {} in {:.1f} ms, exit code {}".format(
+            " ".join(cmd), entry["duration"] * 1000, entry.get("code")))
+        with self.lock:
+            with open(self.path, "a") as handle:
+                handle.write(json.dumps(entry) + "\n")
+        return ret
+
+
+class SimulatedProcess:
+    """
+    Stands in for the subprocess.Popen instance of a simulated background
+    command. There is no process, so its pid is 0.
+    """
+    def __init__(self, response):
+        self.pid = 0
+        self.args = response.get("cmd")
+        self.returncode = response.get("code", 0)
+        self.stdout = io.BytesIO(response.get("output", "").encode("utf-8"))
+        self.stderr = None
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+    def kill(self):
+        pass
+
+    def terminate(self):
+        pass
+
+
+class SimulateExecutor:
+    """
+    Answers commands from a script of JSON lines. A line with "cmd" (a
+    command list) answers exactly that command; several lines for the same
+    command answer its calls in order, the last one repeats. A line with
+    "match" (a shell pattern like "lxc-info * -sH") answers every command
+    that matches it, when no "cmd" line does. Both may set "code",
+    "output" and "duration" (seconds to wait before answering).
+    Everything else succeeds without output. Successful mount and umount
+    commands change a simulated mount table, see simulated_mounts().
+    """
+    name = "simulate"
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.patterns = []
+        # (source, mount point, type, options) of everything mounted
+        self.mounts = []
+        with open(path) as handle:
+            for number, line in enumerate(handle, 1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                try:
+                    response = json.loads(line)
+                except ValueError as e:
+                    raise RuntimeError("Invalid line {} in {}: {}".format(number, path, e))
+                if "cmd" in response:
+                    self.queues.setdefault(tuple(response["cmd"]), []).append(response)
+                elif "match" in response:
+                    self.patterns.append(response)
+                else:
+                    raise RuntimeError("Line {} in {} has neither cmd nor match".format(number, path))
+
+    def response(self, cmd):
+        with self.lock:
+            queue = self.queues.get(tuple(cmd))
+            if queue:
+                return queue.pop(0) if len(queue) > 1 else queue[0]
+        flat = " ".join(cmd)
+        for response in self.patterns:
+            if fnmatch.fnmatchcase(flat, response["match"]):
+                return response
+        logging.debug("No scripted response, succeeding: " + flat)
+        return {}
+
+    def track_mounts(self, cmd):
+        """
+        Apply a mount or umount command to the simulated mount table.
+        """
+        if cmd[:1] == ["sudo"]:
+            cmd = cmd[1:]
+        if cmd[:1] not in [["mount"], ["umount"]]:
+            return
+        fstype, options, paths = "none", "rw", []
+        words = iter(cmd[1:])
+        for word in words:
+            if word == "-t":
+                fstype = next(words, fstype)
+            elif word == "-o":
+                options = next(words, options)
+            elif not word.startswith("-"):
+                paths.append(word)
+
+        with self.lock:
+            if cmd[0] == "mount":
+                # Only "mount source destination" adds a mount, not e.g.
+                # "mount --make-rshared folder"
+                if len(paths) == 2:
+                    self.mounts.append((paths[0], os.path.realpath(paths[1]),
+                                        fstype, options))
+                return
+            for path in paths:
+                for mount in reversed(self.mounts):
+                    if os.path.realpath(path) == mount[1] or path == mount[0]:
+                        self.mounts.remove(mount)
+                        break
+
+    def mount_lines(self):
+        with self.lock:
+            return ["{} {} {} {} 0 0".format(*mount) for mount in self.mounts]
+
+    def run(self, args, cmd, working_dir, output, output_return, sudo,
+            disable_timeout):
+        response = self.response(cmd)
+        if output in ["background", "pipe"]:
+            return SimulatedProcess(response)
+        time.sleep(response.get("duration", 0))
+        if response.get("code", 0) == 0:
+            self.track_mounts(cmd)
+        text = response.get("output", "")
+        if text and output != "tui":
+            args.logfd.write(text)
+            args.logfd.flush()
+        return (response.get("code", 0), text if output_return else "")
+
+
+_executor = None
+
+
+def executor(args):
+    """
+    Pick the executor once per process, from --executor and
+    --executor-file.
+
+    :returns: RealExecutor, RecordExecutor or SimulateExecutor instance
+    """
+    global _executor
+    if _executor is not None:
+        return _executor
+
+    name = args.executor if "executor" in args else "real"
+    path = args.executor_file if "executor_file" in args else None
+    if name in ["record", "simulate"] and not path:
+        raise RuntimeError("--executor {} needs --executor-file".format(name))
+    if name == "record":
+        _executor = RecordExecutor(path)
+    elif name == "simulate":
+        _executor = SimulateExecutor(path)
+    else:
+        _executor = RealExecutor()
+    if _executor.name != "real":
+        logging.info("Using the {} executor with {}".format(_executor.name, path))
+    return _executor
+
+
+def simulated_mounts():
+    """
+    :returns: lines of the simulated mount table in the format of
+              /proc/mounts, None unless commands are simulated
+    """
+    if _executor is None or _executor.name != "simulate":
+        return None
+    return _executor.mount_lines()
+
+
 def core(args, log_message, cmd, working_dir=None, output="log",
          output_return=False, check=None, sudo=False, disable_timeout=False):
     """
@@ -303,40 +548,21 @@ def core(args, log_message, cmd, working_dir=None, output="log",
               * the program's entire output (output_return is True)
     """
     sanity_checks(output, output_return, check)
+    run = executor(args)
 
-    if args.sudo_timer and sudo:
+    if args.sudo_timer and sudo and run.name != "simulate":
         sudo_timer_start(args)
 
     # Log simplified and full command (waydroid -v)
     logging.debug(log_message)
     logging.verbose("run: " + str(cmd))
 
-    # Background
-    if output == "background":
-        return background(args, cmd, working_dir)
-
-    # Pipe
-    if output == "pipe":
-        return pipe(args, cmd, working_dir)
-
-    # Foreground
-    output_after_run = ""
-    if output == "tui":
-        # Foreground TUI
-        code = foreground_tui(cmd, working_dir)
-    else:
-        # Foreground pipe (always redirects to the error log file)
-        output_to_stdout = False
-        if not args.details_to_stdout and output in ["stdout", "interactive"]:
-            output_to_stdout = True
-
-        output_timeout = output in ["log", "stdout"] and not disable_timeout
-
-        (code, output_after_run) = foreground_pipe(args, cmd, working_dir,
-                                                   output_to_stdout,
-                                                   output_return,
-                                                   output_timeout,
-                                                   sudo)
+    # Background and pipe return the process right away
+    ret = run.run(args, cmd, working_dir, output, output_return, sudo,
+                  disable_timeout)
+    if output in ["background", "pipe"]:
+        return ret
+    (code, output_after_run) = ret
 
     # Check the return code
     if check is not False:
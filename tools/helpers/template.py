@@ -0,0 +1,331 @@
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import tools.config
+import tools.helpers.mount
+import tools.helpers.run
+
+""" Golden templates of the Android data directory. A template gets captured
+    once from a session that has been set up (accounts, apps, settings), new
+    sessions then get their data directory provisioned from it as cheaply as
+    the filesystem allows:
+
+    snapshot: btrfs subvolume snapshot, the template is captured into a
+              subvolume when the templates folder is on btrfs
+    reflink:  cp --reflink=always, the copies share their extents (FICLONE)
+              on btrfs, XFS and other filesystems supporting it
+    overlay:  the template stays below an overlay and only the changes of
+              the session get stored. The template is needed on every start,
+              so this is only used when data_template_method asks for it
+    copy:     plain cp -a, works everywhere and is the fallback
+
+    A session remembers its template in template.json next to its data
+    directory, so it only gets provisioned once. Sessions on an overlay are
+    also pinned in the .pins folder of the templates, so their template is
+    neither removed nor replaced while they exist, running or not. """
+
+METHODS = ["snapshot", "reflink", "overlay", "copy"]
+# Inode number of the root directory of every btrfs subvolume
+BTRFS_SUBVOLUME_INODE = 256
+
+
+def check_name(name):
+    if not re.fullmatch(r"[A-Za-z0-9][A-Za-z0-9._-]*", name):
+        raise RuntimeError(f"Invalid template name: {name}")
+
+
+def template_dir(args, name):
+    check_name(name)
+    return tools.config.defaults(args, "templates") + "/" + name
+
+
+def marker_path(session):
+    return os.path.dirname(session["waydroid_data"]) + "/template.json"
+
+
+def filesystem(path):
+    """
+    :returns: type of the filesystem a path is on, e.g. "btrfs"
+    """
+    path = os.path.realpath(path)
+    best, ret = "", ""
+    for line in tools.helpers.mount.mount_lines():
+        words = line.split()
+        if len(words) < 3:
+            continue
+        mountpoint = words[1]
+        if (path == mountpoint or path.startswith(mountpoint.rstrip("/") + "/")) \
+                and len(mountpoint) >= len(best):
+            best, ret = mountpoint, words[2]
+    return ret
+
+
+def is_subvolume(path):
+    return os.stat(path).st_ino == BTRFS_SUBVOLUME_INODE and \
+        filesystem(path) == "btrfs"
+
+
+def remove_tree(args, path):
+    """
+    Remove a folder, which may be a btrfs subvolume.
+    """
+    if not os.path.lexists(path):
+        return
+    if os.path.islink(path) or not os.path.isdir(path):
+        os.unlink(path)
+    elif is_subvolume(path):
+        tools.helpers.run.user(args, ["btrfs", "subvolume", "delete", path])
+    else:
+        shutil.rmtree(path)
+
+
+def remove_template_dir(args, directory):
+    remove_tree(args, directory + "/data")
+    remove_tree(args, directory)
+
+
+def pin(args, marker, name):
+    """
+    Record that the session of a template.json has its data on an overlay
+    over a template.
+    """
+    pins = tools.config.defaults(args, "templates") + "/.pins"
+    os.makedirs(pins, exist_ok=True)
+    path = os.path.join(pins, hashlib.sha256(marker.encode()).hexdigest())
+    with open(path + ".new", "w") as handle:
+        json.dump({"marker": marker, "name": name}, handle)
+    os.replace(path + ".new", path)
+
+
+def pinned(args, name):
+    """
+    Sessions whose overlay is on top of a template, stale pins get removed.
+
+    :returns: list of the template.json files of the sessions
+    """
+    pins = tools.config.defaults(args, "templates") + "/.pins"
+    ret = []
+    for entry in os.scandir(pins) if os.path.isdir(pins) else []:
+        try:
+            with open(entry.path) as handle:
+                item = json.load(handle)
+            with open(item["marker"]) as handle:
+                state = json.load(handle)
+        except (OSError, ValueError, KeyError):
+            # The session's data was deleted
+            os.unlink(entry.path)
+            continue
+        if state.get("method") != "overlay" or state.get("name") != item["name"]:
+            os.unlink(entry.path)
+        elif item["name"] == name:
+            ret.append(item["marker"])
+    return ret
+
+
+def in_use(args, name):
+    """
+    Check whether a session has its data on an overlay over the template,
+    mounted right now or not.
+    """
+    if pinned(args, name):
+        return True
+    lower = "lowerdir=" + template_dir(args, name) + "/data"
+    for line in tools.helpers.mount.mount_lines():
+        words = line.split()
+        if len(words) >= 4 and lower in words[3].split(","):
+            return True
+    return False
+
+
+def list_templates(args):
+    """
+    :returns: dict of template name to its metadata, see capture()
+    """
+    ret = {}
+    folder = tools.config.defaults(args, "templates")
+    if not os.path.isdir(folder):
+        return ret
+    for name in sorted(os.listdir(folder)):
+        try:
+            with open(os.path.join(folder, name, "metadata.json")) as handle:
+                ret[name] = json.load(handle)
+        except (OSError, ValueError):
+            # e.g. a capture that did not finish
+            continue
+    return ret
+
+
+def owner(args, name):
+    """
+    :returns: user id of the user whose data a template holds, None when
+              there is no such template
+    """
+    return list_templates(args).get(name, {}).get("user_id")
+
+
+def capture(args, source, name, session_id, user_id):
+    """
+    Save a data directory as template, replacing an existing template of
+    the same name once the copy is complete. The container using the data
+    should be stopped or frozen.
+
+    :param user_id: user the data belongs to, only their sessions may use
+                    the template
+    """
+    directory = template_dir(args, name)
+    if in_use(args, name):
+        raise RuntimeError(f"Template {name} is in use by a session on an overlay")
+    new = directory + ".new"
+    remove_template_dir(args, new)
+    os.makedirs(new)
+
+    data = new + "/data"
+    # A subvolume can be snapshotted by sessions on the same filesystem
+    if filesystem(new) == "btrfs":
+        tools.helpers.run.user(args, ["btrfs", "subvolume", "create", data], check=False)
+    if not os.path.isdir(data):
+        os.mkdir(data)
+    logging.info(f"Capturing template {name} from {source}")
+    try:
+        tools.helpers.run.user(args, ["cp", "-a", "--reflink=auto", source + "/.", data])
+    except:
+        remove_template_dir(args, new)
+        raise
+
+    cfg = tools.config.load(args)
+    with open(new + "/metadata.json", "w") as handle:
+        json.dump({
+            "created": int(time.time()),
+            "session_id": session_id,
+            "user_id": user_id,
+            "system_datetime": cfg["waydroid"]["system_datetime"],
+            "vendor_datetime": cfg["waydroid"]["vendor_datetime"],
+            "subvolume": is_subvolume(data),
+        }, handle)
+    remove_template_dir(args, directory)
+    os.rename(new, directory)
+
+
+def remove(args, name):
+    directory = template_dir(args, name)
+    if not os.path.exists(directory):
+        raise RuntimeError(f"No template {name}")
+    if in_use(args, name):
+        raise RuntimeError(f"Template {name} is in use by a session on an overlay")
+    remove_template_dir(args, directory)
+    logging.info(f"Removed template {name}")
+
+
+def provision_snapshot(args, source, data):
+    if not is_subvolume(source):
+        raise RuntimeError("the template is not a btrfs subvolume")
+    os.rmdir(data)
+    try:
+        tools.helpers.run.user(args, ["btrfs", "subvolume", "snapshot", source, data])
+    except:
+        os.mkdir(data)
+        raise
+
+
+def provision_reflink(args, source, data):
+    tools.helpers.run.user(args, ["cp", "-a", "--reflink=always", source + "/.", data])
+
+
+def provision_copy(args, source, data):
+    tools.helpers.run.user(args, ["cp", "-a", source + "/.", data])
+
+
+def mount_overlay(args, source, data):
+    if tools.helpers.mount.ismount(data):
+        return
+    folder = os.path.dirname(data)
+    tools.helpers.mount.mount_overlay(args, [source], data, upper_dir=folder + "/data_upper",
+                                      work_dir=folder + "/data_work", readonly=False)
+
+
+PROVISION = {
+    "snapshot": provision_snapshot,
+    "reflink": provision_reflink,
+    "overlay": mount_overlay,
+    "copy": provision_copy,
+}
+
+
+def session_template(args, session):
+    """
+    Look up the template of a session: its "template", or data_template
+    from waydroid.cfg.
+
+    :returns: (name, data folder of the template), (None, None) without one
+    """
+    cfg = tools.config.load(args)
+    name = session.get("template") or cfg["waydroid"]["data_template"]
+    if not name:
+        return None, None
+    source = template_dir(args, name) + "/data"
+    if not os.path.isdir(source):
+        raise RuntimeError(f"No template {name}")
+    # Templates hold accounts and app data of the user who captured them
+    if owner(args, name) != session["user_id"]:
+        raise RuntimeError(f"Template {name} belongs to another user")
+    return name, source
+
+
+def provision(args, session):
+    """
+    Fill the data directory of a new session from its template: the
+    "template" of the session, or data_template from waydroid.cfg. Sessions
+    with data of their own are left alone, sessions on an overlay get it
+    mounted again.
+    """
+    marker = marker_path(session)
+    data = session["waydroid_data"]
+    if os.path.exists(marker):
+        with open(marker) as handle:
+            state = json.load(handle)
+        if state["method"] == "overlay":
+            pin(args, marker, state["name"])
+            mount_overlay(args, template_dir(args, state["name"]) + "/data", data)
+        return
+
+    name, source = session_template(args, session)
+    if not name:
+        return
+    if os.path.isdir(data) and os.listdir(data):
+        logging.info(f"Not provisioning session {args.session_id} from template {name}, it has data already")
+        return
+    os.makedirs(data, exist_ok=True)
+
+    cfg = tools.config.load(args)
+    method = cfg["waydroid"]["data_template_method"]
+    if method == "auto":
+        methods = ["snapshot", "reflink", "copy"]
+    elif method in METHODS:
+        methods = [method] if method == "copy" else [method, "copy"]
+    else:
+        raise RuntimeError(f"Invalid data_template_method: {method}")
+    for method in methods:
+        try:
+            PROVISION[method](args, source, data)
+            break
+        except (OSError, RuntimeError) as e:
+            logging.info(f"Cannot provision with {method}: {e}")
+            # Start over from an empty folder
+            remove_tree(args, data)
+            os.makedirs(data)
+    else:
+        raise RuntimeError(f"Failed to provision session {args.session_id} from template {name}")
+    logging.info(f"Provisioned session {args.session_id} from template {name} ({method})")
+
+    with open(marker, "w") as handle:
+        json.dump({"name": name, "method": method}, handle)
+    if method == "overlay":
+        pin(args, marker, name)
+    for path in [marker, data]:
+        os.chown(path, int(session["user_id"]), int(session["group_id"]))
@@ -0,0 +1,119 @@
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+import glob
+import os
+
+""" Host CPU/NUMA topology from sysfs and the placement of sessions on it.
+    Placement policies (placement_policy in waydroid.cfg):
+
+    none:   sessions may run on every CPU
+    pack:   fill one NUMA node after the other with placement_cpus CPUs per
+            session, so idle nodes stay idle
+    spread: put placement_cpus CPUs per session on the least loaded node
+    numa:   give each session all CPUs and the memory of the least loaded
+            node """
+
+SYSFS_NODES = "/sys/devices/system/node"
+SYSFS_CPUS_ONLINE = "/sys/devices/system/cpu/online"
+
+POLICIES = ["none", "pack", "spread", "numa"]
+
+
+def parse_cpulist(text):
+    """
+    Parse a kernel CPU list like "0-3,8,10-11".
+
+    :returns: sorted list of CPU numbers
+    """
+    ret = set()
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            ret.update(range(int(first), int(last) + 1))
+        else:
+            ret.add(int(part))
+    return sorted(ret)
+
+
+def format_cpulist(cpus):
+    ret = []
+    cpus = sorted(set(cpus))
+    i = 0
+    while i < len(cpus):
+        j = i
+        while j + 1 < len(cpus) and cpus[j + 1] == cpus[j] + 1:
+            j += 1
+        ret.append(str(cpus[i]) if i == j else "{}-{}".format(cpus[i], cpus[j]))
+        i = j + 1
+    return ",".join(ret)
+
+
+def read_cpulist(path):
+    with open(path, "r") as handle:
+        return parse_cpulist(handle.read())
+
+
+def nodes():
+    """
+    :returns: dict of NUMA node id to its online CPUs. Hosts without NUMA
+              support in sysfs look like a single node 0.
+    """
+    online = set(read_cpulist(SYSFS_CPUS_ONLINE)) if os.path.exists(SYSFS_CPUS_ONLINE) \
+        else set(range(os.cpu_count() or 1))
+    ret = {}
+    for path in glob.glob(SYSFS_NODES + "/node[0-9]*/cpulist"):
+        node = int(os.path.basename(os.path.dirname(path))[len("node"):])
+        cpus = [cpu for cpu in read_cpulist(path) if cpu in online]
+        if cpus:
+            ret[node] = cpus
+    if not ret:
+        ret[0] = sorted(online)
+    return ret
+
+
+def place(policy, count, used):
+    """
+    Pick the CPUs and memory nodes of a new session.
+
+    :param policy: one of POLICIES
+    :param count: CPUs per session for "pack" and "spread"
+    :param used: list of CPU lists of the already placed sessions
+    :returns: (cpus, mems) lists, both empty for "none"
+    """
+    if policy not in POLICIES:
+        raise ValueError("Unknown placement policy: " + policy)
+    if policy == "none":
+        return [], []
+
+    topology = nodes()
+    load = {}
+    for cpus in used:
+        for cpu in cpus:
+            load[cpu] = load.get(cpu, 0) + 1
+    node_load = {node: sum(load.get(cpu, 0) for cpu in cpus)
+                 for node, cpus in topology.items()}
+
+    if policy == "numa":
+        node = min(topology, key=lambda n: (node_load[n], n))
+        return list(topology[node]), [node]
+
+    count = max(1, count)
+    if policy == "pack":
+        candidates = [node for node, cpus in sorted(topology.items())
+                      if len([c for c in cpus if not load.get(c)]) >= count]
+        if candidates:
+            node = candidates[0]
+        else:
+            node = min(topology, key=lambda n: (node_load[n], n))
+    else:
+        node = min(topology, key=lambda n: (node_load[n] / len(topology[n]), n))
+
+    cpus = sorted(topology[node], key=lambda c: (load.get(c, 0), c))[:count]
+    if len(cpus) < count:
+        # Session wants more CPUs than the node has, take them from the rest
+        rest = [c for n in sorted(topology) if n != node for c in topology[n]]
+        cpus += sorted(rest, key=lambda c: (load.get(c, 0), c))[:count - len(cpus)]
+    mems = sorted(n for n, node_cpus in topology.items() if set(cpus) & set(node_cpus))
+    return sorted(cpus), mems
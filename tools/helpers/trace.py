@@ -0,0 +1,116 @@
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+import tools.config
+import tools.helpers.metrics
+
+""" Span tracing of session start and stop. Spans are collected per session
+    id and written as Chrome trace events (which Perfetto and
+    chrome://tracing open) to trace.json in the work dir of the session.
+    "waydroid log --trace <sid>" summarizes the slowest spans of it. """
+
+# Keep the buffer of long running sessions bounded
+MAX_EVENTS = 10000
+
+lock = threading.Lock()
+events = {}
+
+
+def trace_path(args):
+    return tools.config.defaults(args, "work") + "/trace.json"
+
+
+def reset(args):
+    """
+    Start a new trace for the session, e.g. at the beginning of do_start().
+    """
+    with lock:
+        events[args.session_id] = []
+
+
+@contextlib.contextmanager
+def span(args, name, phase=False, **extra):
+    """
+    Record how long the body takes as a span of the session's trace.
+
+    :param phase: also observe the duration as a phase of the start metrics
+    :param extra: arguments shown with the span in the trace viewer
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        duration = time.monotonic() - start
+        if phase:
+            tools.helpers.metrics.observe("waydroid_start_phase_seconds", duration, phase=name)
+        add(args, name, start, duration, **extra)
+
+
+def add(args, name, start, duration, **extra):
+    """
+    Record a span that was measured elsewhere, e.g. across callbacks.
+
+    :param start: time.monotonic() at the beginning of the span
+    """
+    event = {
+        "name": name,
+        "ph": "X",
+        "ts": int(start * 1000000),
+        "dur": int(duration * 1000000),
+        "pid": args.session_id,
+        "tid": threading.get_ident(),
+        "args": {k: str(v) for k, v in extra.items()},
+    }
+    with lock:
+        session_events = events.setdefault(args.session_id, [])
+        if len(session_events) < MAX_EVENTS:
+            session_events.append(event)
+
+
+def save(args):
+    """
+    Write the session's trace atomically, next to its other state.
+    """
+    with lock:
+        trace = {
+            "traceEvents": [{"name": "process_name", "ph": "M", "pid": args.session_id,
+                             "args": {"name": "session {}".format(args.session_id)}}]
+                           + list(events.get(args.session_id, [])),
+            "displayTimeUnit": "ms",
+        }
+    path = trace_path(args)
+    try:
+        with open(path + ".tmp", "w") as handle:
+            json.dump(trace, handle)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        logging.debug("Failed to save trace {}: {}".format(path, e))
+
+
+def summary(args, count=15):
+    """
+    :returns: lines describing the slowest spans of the session's trace
+    """
+    path = trace_path(args)
+    if not os.path.exists(path):
+        return ["No trace for session {} in {}".format(args.session_id, path)]
+    with open(path) as handle:
+        spans = [e for e in json.load(handle)["traceEvents"] if e.get("ph") == "X"]
+    if not spans:
+        return ["Trace {} is empty".format(path)]
+
+    first = min(e["ts"] for e in spans)
+    last = max(e["ts"] + e["dur"] for e in spans)
+    ret = ["Session {}: {} spans over {:.1f} ms ({})".format(
+        args.session_id, len(spans), (last - first) / 1000, path)]
+    ret.append("{:>10}  {:>10}  {}".format("ms", "start ms", "span"))
+    for e in sorted(spans, key=lambda e: e["dur"], reverse=True)[:count]:
+        detail = " ".join("{}={}".format(k, v) for k, v in e.get("args", {}).items())
+        ret.append("{:>10.1f}  {:>10.1f}  {} {}".format(
+            e["dur"] / 1000, (e["ts"] - first) / 1000, e["name"], detail).rstrip())
+    return ret
@@ -1,6 +1,5 @@
 import gbinder
 import logging
-import time
 from tools import helpers
 from gi.repository import GLib
 import signal
@@ -9,6 +8,8 @@ import tools.config
 
 INTERFACE = "lineageos.waydroid.IPlatform"
 SERVICE_NAME = "waydroidplatform"
+# Seconds to wait for the service to get registered
+SERVICE_TIMEOUT = 300
 
 TRANSACTION_getprop = 1
 TRANSACTION_setprop = 2
@@ -311,21 +312,29 @@ def get_service(args):
             logging.error("Service Manager never appeared")
             return None
 
-    tries = 1000
-
     remote, status = serviceManager.get_service_sync(SERVICE_NAME)
-    while(not remote):
-        if tries > 0:
-            logging.warning(
-                "Failed to get service {}, trying again...".format(SERVICE_NAME))
-            time.sleep(1)
-            remote, status = serviceManager.get_service_sync(SERVICE_NAME)
-            tries = tries - 1
-        else:
+    if not remote:
+        logging.info("Waiting for service {}...".format(SERVICE_NAME))
+        remote = wait_for_service(serviceManager, SERVICE_NAME)
+        if not remote:
+            logging.error("Service {} never appeared".format(SERVICE_NAME))
             return None
 
     return IPlatform(remote)
 
+# Wakes up when the service gets registered, can be interrupted
+def wait_for_service(sm, name, timeout=SERVICE_TIMEOUT):
+    mainloop = GLib.MainLoop()
+    hndl = sm.add_registration_handler(name, lambda *args: mainloop.quit())
+    GLib.timeout_add_seconds(timeout, lambda: mainloop.quit())
+    GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGINT, lambda _: mainloop.quit(), None)
+    remote, status = sm.get_service_sync(name)
+    if not remote:
+        mainloop.run()
+        remote, status = sm.get_service_sync(name)
+    sm.remove_handler(hndl)
+    return remote
+
 # Like ServiceManager.wait() but can be interrupted
 def wait_for_manager(sm):
     mainloop = GLib.MainLoop()
@@ -3,3 +3,9 @@
 from tools.services.user_manager import start, stop
 from tools.services.clipboard_manager import start, stop
 from tools.services.hardware_manager import start, stop
+from tools.services.container_pool import ContainerPool
+from tools.services.session_watchdog import SessionWatchdog
+from tools.services.idle_freezer import IdleFreezer
+from tools.services.session_readiness import SessionReadiness
+from tools.services.admission_control import AdmissionControl, NoCapacityError
+from tools.services.session_autoscaler import SessionAutoscaler
@@ -0,0 +1,206 @@
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+import logging
+import os
+import threading
+import time
+import tools.config
+from tools import helpers
+import dbus.exceptions
+from gi.repository import GLib
+
+""" Admission control for cold starts. Before a container gets started, the
+    host has to have room for it according to the budgets in waydroid.cfg
+    (0 turns a check off):
+
+    session_memory_reserve: MiB every session is expected to need. Sessions
+                            that don't use that much yet still hold the
+                            rest, so a burst of starts can't overcommit
+    admission_min_available: MiB of MemAvailable that have to be left over
+                             after all reservations
+    admission_memory_pressure, admission_cpu_pressure: highest "some avg10"
+                             of /proc/pressure/{memory,cpu}, in percent
+    admission_load: highest 1 minute load average per CPU
+
+    A start that doesn't fit waits up to admission_timeout seconds for room
+    and then fails with a NoCapacity error, so callers see back-pressure
+    instead of all sessions slowing down. Waiting starts are queued on the
+    main loop, first come first served, so they don't hold worker threads
+    of the container manager that stops need. """
+
+# How often waiting starts check the host again
+RECHECK_SECONDS = 1
+MIB = 1024 * 1024
+
+
+class NoCapacityError(dbus.exceptions.DBusException):
+    _dbus_error_name = "id.waydro.ContainerManager.Error.NoCapacity"
+
+
+def mem_available():
+    """
+    :returns: MemAvailable of /proc/meminfo in bytes
+    """
+    with open("/proc/meminfo") as handle:
+        for line in handle:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError("No MemAvailable in /proc/meminfo")
+
+
+def pressure(resource):
+    """
+    :returns: "some avg10" of a pressure stall file, 0 without PSI support
+    """
+    try:
+        with open("/proc/pressure/" + resource) as handle:
+            for line in handle:
+                words = line.split()
+                if words and words[0] == "some":
+                    return float(dict(word.split("=") for word in words[1:])["avg10"])
+    except (OSError, KeyError, ValueError):
+        pass
+    return 0.0
+
+
+class AdmissionControl:
+    def __init__(self, manager):
+        self.manager = manager
+        self.lock = threading.Lock()
+        self.admitted = set()
+        self.queue = []
+        self.timer = None
+
+    def budgets(self):
+        cfg = tools.config.load(self.manager.args)["waydroid"]
+        return {
+            "reserve": int(cfg["session_memory_reserve"]) * MIB,
+            "min_available": int(cfg["admission_min_available"]) * MIB,
+            "memory_pressure": float(cfg["admission_memory_pressure"]),
+            "cpu_pressure": float(cfg["admission_cpu_pressure"]),
+            "load": float(cfg["admission_load"]),
+            "timeout": int(cfg["admission_timeout"]),
+        }
+
+    def outstanding(self, session_id, reserve):
+        """
+        Memory reserved by admitted sessions, but not used by them yet.
+        """
+        ret = 0
+        for admitted in self.admitted - {session_id}:
+            used = 0
+            cgroup = helpers.lxc.container_cgroup(self.manager.session_args(admitted))
+            if cgroup is not None:
+                try:
+                    used = int(helpers.cgroup.read(cgroup, "memory.current"))
+                except (OSError, ValueError):
+                    pass
+            ret += max(0, reserve - used)
+        return ret
+
+    def check(self, session_id, budgets):
+        """
+        :returns: why there is no room for the session, None if there is
+        """
+        if budgets["reserve"] or budgets["min_available"]:
+            left = mem_available() - self.outstanding(session_id, budgets["reserve"]) \
+                - budgets["reserve"]
+            if left < budgets["min_available"]:
+                return "{} MiB of memory available, {} MiB needed".format(
+                    (left + budgets["reserve"]) // MIB,
+                    (budgets["reserve"] + budgets["min_available"]) // MIB)
+        for resource in ["memory", "cpu"]:
+            limit = budgets[resource + "_pressure"]
+            value = pressure(resource) if limit else 0
+            if value > limit:
+                return f"{resource} pressure is {value:.1f}%, the limit is {limit:g}%"
+        if budgets["load"]:
+            load = os.getloadavg()[0] / (os.cpu_count() or 1)
+            if load > budgets["load"]:
+                return f"load is {load:.2f} per CPU, the limit is {budgets['load']:g}"
+        return None
+
+    def try_admit(self, session_id, budgets=None):
+        """
+        Reserve room for a session if the host has it right now. Sessions
+        that hold a reservation already keep it.
+
+        :returns: why there is no room, None once the session is admitted
+        """
+        with self.lock:
+            if session_id in self.admitted:
+                return None
+            reason = self.check(session_id, budgets or self.budgets())
+            if reason is None:
+                self.admitted.add(session_id)
+            return reason
+
+    def hold(self, session_id):
+        """
+        Count a session that runs already against the budgets, e.g. one
+        that was reattached or handed out by the warm pool.
+        """
+        with self.lock:
+            self.admitted.add(session_id)
+
+    def admit(self, session_id, admitted, rejected):
+        """
+        Wait up to admission_timeout for room to start a session. Called on
+        the main loop, the callbacks run there as well.
+
+        :param admitted: called once the session holds its reservation
+        :param rejected: called with a NoCapacityError when the host stays
+                         too busy
+        """
+        budgets = self.budgets()
+        if self.queue:
+            # Room that frees up goes to the starts waiting for it first
+            reason = "earlier starts are waiting for capacity"
+        else:
+            reason = self.try_admit(session_id, budgets)
+        if reason is None:
+            helpers.metrics.inc("waydroid_admissions_total", result="admitted")
+            admitted()
+            return
+        if budgets["timeout"] <= 0:
+            helpers.metrics.inc("waydroid_admissions_total", result="rejected")
+            rejected(NoCapacityError(f"No capacity for session {session_id}: {reason}"))
+            return
+        logging.info(f"Waiting for capacity to start session {session_id}: {reason}")
+        self.queue.append({"session_id": session_id, "reason": reason,
+                           "deadline": time.monotonic() + budgets["timeout"],
+                           "admitted": admitted, "rejected": rejected})
+        if self.timer is None:
+            self.timer = GLib.timeout_add_seconds(RECHECK_SECONDS, self.recheck)
+
+    def recheck(self):
+        budgets = self.budgets()
+        # Callbacks may queue more starts
+        queue, self.queue = self.queue, []
+        waiting = []
+        for start in queue:
+            # Later starts must not take the room an earlier one waits for
+            if not waiting:
+                start["reason"] = self.try_admit(start["session_id"], budgets)
+                if start["reason"] is None:
+                    helpers.metrics.inc("waydroid_admissions_total", result="queued")
+                    start["admitted"]()
+                    continue
+            if time.monotonic() >= start["deadline"]:
+                helpers.metrics.inc("waydroid_admissions_total", result="rejected")
+                start["rejected"](NoCapacityError(
+                    f"No capacity for session {start['session_id']}: {start['reason']}"))
+                continue
+            waiting.append(start)
+        self.queue = waiting + self.queue
+        if self.queue:
+            return True
+        self.timer = None
+        return False
+
+    def release(self, session_id):
+        """
+        Give up the reservation of a session, e.g. because it stopped.
+        """
+        with self.lock:
+            self.admitted.discard(session_id)
@@ -0,0 +1,216 @@
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+import json
+import logging
+import os
+import tempfile
+import threading
+import tools.actions.container_manager
+import tools.config
+from tools import helpers
+from gi.repository import GLib
+
+""" Warm pool of booted and frozen containers. After a session of a given id
+    has run once, its description is remembered in pool_session.json. The
+    pool boots a container for it in the background with everything except
+    the user's sockets and user properties, waits until Android finished
+    booting and freezes it. When the same user starts that session again,
+    the sockets get bind-mounted into the shared XDG_RUNTIME_DIR staging
+    directory, the container is thawed and the user properties are set.
+
+    The pool is keyed by session id because the rootfs, LXC config and
+    network of a container all belong to one session id. Handouts to another
+    user or with a different data path or screen density are refused and
+    fall back to a cold start. """
+
+
+def session_file(args):
+    return tools.config.defaults(args, "work") + "/pool_session.json"
+
+
+class ContainerPool:
+    def __init__(self, manager):
+        self.manager = manager
+        self.cond = threading.Condition()
+        self.ready = {}
+        self.booting = set()
+        self.stopping = False
+
+    def size(self):
+        cfg = tools.config.load(self.manager.args)
+        return int(cfg["waydroid"]["pool_size"])
+
+    def remember(self, args, session):
+        """
+        Store the session a container was started for, so the pool can boot
+        a container for it again once it is stopped.
+        """
+        session = {k: v for k, v in session.items()
+                   if k not in ["pid", "state", "pool", "pooled"]}
+        path = session_file(args)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".pool_session.")
+        try:
+            with os.fdopen(fd, "w") as handle:
+                json.dump(session, handle)
+            os.replace(tmp, path)
+        except:
+            os.remove(tmp)
+            raise
+
+    def candidates(self):
+        """
+        Session ids that have run before and are neither tracked by the
+        container manager nor by the pool, lowest id first.
+        """
+        ret = []
+        work = tools.config.defaults(self.manager.args, "work_root")
+        for entry in os.listdir(work) if os.path.isdir(work) else []:
+            if not entry.startswith("session_"):
+                continue
+            try:
+                session_id = int(entry[len("session_"):])
+            except ValueError:
+                continue
+            if not os.path.exists(os.path.join(work, entry, "pool_session.json")):
+                continue
+            if session_id in self.manager.sessions or session_id in self.ready \
+                    or session_id in self.booting:
+                continue
+            ret.append(session_id)
+        return sorted(ret)
+
+    def refill(self):
+        """
+        Boot containers in the background until the pool has pool_size
+        ready or booting containers.
+        """
+        size = self.size()
+        with self.cond:
+            if self.stopping:
+                return
+            free = size - len(self.ready) - len(self.booting)
+            for session_id in self.candidates()[:max(0, free)]:
+                # Sessions users start come first. A container handed out
+                # keeps the reservation, its session doesn't queue again
+                if self.manager.admission.try_admit(session_id) is not None:
+                    logging.info("Not refilling the pool, the host is busy")
+                    break
+                self.booting.add(session_id)
+                threading.Thread(target=self.boot, args=(session_id,),
+                                 daemon=True).start()
+
+    def boot(self, session_id):
+        args = self.manager.session_args(session_id)
+        try:
+            with open(session_file(args)) as handle:
+                session = json.load(handle)
+            session["pool"] = "true"
+            logging.info(f"Booting pool container for session {session_id}")
+
+            helpers.mount.make_shared(args, tools.config.defaults(args, "late_bind"))
+            tools.actions.container_manager.do_start(args, session)
+            cfg = tools.config.load(args)
+            timeout = int(cfg["waydroid"]["boot_timeout"])
+            booted = threading.Event()
+            self.manager.readiness.watch(session_id, booted.set)
+            with helpers.trace.span(args, "android_boot"):
+                if not booted.wait(timeout):
+                    raise OSError(f"Android did not finish booting within {timeout} seconds")
+            tools.actions.container_manager.freeze(args)
+        except Exception as e:
+            logging.error(f"Failed to boot pool container for session {session_id}: {e}")
+            GLib.idle_add(self.manager.readiness.forget, session_id)
+            tools.actions.container_manager.stop(args, False)
+            self.manager.admission.release(session_id)
+            with self.cond:
+                self.booting.discard(session_id)
+                self.cond.notify_all()
+            return
+
+        with self.cond:
+            if not self.stopping:
+                self.booting.discard(session_id)
+                self.ready[session_id] = (session, args.container_pid)
+                self.cond.notify_all()
+                logging.info(f"Pool container for session {session_id} is ready")
+                return
+        tools.actions.container_manager.stop(args, False)
+        self.manager.admission.release(session_id)
+        with self.cond:
+            self.booting.discard(session_id)
+            self.cond.notify_all()
+
+    def take(self, args, session):
+        """
+        Hand out the pooled container of a session, if there is a matching one.
+
+        :returns: True when the container is running for the session (and
+                  args.container_pid is set), False when a cold start is needed
+        """
+        with self.cond:
+            while args.session_id in self.booting:
+                self.cond.wait()
+            pooled = self.ready.pop(args.session_id, None)
+        if pooled is None:
+            return False
+
+        pool_session, pid = pooled
+        for key in ["user_id", "waydroid_data", "lcd_density", "ephemeral"]:
+            if pool_session.get(key) != session.get(key):
+                logging.info(f"Pool container for session {args.session_id} does not match ({key}), starting a new one")
+                tools.actions.container_manager.stop(args, False)
+                return False
+
+        try:
+            self.attach_user(args, session)
+        except Exception as e:
+            logging.error(f"Failed to hand out pool container for session {args.session_id}: {e}")
+            tools.actions.container_manager.stop(args, False)
+            return False
+
+        session["pooled"] = "true"
+        args.session = session
+        args.container_pid = pid
+        logging.info(f"Handed out pool container for session {args.session_id}")
+        return True
+
+    def attach_user(self, args, session):
+        late_bind = tools.config.defaults(args, "late_bind")
+
+        wayland_host_socket = os.path.realpath(os.path.join(session["xdg_runtime_dir"], session["wayland_display"]))
+        if not os.path.exists(wayland_host_socket) or \
+                str(os.stat(wayland_host_socket).st_uid) != session["user_id"]:
+            raise OSError("Wayland socket is not owned by user: " + wayland_host_socket)
+        helpers.mount.bind_file(args, wayland_host_socket, os.path.join(
+            late_bind, tools.config.defaults(args, "container_wayland_display")))
+
+        pulse_host_socket = os.path.join(session["pulse_runtime_path"], "native")
+        if os.path.exists(pulse_host_socket) and \
+                str(os.stat(pulse_host_socket).st_uid) == session["user_id"]:
+            pulse_dir = os.path.basename(tools.config.defaults(args, "container_pulse_runtime_path"))
+            helpers.mount.bind_file(args, pulse_host_socket, os.path.join(
+                late_bind, pulse_dir, "native"), create_folders=True)
+
+        tools.actions.container_manager.unfreeze(args)
+        # ro.sf.lcd_density is read-only, take() only hands out containers
+        # that were booted with the right value
+        for prop in helpers.images.session_props(args, session):
+            key, value = prop.split("=", 1)
+            if not key.startswith("ro."):
+                helpers.lxc.setprop(args, key, value)
+
+    def drain(self):
+        """
+        Stop all pool containers, waiting for the ones that are still booting.
+        """
+        with self.cond:
+            self.stopping = True
+            ready = self.ready
+            self.ready = {}
+        for session_id in ready:
+            logging.info(f"Stopping pool container for session {session_id}")
+            tools.actions.container_manager.stop(self.manager.session_args(session_id), False)
+            self.manager.admission.release(session_id)
+        with self.cond:
+            while self.booting:
+                self.cond.wait()
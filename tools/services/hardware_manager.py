@@ -27,6 +27,7 @@ def start(args):
 
     def reboot():
         helpers.lxc.stop(args)
+        helpers.lxc.wait_for_state(args, "STOPPED")
         helpers.lxc.start(args)
 
     def upgrade(system_zip, system_time, vendor_zip, vendor_time):
@@ -43,7 +44,9 @@ def start(args):
         else:
             vendor_zip = "" # Race prevention
         helpers.lxc.stop(args)
+        helpers.lxc.wait_for_state(args, "STOPPED")
         helpers.images.umount_rootfs(args)
+        helpers.images.umount_base(args)
         helpers.images.replace(args, system_zip, system_time,
                                vendor_zip, vendor_time)
         args.session["background_start"] = "false"
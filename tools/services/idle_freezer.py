@@ -0,0 +1,160 @@
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+import functools
+import logging
+import os
+import time
+import tools.actions.container_manager
+import tools.config
+from tools import helpers
+from gi.repository import GLib
+
+""" Freezes sessions that have been idle for idle_freeze_timeout seconds.
+    A session counts as active while its cgroup uses more than
+    idle_cpu_percent of a CPU (this includes rendering for the Wayland
+    compositor and handling input), while binder transactions happen (when
+    the binderfs of the session exposes binder_logs/stats) and whenever a
+    client reports activity with NotifyActivity: app launches, intents and
+    the user monitor of the session manager do (see
+    tools.helpers.ipc.notify_activity).
+
+    Sessions frozen here are thawed by the next Unfreeze or NotifyActivity
+    call. The Freeze that clients like "waydroid prop get" send after their
+    request is ignored for such sessions, so they go back to idle tracking
+    instead of staying frozen for good. """
+
+INTERVAL = 10
+# How long after an Unfreeze a Freeze still counts as part of the request
+REQUEST_SECONDS = 60
+
+
+class IdleFreezer:
+    def __init__(self, manager):
+        self.manager = manager
+        self.last_active = {}
+        self.samples = {}
+        self.auto_frozen = set()
+        self.auto_thawed = {}
+        GLib.timeout_add_seconds(INTERVAL, self.tick)
+
+    def timeout(self):
+        cfg = tools.config.load(self.manager.args)
+        return int(cfg["waydroid"]["idle_freeze_timeout"]), \
+            float(cfg["waydroid"]["idle_cpu_percent"])
+
+    def sample(self, args):
+        """
+        :returns: (cpu usage in usec, binder transactions) of the session
+        """
+        usage = 0
+        cgroup = helpers.lxc.container_cgroup(args)
+        if cgroup is not None:
+            try:
+                usage = int(helpers.cgroup.read_keyed(cgroup, "cpu.stat").get("usage_usec", 0))
+            except OSError:
+                pass
+
+        transactions = 0
+        stats = os.path.join(tools.config.defaults(args, "binderfs"), "binder_logs", "stats")
+        try:
+            with open(stats, "r") as handle:
+                for line in handle:
+                    words = line.split()
+                    if len(words) == 2 and words[0] in ["BC_TRANSACTION:", "BC_REPLY:"]:
+                        transactions += int(words[1])
+                    elif line.startswith("proc "):
+                        # Only the global totals come before the first proc
+                        break
+        except (OSError, ValueError):
+            pass
+        return usage, transactions
+
+    def tick(self):
+        timeout, cpu_percent = self.timeout()
+        if timeout <= 0:
+            return True
+
+        for session_id in list(self.manager.sessions):
+            # Sessions that get started, stopped, captured etc. right now
+            # are left alone
+            if session_id in self.auto_frozen or session_id in self.manager.busy:
+                continue
+            args = self.manager.session_args(session_id)
+            self.manager.run_async(
+                [session_id], functools.partial(self.check, args, timeout, cpu_percent),
+                functools.partial(self.checked, args, time.monotonic()), lambda *result: None,
+                lambda e, session_id=session_id: logging.error(f"Failed to freeze idle session {session_id}: {e}"))
+        return True
+
+    def check(self, args, timeout, cpu_percent):
+        """
+        Sample a session and freeze it once it has been idle for timeout
+        seconds. Called on a worker thread.
+
+        :returns: True when the session got frozen
+        """
+        session_id = args.session_id
+        if helpers.lxc.status(args) != "RUNNING":
+            return False
+
+        now = time.monotonic()
+        usage, transactions = self.sample(args)
+        previous = self.samples.get(session_id)
+        self.samples[session_id] = (now, usage, transactions)
+        self.last_active.setdefault(session_id, now)
+        if previous is not None:
+            elapsed = (now - previous[0]) * 1000000
+            busy = elapsed > 0 and (usage - previous[1]) * 100 / elapsed > cpu_percent
+            if busy or transactions != previous[2]:
+                self.last_active[session_id] = now
+
+        if now - self.last_active[session_id] < timeout:
+            return False
+        logging.info(f"Session {session_id} idle for {timeout} seconds, freezing it")
+        tools.actions.container_manager.freeze(args)
+        return True
+
+    def checked(self, args, started, frozen):
+        if not frozen:
+            return
+        if self.last_active.get(args.session_id, 0) > started:
+            # Activity was reported while the session got frozen
+            logging.info(f"Thawing idle session {args.session_id}")
+            self.manager.run_async([args.session_id],
+                                   lambda: tools.actions.container_manager.unfreeze(args),
+                                   lambda result: None, lambda *result: None, logging.error)
+            return
+        self.auto_frozen.add(args.session_id)
+        helpers.metrics.inc("waydroid_idle_freezes_total")
+
+    def activity(self, session_id):
+        self.last_active[session_id] = time.monotonic()
+        self.samples.pop(session_id, None)
+
+    def thaw(self, session_id):
+        """
+        Note an Unfreeze request. Returns True when the session was frozen
+        by the idle scheduler.
+        """
+        self.activity(session_id)
+        if session_id in self.auto_frozen:
+            self.auto_frozen.discard(session_id)
+            self.auto_thawed[session_id] = time.monotonic()
+            return True
+        return False
+
+    def skip_freeze(self, session_id):
+        """
+        Check whether a Freeze request only returns a session to the state
+        before the last Unfreeze, which the idle scheduler handles.
+        """
+        thawed = self.auto_thawed.pop(session_id, None)
+        if thawed is not None and time.monotonic() - thawed < REQUEST_SECONDS:
+            return True
+        self.auto_frozen.discard(session_id)
+        return False
+
+    def forget(self, session_id):
+        for state in [self.last_active, self.samples, self.auto_thawed]:
+            state.pop(session_id, None)
+        self.auto_frozen.discard(session_id)
@@ -0,0 +1,121 @@
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+import functools
+import itertools
+import logging
+import time
+import tools.config
+import tools.helpers.ipc
+from tools.services.admission_control import NoCapacityError
+import dbus
+from gi.repository import GLib
+
+""" Keeps autoscale_idle sessions of the session manager ready and unclaimed,
+    with at most autoscale_max sessions in total. Jobs take a session with
+    the Claim D-Bus method of the session manager and give it back with
+    Release, or drop it with RemoveSession. Only sessions the autoscaler
+    added itself get removed again when too many are idle. When the host
+    has no capacity, adding waits for a backoff that doubles up to
+    MAX_BACKOFF; sessions that failed to start for other reasons are not
+    tried again. """
+
+INTERVAL = 10
+# Longest wait before adding again after NoCapacity errors
+MAX_BACKOFF = 300
+
+
+class SessionAutoscaler:
+    def __init__(self, manager):
+        self.manager = manager
+        self.added = set()
+        self.unavailable = set()
+        self.backoff = 0
+        self.retry_at = 0
+        bus = dbus.SystemBus()
+        bus.add_signal_receiver(self.session_ready, signal_name="SessionReady",
+                                dbus_interface="id.waydro.ContainerManager",
+                                bus_name="id.waydro.Container")
+        bus.add_signal_receiver(self.session_failed, signal_name="SessionFailed",
+                                dbus_interface="id.waydro.ContainerManager",
+                                bus_name="id.waydro.Container")
+        GLib.idle_add(self.refresh)
+        GLib.timeout_add_seconds(INTERVAL, self.tick)
+
+    def targets(self):
+        cfg = tools.config.load(self.manager.args)
+        return int(cfg["waydroid"]["autoscale_idle"]), \
+            int(cfg["waydroid"]["autoscale_max"])
+
+    def refresh(self):
+        # Sessions that became ready before we listened for SessionReady
+        container = tools.helpers.ipc.DBusContainerService()
+        for session_id in list(self.manager.session_ids):
+            container.IsReady(session_id,
+                              reply_handler=functools.partial(self.is_ready, session_id),
+                              error_handler=logging.debug)
+        # Sessions not known to be ready yet count as starting
+        self.scale()
+        return False
+
+    def is_ready(self, session_id, ready):
+        if ready:
+            self.session_ready(session_id)
+
+    def session_ready(self, session_id):
+        if session_id in self.manager.session_ids:
+            self.manager.ready.add(session_id)
+            self.scale()
+
+    def session_failed(self, session_id, reason, action):
+        self.manager.ready.discard(session_id)
+        if action == "stopped":
+            self.manager.session_ids.discard(session_id)
+            self.manager.claimed.discard(session_id)
+            self.added.discard(session_id)
+            self.scale()
+
+    def tick(self):
+        self.scale()
+        return True
+
+    def add_done(self, session_id):
+        self.backoff = 0
+
+    def add_failed(self, session_id, e):
+        name = e.get_dbus_name() if isinstance(e, dbus.DBusException) else None
+        if name == "org.freedesktop.DBus.Error.NoReply":
+            # The session manager checks on it, see check_added
+            return
+        self.added.discard(session_id)
+        if name == NoCapacityError._dbus_error_name:
+            self.backoff = min(MAX_BACKOFF, max(INTERVAL, self.backoff * 2))
+            self.retry_at = time.monotonic() + self.backoff
+            logging.info(f"No capacity to add session {session_id}, trying again in {self.backoff} seconds")
+            return
+        logging.error(f"Autoscaler failed to add session {session_id}: {e}")
+        self.unavailable.add(session_id)
+
+    def scale(self):
+        target, limit = self.targets()
+        if target <= 0:
+            return
+        ids = self.manager.session_ids
+        idle = sorted(self.manager.ready - self.manager.claimed)
+        # Sessions still starting are going to be idle once they are ready
+        starting = ids - self.manager.ready
+        missing = min(target - len(idle) - len(starting), limit - len(ids))
+        if time.monotonic() < self.retry_at:
+            missing = 0
+        for _ in range(max(0, missing)):
+            session_id = next(i for i in itertools.count()
+                              if i not in ids and i not in self.unavailable)
+            logging.info(f"Autoscaler adding session {session_id}")
+            self.added.add(session_id)
+            self.manager.add_session(session_id, functools.partial(self.add_done, session_id),
+                                     functools.partial(self.add_failed, session_id))
+
+        surplus = [i for i in reversed(idle) if i in self.added][:max(0, len(idle) - target)]
+        for session_id in surplus:
+            logging.info(f"Autoscaler removing idle session {session_id}")
+            self.added.discard(session_id)
+            self.manager.remove_session(session_id, lambda: None, logging.error)
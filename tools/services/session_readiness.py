@@ -0,0 +1,151 @@
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+import logging
+import threading
+import time
+import gbinder
+import tools.config
+from tools import helpers
+from tools.interfaces import IPlatform
+from gi.repository import GLib
+
+""" Tracks when Android in a session becomes usable. A presence handler on
+    the session's binder service manager notices it coming up. A thread
+    then sleeps until the platform service registers and waits for
+    sys.boot_completed inside the container (see lxc.wait_for_prop), so
+    nothing polls from the host while Android boots. Ready sessions are
+    announced with the SessionReady D-Bus signal and listed in the
+    ReadySessions property of the container service. """
+
+# How often old python-gbinder without registration handlers looks for the
+# platform service
+POLL_SECONDS = 0.1
+
+
+class SessionReadiness:
+    def __init__(self, manager):
+        self.manager = manager
+        self.tokens = {}
+        self.handlers = {}
+        self.started = {}
+        self.ready = set()
+        # Events the boot threads sleep on, set to wake them up
+        self.wakeups = {}
+        self.callbacks = {}
+
+    def watch(self, session_id, booted=None):
+        """
+        Start tracking a session whose container was just started. May be
+        called from any thread.
+
+        :param booted: called on the main loop once Android booted, instead
+                       of announcing the session as ready. Used for the
+                       containers of the warm pool
+        """
+        GLib.idle_add(self.start_watch, session_id, booted)
+
+    def start_watch(self, session_id, booted=None):
+        self.forget(session_id)
+        token = object()
+        self.tokens[session_id] = token
+        self.started[session_id] = time.monotonic()
+        if booted is not None:
+            self.callbacks[session_id] = booted
+
+        args = self.manager.session_args(session_id)
+        helpers.drivers.loadBinderNodes(args)
+        binder = tools.config.defaults(args, "binderfs") + args.BINDER_DRIVER
+        try:
+            try:
+                sm = gbinder.ServiceManager(binder, args.SERVICE_MANAGER_PROTOCOL, args.BINDER_PROTOCOL)
+            except TypeError:
+                sm = gbinder.ServiceManager(binder)
+        except Exception as e:
+            logging.warning(f"Cannot track readiness of session {session_id}: {e}")
+            self.tokens.pop(session_id)
+            return False
+
+        def presence():
+            if sm.is_present() and self.tokens.get(session_id) is token:
+                self.remove_handler(session_id)
+                threading.Thread(target=self.wait_for_boot, args=(session_id, token, sm),
+                                 daemon=True).start()
+        self.handlers[session_id] = (sm, sm.add_presence_handler(presence))
+        presence()
+        return False
+
+    def wait_for_boot(self, session_id, token, sm):
+        registered = threading.Event()
+        self.wakeups[session_id] = registered
+        try:
+            handler = sm.add_registration_handler(IPlatform.SERVICE_NAME, lambda *_: registered.set())
+        except AttributeError:
+            # Old python-gbinder, look for the service every POLL_SECONDS
+            handler = None
+
+        try:
+            while True:
+                if self.tokens.get(session_id) is not token:
+                    return
+                remote, status = sm.get_service_sync(IPlatform.SERVICE_NAME)
+                if remote:
+                    break
+                # Woken up by the registration handler or by forget()
+                registered.wait(None if handler is not None else POLL_SECONDS)
+                registered.clear()
+        finally:
+            if handler is not None:
+                sm.remove_handler(handler)
+
+        args = self.manager.session_args(session_id)
+        if helpers.lxc.wait_for_prop(args, "sys.boot_completed", "1"):
+            GLib.idle_add(self.set_ready, session_id, token)
+
+    def set_ready(self, session_id, token):
+        if self.tokens.get(session_id) is not token:
+            return False
+        booted = self.callbacks.pop(session_id, None)
+        if booted is not None:
+            self.forget(session_id)
+            booted()
+            return False
+        elapsed = time.monotonic() - self.started[session_id]
+        logging.info(f"Session {session_id} is ready after {elapsed:.1f} seconds")
+        helpers.metrics.observe("waydroid_session_ready_seconds", elapsed)
+        args = self.manager.session_args(session_id)
+        helpers.trace.add(args, "android_boot", self.started[session_id], elapsed)
+        helpers.trace.save(args)
+        self.ready.add(session_id)
+        self.manager.SessionReady(session_id)
+        self.manager.PropertiesChanged("id.waydro.ContainerManager",
+                                       self.manager.GetAll("id.waydro.ContainerManager"), [])
+        return False
+
+    def is_ready(self, session_id):
+        return session_id in self.ready
+
+    def waiting(self, session_id):
+        """
+        Check whether a tracked session has not become ready yet.
+        """
+        return session_id in self.tokens and session_id not in self.ready
+
+    def remove_handler(self, session_id):
+        if session_id in self.handlers:
+            sm, handler = self.handlers.pop(session_id)
+            sm.remove_handler(handler)
+
+    def forget(self, session_id):
+        """
+        Stop tracking a session, e.g. because it is stopped.
+        """
+        self.tokens.pop(session_id, None)
+        self.callbacks.pop(session_id, None)
+        self.remove_handler(session_id)
+        wakeup = self.wakeups.pop(session_id, None)
+        if wakeup is not None:
+            wakeup.set()
+        if session_id in self.ready:
+            self.ready.discard(session_id)
+            self.manager.PropertiesChanged("id.waydro.ContainerManager",
+                                           self.manager.GetAll("id.waydro.ContainerManager"), [])
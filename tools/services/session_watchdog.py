@@ -0,0 +1,120 @@
+# Copyright 2026 Waydroid contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+import logging
+import os
+import time
+import tools.actions.container_manager
+import tools.config
+from tools import helpers
+from gi.repository import GLib
+
+""" Supervisor for the containers of the container service. The process
+    running each container (lxc-start -F) is watched through a pidfd in the
+    main loop, so its exit is noticed and reaped right away. Containers that
+    exit or do not finish booting within boot_timeout get cleaned up and
+    started again, waiting restart_backoff * 2^n seconds before the n-th
+    retry. After restart_limit failures in a row the session is dropped.
+    Every failure is announced with the SessionFailed D-Bus signal. """
+
+# A session that ran this long is considered healthy again
+STABLE_SECONDS = 300
+MAX_BACKOFF = 300
+
+
+class SessionWatchdog:
+    def __init__(self, manager):
+        self.manager = manager
+        self.watches = {}
+        self.failures = {}
+        self.started = {}
+
+    def watch(self, session_id, pid, check_boot=True):
+        """
+        Supervise the process running the container of a session. May be
+        called from any thread.
+        """
+        self.forget(session_id)
+        token = object()
+        self.watches[session_id] = token
+        self.started[session_id] = time.monotonic()
+
+        try:
+            fd = os.pidfd_open(pid)
+        except (AttributeError, OSError, TypeError) as e:
+            logging.warning(f"Cannot watch session {session_id} (pid {pid}): {e}")
+            return
+
+        def on_exit(fd, condition):
+            os.close(fd)
+            try:
+                os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                # Reattached containers are not our children
+                pass
+            if self.watches.get(session_id) is token:
+                self.failed(session_id, "container exited")
+            return False
+        GLib.io_add_watch(fd, GLib.PRIORITY_DEFAULT, GLib.IO_IN, on_exit)
+
+        if check_boot:
+            cfg = tools.config.load(self.manager.args)
+            GLib.timeout_add_seconds(int(cfg["waydroid"]["boot_timeout"]),
+                                     self.check_boot, session_id, token)
+
+    def check_boot(self, session_id, token):
+        """
+        Runs boot_timeout seconds after the start, the session readiness
+        tracker knows whether Android has finished booting by then.
+        """
+        if self.watches.get(session_id) is token and self.manager.readiness.waiting(session_id):
+            cfg = tools.config.load(self.manager.args)
+            self.failed(session_id, "Android did not finish booting within {} seconds".format(
+                cfg["waydroid"]["boot_timeout"]))
+        return False
+
+    def forget(self, session_id):
+        """
+        Stop supervising a session, e.g. because it is stopped on purpose.
+        """
+        self.watches.pop(session_id, None)
+
+    def failed(self, session_id, reason):
+        self.forget(session_id)
+        self.manager.readiness.forget(session_id)
+        session = self.manager.sessions.get(session_id)
+        if session is None:
+            return
+        logging.error(f"Session {session_id} failed: {reason}")
+        helpers.metrics.inc("waydroid_session_failures_total")
+        tools.actions.container_manager.stop(self.manager.session_args(session_id), False)
+
+        if time.monotonic() - self.started.get(session_id, 0) > STABLE_SECONDS:
+            self.failures[session_id] = 0
+        failures = self.failures.get(session_id, 0) + 1
+        self.failures[session_id] = failures
+
+        cfg = tools.config.load(self.manager.args)
+        if failures > int(cfg["waydroid"]["restart_limit"]):
+            logging.error(f"Giving up on session {session_id} after {failures - 1} restarts")
+            self.manager.drop_session(session_id)
+            self.failures.pop(session_id, None)
+            self.manager.SessionFailed(session_id, reason, "stopped")
+            return
+
+        delay = min(MAX_BACKOFF, int(cfg["waydroid"]["restart_backoff"]) * 2 ** (failures - 1))
+        logging.info(f"Restarting session {session_id} in {delay} seconds")
+        self.manager.SessionFailed(session_id, reason, "restarting")
+        GLib.timeout_add_seconds(delay, self.restart, session_id, session)
+
+    def restart(self, session_id, session):
+        if self.manager.sessions.get(session_id) is not session:
+            # Stopped or replaced in the meantime
+            return False
+
+        args = self.manager.session_args(session_id)
+        self.manager.run_async([session_id],
+                               lambda: self.manager.start_session(args, session),
+                               lambda result: self.manager.save_sessions(),
+                               lambda *result: None,
+                               lambda e: self.failed(session_id, f"restart failed: {e}"))
+        return False
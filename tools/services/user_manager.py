@@ -4,6 +4,8 @@ import logging
 import os
 import threading
 import tools.config
+import tools.helpers.ephemeral
+import tools.helpers.ipc
 import tools.helpers.net
 from tools.interfaces import IUserMonitor
 from tools.interfaces import IPlatform
@@ -11,7 +13,7 @@ from tools.interfaces import IPlatform
 stopping = False
 
 def start(args, session, unlocked_cb=None):
-    waydroid_data = session["waydroid_data"]
+    waydroid_data = tools.helpers.ephemeral.host_data(args, session)
     apps_dir = session["xdg_data_home"] + "/applications/"
 
     def makeDesktopFile(appInfo):
@@ -70,6 +72,7 @@ NoDisplay={str(hide).lower()}
     def userUnlocked(uid):
         cfg = tools.config.load(args)
         logging.info("Android with user {} is ready".format(uid))
+        tools.helpers.ipc.notify_activity(args.session_id)
 
         if cfg["waydroid"]["auto_adb"] == "True":
             tools.helpers.net.adb_connect(args)
@@ -87,6 +90,7 @@ NoDisplay={str(hide).lower()}
             unlocked_cb()
 
     def packageStateChanged(mode, packageName, uid):
+        tools.helpers.ipc.notify_activity(args.session_id)
         platformService = IPlatform.get_service(args)
         if platformService:
             appInfo = platformService.getAppInfo(packageName)